@@ -0,0 +1,224 @@
+# This file contains near-duplicate filtering of generated MWO sentences with MinHash / LSH
+
+import os
+import re
+import csv
+import json
+import time
+import zlib
+import argparse
+import numpy as np
+
+# Words ignored when comparing sentences ("pump seal leaking" and "pump seal is leaking" are duplicates)
+STOP_WORDS = {'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'has', 'have', 'had',
+              'in', 'on', 'at', 'of', 'for', 'to', 'with', 'and', 'or', 'from', 'by', 'it', 'its'}
+
+# Rows of the signature matrix are computed in chunks of this many shingles to bound memory
+CHUNK_SHINGLES = 1 << 18
+
+# Buckets larger than this are linked as a star and a chain instead of comparing all pairs
+MAX_BUCKET_PAIRS = 50
+
+# Expected share of pairs at the similarity threshold that LSH must find as candidates
+LSH_RECALL = 0.99
+
+# Function to read generated sentences from a csv file
+def read_sentences(filepath):
+    """ Read rows (sentence, object type, object name, event name) of a generated sentence csv file """
+    with open(filepath, encoding='utf-8') as f:
+        return [row for row in csv.reader(f) if row]
+
+# Function to get the shingles of a sentence
+def get_shingles(sentence, shingle_size=1):
+    """ Return the set of word n-grams (n = shingle_size) of a sentence without stop words """
+    tokens = [token for token in re.findall(r"[a-z0-9]+", sentence.lower()) if token not in STOP_WORDS]
+    if len(tokens) < shingle_size:
+        return {" ".join(tokens) or sentence.lower().strip()}
+    return {" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)}
+
+# Function to create the MinHash permutations
+def get_permutations(num_perm=64, seed=13):
+    """ Return multipliers (odd) and offsets of num_perm multiply-shift hash functions """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    return multipliers, offsets
+
+# Function to compute the MinHash signatures of shingle sets
+def minhash_signatures(shingle_sets, num_perm=64, seed=13):
+    """ Return a (len(shingle_sets), num_perm) array of MinHash signatures. Shingles are hashed
+        once (crc32) and the permutations of all shingles in a chunk are applied with NumPy. """
+    multipliers, offsets = get_permutations(num_perm, seed)
+    shingle_hashes = {}
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+    start = 0
+    while start < len(shingle_sets):
+        # Take sets until the chunk holds CHUNK_SHINGLES shingles
+        end, num_shingles = start, 0
+        while end < len(shingle_sets) and (end == start or num_shingles + len(shingle_sets[end]) <= CHUNK_SHINGLES):
+            num_shingles += len(shingle_sets[end])
+            end += 1
+        values, bounds = [], []
+        for shingles in shingle_sets[start:end]:
+            bounds.append(len(values))
+            for shingle in shingles:
+                value = shingle_hashes.get(shingle)
+                if value is None:
+                    value = shingle_hashes[shingle] = zlib.crc32(shingle.encode("utf-8"))
+                values.append(value)
+        values = np.array(values, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            hashed = (values[:, None] * multipliers[None, :] + offsets[None, :]) >> np.uint64(32)
+        signatures[start:end] = np.minimum.reduceat(hashed, np.array(bounds), axis=0)
+        start = end
+    return signatures
+
+# Function to compute the probability that a pair becomes an LSH candidate
+def lsh_recall(similarity, bands, rows):
+    """ Probability that a pair with Jaccard similarity similarity shares a bucket in at least one band """
+    return 1 - (1 - similarity ** rows) ** bands
+
+# Function to choose the LSH bands for a similarity threshold
+def choose_bands(threshold, num_perm=64, recall=LSH_RECALL):
+    """ Return (bands, rows) with bands * rows <= num_perm with the most rows (fewest candidates) whose
+        expected recall of pairs at the threshold is at least recall. The midpoint of the S-curve,
+        (1 / bands) ** (1 / rows), then lies well below the threshold; with too few permutations the
+        option with the highest recall is returned. """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1)]
+    good = [option for option in options if lsh_recall(threshold, *option) >= recall]
+    if not good:
+        return max(options, key=lambda option: lsh_recall(threshold, *option))
+    return max(good, key=lambda option: option[1])
+
+# Function to find candidate pairs with LSH
+def lsh_candidates(signatures, scopes, bands, rows):
+    """ Return candidate pairs of items sharing a bucket in any band. Items only share buckets
+        within the same scope. Bucket keys are hashed with NumPy and grouped by sorting. """
+    rng = np.random.default_rng(7)
+    mixers = rng.integers(1, 1 << 63, size=rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    scopes = np.asarray(scopes, dtype=np.uint64)
+    pairs = set()
+    for band in range(bands):
+        with np.errstate(over="ignore"):
+            keys = (signatures[:, band * rows:(band + 1) * rows] * mixers).sum(axis=1, dtype=np.uint64)
+            keys = keys ^ (scopes * np.uint64(0x9E3779B97F4A7C15)) ^ np.uint64(band)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = order[start:start + size].tolist()
+            if size <= MAX_BUCKET_PAIRS:
+                pairs.update((a, b) for i, a in enumerate(members) for b in members[i + 1:])
+            else:
+                pairs.update((members[0], b) for b in members[1:])
+                pairs.update(zip(members[1:], members[2:]))
+    return pairs
+
+# Function to cluster near-duplicate sentences
+def cluster_sentences(sentences, scopes=None, threshold=0.8, shingle_size=1, num_perm=64,
+                      embed_threshold=None):
+    """ Cluster sentences whose shingle sets have Jaccard similarity >= threshold (found with
+        MinHash / LSH, then checked exactly). With embed_threshold, pairs must also have embedding
+        cosine similarity >= embed_threshold. Sentences are only clustered within the same scope.
+        Returns a cluster id (index of the first sentence of its cluster) for each sentence. """
+    scopes = scopes if scopes is not None else [0] * len(sentences)
+
+    # Sentences with the same shingles in the same scope are exact duplicates, so each is hashed once
+    unique, items = {}, []
+    for sentence, scope in zip(sentences, scopes):
+        shingles = frozenset(get_shingles(sentence, shingle_size))
+        items.append(unique.setdefault((scope, shingles), len(unique)))
+    keys = list(unique)
+    shingle_sets = [shingles for _, shingles in keys]
+
+    bands, rows = choose_bands(threshold, num_perm)
+    signatures = minhash_signatures(shingle_sets, bands * rows)
+    scope_ids = {}
+    scope_index = [scope_ids.setdefault(scope, len(scope_ids)) for scope, _ in keys]
+    candidates = [(a, b) for a, b in lsh_candidates(signatures, scope_index, bands, rows)
+                  if len(shingle_sets[a] & shingle_sets[b]) >= threshold * len(shingle_sets[a] | shingle_sets[b])]
+
+    if embed_threshold is not None and candidates:
+        # Encode the sentences of all candidate pairs in one batch and score the pairs at once
+        from embeddings import encode
+
+        first_sentence = {}
+        for sentence, item in zip(sentences, items):
+            first_sentence.setdefault(item, sentence)
+        texts = sorted({item for pair in candidates for item in pair})
+        position = {item: i for i, item in enumerate(texts)}
+        vectors = encode([first_sentence[item] for item in texts])
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        left = vectors[[position[a] for a, _ in candidates]]
+        right = vectors[[position[b] for _, b in candidates]]
+        similarity = (left * right).sum(axis=1)
+        candidates = [pair for pair, score in zip(candidates, similarity) if score >= embed_threshold]
+
+    # Leader clustering in sentence order: a sentence joins the cluster of its first similar leader,
+    # so every removed sentence is similar to the kept one (no chaining through intermediate sentences)
+    neighbours = {}
+    for a, b in candidates:
+        neighbours.setdefault(max(a, b), []).append(min(a, b))
+    leader = list(range(len(keys)))
+    for item in range(len(keys)):
+        leaders = [other for other in neighbours.get(item, []) if leader[other] == other]
+        if leaders:
+            leader[item] = min(leaders)
+
+    # Name each cluster after its first sentence
+    first = {}
+    return [first.setdefault(leader[item], i) for i, item in enumerate(items)]
+
+# Function to remove near-duplicate rows of generated sentences
+def dedup_rows(rows, scope="global", threshold=0.8, shingle_size=1, num_perm=64, embed_threshold=None):
+    """ Return (kept rows, clusters) where clusters maps the index of each kept row with
+        near-duplicates to the indexes of the rows removed for it. scope "path" only compares
+        sentences of the same object and event, "global" compares all sentences. """
+    scopes = [(row[2], row[3]) if scope == "path" else 0 for row in rows]
+    cluster_ids = cluster_sentences([row[0] for row in rows], scopes, threshold, shingle_size,
+                                    num_perm, embed_threshold)
+    kept, clusters = [], {}
+    for i, (row, cluster_id) in enumerate(zip(rows, cluster_ids)):
+        if cluster_id == i:
+            kept.append(row)
+        else:
+            clusters.setdefault(cluster_id, []).append(i)
+    return kept, clusters
+
+# Function to write the clusters of removed near-duplicates
+def save_clusters(rows, clusters, filepath):
+    """ Write clusters (largest first) as json lines of the kept sentence and its removed duplicates """
+    with open(filepath, "w", encoding='utf-8') as f:
+        for kept, removed in sorted(clusters.items(), key=lambda item: (-len(item[1]), item[0])):
+            f.write(json.dumps({"kept": rows[kept][0], "object_name": rows[kept][2], "event_name": rows[kept][3],
+                                "removed": [rows[i][0] for i in removed]}) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove near-duplicate generated MWO sentences")
+    parser.add_argument("infiles", nargs="*", default=["mwo_sentences/order_synthetic.csv", "mwo_sentences/synthetic.csv"])
+    parser.add_argument("--scope", choices=["path", "global"], default="global",
+                        help="compare sentences of the same path only, or all sentences")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Jaccard similarity of shingle sets")
+    parser.add_argument("--shingle-size", type=int, default=1, help="words per shingle")
+    parser.add_argument("--num-perm", type=int, default=64, help="MinHash permutations")
+    parser.add_argument("--embed-threshold", type=float, help="also require embedding cosine similarity (embeddings.py)")
+    parser.add_argument("--suffix", default="_dedup", help="suffix of the deduplicated csv and clusters files")
+    args = parser.parse_args()
+
+    bands, rows = choose_bands(args.threshold, args.num_perm)
+    print(f"LSH with {bands} bands of {rows} rows: expected recall {lsh_recall(args.threshold, bands, rows):.2%} "
+          f"of pairs at similarity {args.threshold}, 50% at {(1 / bands) ** (1 / rows):.2f}")
+    for infile in args.infiles:
+        start = time.perf_counter()
+        rows = read_sentences(infile)
+        kept, clusters = dedup_rows(rows, args.scope, args.threshold, args.shingle_size,
+                                    args.num_perm, args.embed_threshold)
+        base, ext = os.path.splitext(infile)
+        with open(f"{base}{args.suffix}{ext}", "w", encoding='utf-8', newline='') as f:
+            csv.writer(f, lineterminator="\n").writerows(kept)
+        save_clusters(rows, clusters, f"{base}{args.suffix}_clusters.jsonl")
+        print(f"{infile}: kept {len(kept)} of {len(rows)} sentences, {len(rows) - len(kept)} near-duplicates "
+              f"in {len(clusters)} clusters ({time.perf_counter() - start:.1f}s)")
+        for kept_index, removed in sorted(clusters.items(), key=lambda item: -len(item[1]))[:5]:
+            print(f"  {len(removed) + 1}x {rows[kept_index][0]} ~ {rows[removed[0]][0]}")
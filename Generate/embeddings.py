@@ -0,0 +1,117 @@
+# This file contains a process-wide sentence embedding service with an on-disk embedding cache
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+# Embedding settings (overridable with EMBEDDING_MODEL and EMBEDDING_CACHE_PATH)
+EMBEDDINGS = {
+    "model": os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-MiniLM-L6-v2"),
+    "path": os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache.db")),
+    "batch_size": 64
+}
+EMBEDDING_STATS = {"hits": 0, "misses": 0, "load_time": 0.0, "encode_time": 0.0}
+EMBEDDING_STATE = {"encoder": None, "name": None, "conn": None}
+EMBEDDING_LOCK = threading.Lock()
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS embeddings (
+        key TEXT PRIMARY KEY,
+        dim INTEGER NOT NULL,
+        vector BLOB NOT NULL
+    );
+"""
+
+# Function to replace the embedding model
+def set_encoder(encoder, name):
+    """ Use encoder(texts) -> array of shape (len(texts), dim) instead of the sentence transformer
+        (e.g. a small deterministic encoder in tests). name keeps its embeddings apart in the cache. """
+    with EMBEDDING_LOCK:
+        EMBEDDING_STATE["encoder"] = encoder
+        EMBEDDING_STATE["name"] = name
+
+# Function to set the embedding cache location
+def configure_embeddings(path=None, batch_size=None):
+    """ Change cache location or encode batch size """
+    with EMBEDDING_LOCK:
+        if path is not None and path != EMBEDDINGS["path"]:
+            EMBEDDINGS["path"] = path
+            EMBEDDING_STATE["conn"] = None
+        if batch_size is not None:
+            EMBEDDINGS["batch_size"] = batch_size
+
+# Function to load the embedding model
+def get_encoder():
+    """ Load the sentence transformer once per process (unless an encoder was set) """
+    if EMBEDDING_STATE["encoder"] is None:
+        from sentence_transformers import SentenceTransformer
+
+        start = time.perf_counter()
+        model = SentenceTransformer(EMBEDDINGS["model"])
+        EMBEDDING_STATS["load_time"] += time.perf_counter() - start
+        EMBEDDING_STATE["encoder"] = lambda texts: model.encode(texts, batch_size=EMBEDDINGS["batch_size"],
+                                                                convert_to_numpy=True)
+        EMBEDDING_STATE["name"] = EMBEDDINGS["model"]
+    return EMBEDDING_STATE["encoder"]
+
+# Function to open the embedding cache database
+def get_cache_conn():
+    """ Open embedding cache database once per process """
+    if EMBEDDING_STATE["conn"] is None:
+        conn = sqlite3.connect(EMBEDDINGS["path"], timeout=30, check_same_thread=False)
+        conn.executescript(SCHEMA)
+        EMBEDDING_STATE["conn"] = conn
+    return EMBEDDING_STATE["conn"]
+
+# Function to create the cache key of a text
+def text_key(name, text):
+    """ Hash embedding model name and text """
+    return hashlib.sha256(f"{name}\n{text}".encode("utf-8")).hexdigest()
+
+# Function to embed texts
+def encode(texts):
+    """ Return float32 embeddings of texts as an array of shape (len(texts), dim).
+        Cached embeddings are read from disk and the rest are encoded in one batch. """
+    if isinstance(texts, str):
+        texts = [texts]
+    with EMBEDDING_LOCK:
+        encoder = get_encoder()
+        name = EMBEDDING_STATE["name"]
+        conn = get_cache_conn()
+        keys = {text: text_key(name, text) for text in texts}
+        vectors = {}
+        for text, key in keys.items():
+            row = conn.execute("SELECT dim, vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vectors[text] = np.frombuffer(row[1], dtype=np.float32).reshape(row[0])
+        missing = [text for text in keys if text not in vectors]
+        EMBEDDING_STATS["hits"] += len(keys) - len(missing)
+        EMBEDDING_STATS["misses"] += len(missing)
+        if missing:
+            start = time.perf_counter()
+            embeddings = np.asarray(encoder(missing), dtype=np.float32)
+            EMBEDDING_STATS["encode_time"] += time.perf_counter() - start
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                                 [(keys[text], embedding.shape[0], embedding.tobytes())
+                                  for text, embedding in zip(missing, embeddings)])
+            vectors.update(zip(missing, embeddings))
+    return np.stack([vectors[text] for text in texts]) if texts else np.zeros((0, 0), dtype=np.float32)
+
+# Function to score texts against a query by cosine similarity
+def cosine_similarity(query, embeddings):
+    """ Cosine similarity of a query vector with each row of embeddings """
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+    return embeddings @ query / np.maximum(norms, 1e-12)
+
+# Function to report embedding cache and model load statistics
+def embedding_stats(since=None):
+    """ Return a one-line summary of model load time and cache hits, counted from
+        the since snapshot (a copy of EMBEDDING_STATS) if given """
+    stats = {name: value - (since or {}).get(name, 0) for name, value in EMBEDDING_STATS.items()}
+    total = stats["hits"] + stats["misses"]
+    return (f"embedding model load {stats['load_time']:.2f}s, encoding {stats['encode_time']:.2f}s, "
+            f"{stats['hits']}/{total} embeddings cached")
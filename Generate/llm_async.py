@@ -0,0 +1,200 @@
+# This file contains an asyncio engine for generating MWO sentences for many paths concurrently
+
+import os
+import csv
+import time
+import asyncio
+import argparse
+from openai import OpenAI, AsyncOpenAI
+from dotenv import load_dotenv
+
+from llm_generate import get_generate_prompt, get_generate_fewshot, process_mwo_response
+from path_store import open_path_store, sample_paths
+from llm_calls import begin_request, finish_request, configure_cache, record_call, record_sentences, is_retryable, get_retry_delay
+from run_manifest import open_run, pending_paths, add_result, commit_shard, merge_run
+
+# Rough token estimate of a request (prompt characters per token, completion tokens reserved)
+CHARS_PER_TOKEN = 4
+COMPLETION_TOKENS = 100
+
+# Function to create a token bucket
+def new_bucket(per_minute):
+    """ Create token bucket refilled at per_minute units per minute, holding at most one minute """
+    return {"capacity": per_minute, "tokens": per_minute, "rate": per_minute / 60, "updated": time.monotonic()}
+
+# Function to take units from a token bucket
+async def bucket_acquire(bucket, amount):
+    """ Wait until the bucket holds amount units and take them """
+    amount = min(amount, bucket["capacity"])
+    while True:
+        now = time.monotonic()
+        bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        if bucket["tokens"] >= amount:
+            bucket["tokens"] -= amount
+            return
+        await asyncio.sleep((amount - bucket["tokens"]) / bucket["rate"])
+
+# Function to create the limits shared by all requests
+def new_limits(concurrency=8, rpm=500, tpm=200000, max_retries=6, base_delay=1.0, max_delay=60.0):
+    """ Create concurrency, requests-per-minute and tokens-per-minute limits and retry settings """
+    return {
+        "semaphore": asyncio.Semaphore(concurrency),
+        "requests": new_bucket(rpm),
+        "tokens": new_bucket(tpm),
+        "max_retries": max_retries,
+        "base_delay": base_delay,
+        "max_delay": max_delay,
+        "stats": {"requests": 0, "retries": 0, "tokens": 0}
+    }
+
+# Function to estimate the tokens of a request
+def estimate_tokens(messages):
+    """ Estimate prompt and completion tokens of a chat request """
+    return sum(len(message["content"]) for message in messages) // CHARS_PER_TOKEN + COMPLETION_TOKENS
+
+# Function to make a rate-limited chat completion
+async def limited_completion(client, limits, messages, model="gpt-4o-mini", stage="generate", fewshot=0, **kwargs):
+    """ Make a chat completion within the concurrency and rate limits, retrying with backoff.
+        Cached responses (llm_calls.py) are returned without taking from the rate limits. """
+    call_start = time.perf_counter()
+    key, response = begin_request(model, messages, kwargs)
+    if response is not None:
+        record_call(stage, model, messages, response, time.perf_counter() - call_start, True, fewshot=fewshot)
+        return response
+    estimate = estimate_tokens(messages)
+    for attempt in range(limits["max_retries"] + 1):
+        await bucket_acquire(limits["requests"], 1)
+        await bucket_acquire(limits["tokens"], estimate)
+        async with limits["semaphore"]:
+            try:
+                start = time.perf_counter()
+                response = await client.chat.completions.create(model=model, messages=messages, **kwargs)
+            except Exception as error:
+                if attempt == limits["max_retries"] or not is_retryable(error):
+                    raise
+                limits["stats"]["retries"] += 1
+                delay = get_retry_delay(error, attempt, limits)
+            else:
+                finish_request(key, response, time.perf_counter() - start)
+                record_call(stage, model, messages, response, time.perf_counter() - call_start, False,
+                            retries=attempt, fewshot=fewshot)
+                limits["stats"]["requests"] += 1
+                usage = getattr(response, "usage", None)
+                if usage is not None:
+                    # Correct the token bucket with the actual usage of the request
+                    limits["stats"]["tokens"] += usage.total_tokens
+                    limits["tokens"]["tokens"] -= usage.total_tokens - estimate
+                return response
+        await asyncio.sleep(delay)
+
+# Function to generate MWO sentences for a path
+async def generate_mwo_async(client, limits, message, num_completions=1, model="gpt-4o-mini", fewshot=0):
+    """ Generate MWO sentences for the message of a path (num_completions > 1 as in generate_diverse_mwo) """
+    stage = "generate_diverse" if num_completions > 1 else "generate"
+    responses = await asyncio.gather(*[
+        limited_completion(client, limits, message, model=model, stage=stage, fewshot=fewshot,
+                           temperature=0.9, top_p=0.9, n=1)
+        for _ in range(num_completions)
+    ])
+    sentences = []
+    for response in responses:
+        response_sentences = process_mwo_response(response.choices[0].message.content)
+        record_sentences(response, len(response_sentences))
+        sentences.extend(response_sentences)
+    if num_completions > 1:
+        sentences = list(set(sentences)) # Remove duplicates
+    return sentences
+
+# Function to generate MWO sentences for many paths concurrently
+async def generate_all(client, prompt_variations, paths, on_result, limits, num_completions=1,
+                       model="gpt-4o-mini", report_every=50):
+    """ Generate MWO sentences for all paths and call on_result(path, sentences) in path order
+        as soon as each path and all paths before it are done. Returns throughput statistics. """
+    # Prompts are drawn in path order first, so random prompt variations do not depend on timing
+    messages = []
+    for path in paths:
+        prompt = get_generate_prompt(prompt_variations, path['object_name'], path['event_name'])
+        fewshot = get_generate_fewshot(prompt_variations)
+        messages.append((list(fewshot) + [{"role": "user", "content": prompt}], len(fewshot)))
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(generate_mwo_async(client, limits, message, num_completions, model, fewshot))
+             for message, fewshot in messages]
+    for i, (path, task) in enumerate(zip(paths, tasks)):
+        sentences = await task
+        on_result(path, sentences)
+        if report_every and (i + 1) % report_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"{i + 1}/{len(paths)} paths, {60 * (i + 1) / elapsed:.1f} paths/min")
+
+    elapsed = time.perf_counter() - start
+    stats = dict(limits["stats"], paths=len(paths), seconds=elapsed,
+                 paths_per_minute=60 * len(paths) / elapsed if elapsed else 0.0)
+    print(f"Generated {len(paths)} paths in {elapsed:.1f}s ({stats['paths_per_minute']:.1f} paths/min, "
+          f"{stats['requests']} requests, {stats['retries']} retries, {stats['tokens']} tokens)")
+    return stats
+
+if __name__ == "__main__":
+    from llm_prompt import initialise_prompts
+
+    parser = argparse.ArgumentParser(description="Generate MWO sentences for sampled paths concurrently")
+    parser.add_argument("--num-samples", type=int, default=1, help="paths sampled per path type")
+    parser.add_argument("--paths", help="csv file of object_name,object_type,event_name to generate instead")
+    parser.add_argument("--diverse", action="store_true", help="5 completions per path (generate_diverse_mwo)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=500, help="requests per minute")
+    parser.add_argument("--tpm", type=int, default=200000, help="tokens per minute")
+    parser.add_argument("--max-retries", type=int, default=6)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--base-url", help="OpenAI-compatible server, e.g. http://127.0.0.1:8000/v1 (stub_server.py)")
+    parser.add_argument("--cache", choices=["on", "replay", "refresh", "off"], default=None,
+                        help="LLM cache mode (replay runs offline from cached responses)")
+    parser.add_argument("--run-dir", help="directory of the run manifest and shards (default: mwo_sentences/runs/<time>)")
+    parser.add_argument("--resume", action="store_true", help="continue the run in --run-dir, skipping completed paths")
+    parser.add_argument("--shard-size", type=int, default=50, help="paths per committed shard")
+    parser.add_argument("--out-log", default="mwo_sentences/log.txt")
+    parser.add_argument("--out-csv", default="mwo_sentences/order_synthetic.csv")
+    args = parser.parse_args()
+
+    # Set OpenAI API key
+    load_dotenv()
+    configure_cache(mode=args.cache)
+    api_key = os.getenv("API_KEY") or "stub"
+    client = OpenAI(api_key=api_key, base_url=args.base_url, max_retries=0) # Retries are made (and counted) by chat_completion
+    async_client = AsyncOpenAI(api_key=api_key, base_url=args.base_url, max_retries=0)
+
+    # Paths to generate: saved with the run when it starts, so a resumed run uses the same paths
+    if args.resume:
+        if not args.run_dir:
+            parser.error("--resume needs --run-dir")
+        run = open_run(args.run_dir, resume=True)
+    else:
+        if args.paths:
+            with open(args.paths, encoding='utf-8') as f:
+                paths = list(csv.DictReader(f, fieldnames=["object_name", "object_type", "event_name"]))
+        else:
+            paths = sample_paths(open_path_store(), num_samples=args.num_samples, valid=True)
+        run_dir = args.run_dir or os.path.join("mwo_sentences", "runs", time.strftime("%Y%m%d-%H%M%S"))
+        run = open_run(run_dir, paths, settings={"model": args.model, "diverse": args.diverse})
+    paths = pending_paths(run)
+    print(f"Run '{run['dir']}': {len(paths)} of {len(run['paths'])} paths to generate")
+
+    # Initialise base prompts and instructions
+    prompt_variations = initialise_prompts(client, num_variants=5, num_examples=5)
+
+    # Function to record the sentences of a finished path in the run
+    def on_result(path, sentences):
+        print(f"{path['object_name']} {path['event_name']} - {len(sentences)} sentences")
+        add_result(run, path, sentences, args.shard_size)
+
+    async def main():
+        limits = new_limits(args.concurrency, args.rpm, args.tpm, args.max_retries)
+        await generate_all(async_client, prompt_variations, paths, on_result,
+                           limits, num_completions=5 if args.diverse else 1, model=args.model)
+    try:
+        asyncio.run(main())
+    finally:
+        # Results already passed to on_result are complete, so keep them even if the run aborts
+        commit_shard(run)
+    merge_run(run, args.out_log, args.out_csv)
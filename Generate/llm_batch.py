@@ -0,0 +1,231 @@
+# This file contains the offline batch mode of generation: compile paths into a batch request file and ingest its results
+
+import os
+import json
+import time
+import argparse
+from openai import OpenAI
+from dotenv import load_dotenv
+
+from llm_generate import get_generate_prompt, get_generate_fewshot, process_mwo_response
+from path_store import open_path_store, sample_paths
+from run_manifest import path_key, atomic_write, save_manifest, open_run, pending_paths, add_result, commit_shard, merge_run
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+PROMPTS_FILE = "prompts.json"
+
+# Function to create the custom id of a request
+def request_id(path, completion):
+    """ Stable custom id of completion number completion of a path """
+    return f"{path_key(path)}-{completion}"
+
+# Function to read prompt variations from a json file
+def load_prompts(filepath):
+    """ Read prompt variations (base prompts, word limits, count limits) saved by save_prompts """
+    with open(filepath, encoding='utf-8') as f:
+        base_prompts, limit_words, limit_count = json.load(f)
+    return (base_prompts, limit_words, limit_count)
+
+# Function to save prompt variations to a json file
+def save_prompts(filepath, prompt_variations):
+    """ Save prompt variations as a json list of three lists """
+    atomic_write(filepath, json.dumps([list(variants) for variants in prompt_variations], indent=4))
+
+# Function to get the prompt variations of a run
+def get_run_prompts(run, client=None, prompts_file=None):
+    """ Return the prompt variations of the run. They are initialised once (paraphrased through
+        the API) and saved in the run directory, so resumed and offline compiles reuse them.
+        prompts_file replaces them with variations saved earlier, e.g. by another run. """
+    run_file = os.path.join(run["dir"], PROMPTS_FILE)
+    if prompts_file:
+        prompt_variations = load_prompts(prompts_file)
+    elif os.path.exists(run_file):
+        return load_prompts(run_file)
+    else:
+        from llm_prompt import initialise_prompts
+
+        # Initialise base prompts and instructions
+        prompt_variations = initialise_prompts(client, num_variants=5, num_examples=5)
+    save_prompts(run_file, prompt_variations)
+    return prompt_variations
+
+# Function to compile paths into batch requests
+def compile_requests(prompt_variations, paths, num_completions=1, model="gpt-4o-mini"):
+    """ Return one batch request per completion of each path, with the same messages and
+        sampling parameters as generate_mwo (num_completions > 1 as in generate_diverse_mwo) """
+    requests = []
+    for path in paths:
+        prompt = get_generate_prompt(prompt_variations, path['object_name'], path['event_name'])
+        fewshot = get_generate_fewshot(prompt_variations)
+        message = list(fewshot) + [{"role": "user", "content": prompt}]
+        for completion in range(num_completions):
+            requests.append({
+                "custom_id": request_id(path, completion),
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {"model": model, "messages": message, "temperature": 0.9, "top_p": 0.9, "n": 1}
+            })
+    return requests
+
+# Function to write the batch request file of the pending paths of a run
+def compile_batch(run, prompt_variations, num_completions=1, model="gpt-4o-mini"):
+    """ Write the pending paths of the run to the next batch request file and record it in the manifest """
+    batches = run["manifest"].setdefault("batches", [])
+    paths, seen = [], set()
+    for path in pending_paths(run):
+        # Paths with the same key are one path of the run (see run_manifest.path_key)
+        if path_key(path) not in seen:
+            seen.add(path_key(path))
+            paths.append(path)
+    requests = compile_requests(prompt_variations, paths, num_completions, model)
+    filename = f"batch-{len(batches):05d}.jsonl"
+    atomic_write(os.path.join(run["dir"], filename), "".join(json.dumps(request) + "\n" for request in requests))
+    batches.append({"file": filename, "num_paths": len(paths), "num_requests": len(requests),
+                    "num_completions": num_completions, "model": model, "id": None, "results": None})
+    save_manifest(run)
+    print(f"Compiled {len(requests)} requests for {len(paths)} paths into {os.path.join(run['dir'], filename)}")
+    return filename
+
+# Function to read a batch results file
+def read_results(results_file):
+    """ Return {custom_id: response content} of successful results and {custom_id: error} of failed ones """
+    contents, errors = {}, {}
+    with open(results_file, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                errors[result["custom_id"]] = result.get("error") or response.get("body")
+                continue
+            contents[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return contents, errors
+
+# Function to join batch results back to the paths of a run
+def ingest_results(run, results_file, num_completions=1, shard_size=50):
+    """ Parse the results of a batch with process_mwo_response and add the sentences of each
+        pending path whose completions all succeeded to the run. Paths with failed or missing
+        completions stay pending, so they can be compiled into another batch. """
+    contents, errors = read_results(results_file)
+    num_paths = 0
+    for path in pending_paths(run):
+        ids = [request_id(path, completion) for completion in range(num_completions)]
+        if path_key(path) in run["completed"] or not all(id in contents for id in ids):
+            continue
+        sentences = []
+        for id in ids:
+            sentences.extend(process_mwo_response(contents[id]))
+        if num_completions > 1:
+            sentences = list(set(sentences)) # Remove duplicates
+        add_result(run, path, sentences, shard_size)
+        run["completed"].add(path_key(path))
+        num_paths += 1
+    commit_shard(run)
+    print(f"Ingested {num_paths} paths from {results_file} ({len(errors)} failed requests, "
+          f"{len(pending_paths(run))} paths pending)")
+    return num_paths, errors
+
+# Function to answer a batch request file locally
+def simulate_batch(batch_file, results_file):
+    """ Write a results file in the batch output format with stub_server.py completions,
+        so the whole batch round trip can be run without the API """
+    from stub_server import stub_completion
+
+    lines = []
+    with open(batch_file, encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            request = json.loads(line)
+            body = request["body"]
+            choices = [{"index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": stub_completion(body["messages"])}}]
+            response = {"id": f"chatcmpl-stub-{i:08x}", "object": "chat.completion", "created": int(time.time()),
+                        "model": body["model"], "choices": choices}
+            lines.append({"id": f"batch_req_{i:08x}", "custom_id": request["custom_id"],
+                          "response": {"status_code": 200, "request_id": f"req_{i:08x}", "body": response},
+                          "error": None})
+    atomic_write(results_file, "".join(json.dumps(line) + "\n" for line in lines))
+
+# Function to submit the latest batch request file of a run
+def submit_batch(client, run):
+    """ Upload the latest batch request file and create a batch job """
+    batch = run["manifest"]["batches"][-1]
+    with open(os.path.join(run["dir"], batch["file"]), "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    job = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    batch["id"] = job.id
+    save_manifest(run)
+    print(f"Submitted {batch['file']} as batch {job.id}")
+    return job.id
+
+# Function to download the results of the latest batch of a run
+def fetch_batch(client, run):
+    """ Download the output file of the latest batch once it is completed; returns the results file or None """
+    batch = run["manifest"]["batches"][-1]
+    job = client.batches.retrieve(batch["id"])
+    print(f"Batch {job.id}: {job.status} {job.request_counts}")
+    if job.status not in ("completed", "expired", "cancelled") or not job.output_file_id:
+        return None
+    results_file = os.path.join(run["dir"], batch["file"].replace(".jsonl", ".results.jsonl"))
+    atomic_write(results_file, client.files.content(job.output_file_id).read())
+    batch["results"] = os.path.basename(results_file)
+    save_manifest(run)
+    return results_file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate MWO sentences through batch request files")
+    parser.add_argument("command", choices=["compile", "submit", "fetch", "simulate", "ingest"],
+                        help="compile pending paths into a request file, submit it, fetch its results, "
+                             "simulate results locally (stub_server.py) or ingest results into the run")
+    parser.add_argument("--run-dir", help="run directory (compile creates mwo_sentences/runs/<time> if not given)")
+    parser.add_argument("--resume", action="store_true", help="compile the pending paths of the run in --run-dir")
+    parser.add_argument("--num-samples", type=int, default=1, help="paths sampled per path type")
+    parser.add_argument("--diverse", action="store_true", help="5 completions per path (generate_diverse_mwo)")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--prompts", help=f"prompt variations json to compile with (default: {PROMPTS_FILE} "
+                                          "of the run, initialised through the API on the first compile)")
+    parser.add_argument("--results", help="results file to ingest (default: results of the latest batch)")
+    parser.add_argument("--shard-size", type=int, default=50, help="paths per committed shard")
+    parser.add_argument("--out-log", default="mwo_sentences/log.txt")
+    parser.add_argument("--out-csv", default="mwo_sentences/order_synthetic.csv")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = OpenAI(api_key=os.getenv("API_KEY") or "stub")
+
+    if args.command == "compile" and not args.resume:
+        paths = sample_paths(open_path_store(), num_samples=args.num_samples, valid=True)
+        run_dir = args.run_dir or os.path.join("mwo_sentences", "runs", time.strftime("%Y%m%d-%H%M%S"))
+        run = open_run(run_dir, paths, settings={"model": args.model, "diverse": args.diverse, "batch": True})
+    else:
+        if not args.run_dir:
+            parser.error(f"{args.command} needs --run-dir")
+        run = open_run(args.run_dir, resume=True)
+    batches = run["manifest"].get("batches", [])
+    if args.command != "compile" and not batches:
+        parser.error(f"Run '{run['dir']}' has no batch request file, compile one first")
+
+    if args.command == "compile":
+        prompt_variations = get_run_prompts(run, client, args.prompts)
+        settings = run["manifest"]["settings"]
+        compile_batch(run, prompt_variations, num_completions=5 if settings.get("diverse") else 1,
+                      model=settings.get("model", args.model))
+    elif args.command == "submit":
+        submit_batch(client, run)
+    elif args.command == "fetch":
+        fetch_batch(client, run)
+    elif args.command == "simulate":
+        batch = batches[-1]
+        results_file = os.path.join(run["dir"], batch["file"].replace(".jsonl", ".results.jsonl"))
+        simulate_batch(os.path.join(run["dir"], batch["file"]), results_file)
+        batch["results"] = os.path.basename(results_file)
+        save_manifest(run)
+        print(f"Simulated results of {batch['file']} in {results_file}")
+    elif args.command == "ingest":
+        batch = batches[-1]
+        results_file = args.results or (batch["results"] and os.path.join(run["dir"], batch["results"]))
+        if not results_file:
+            parser.error("No results to ingest, fetch or simulate them first or pass --results")
+        ingest_results(run, results_file, batch["num_completions"], args.shard_size)
+        if not pending_paths(run):
+            merge_run(run, args.out_log, args.out_csv)
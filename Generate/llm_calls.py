@@ -0,0 +1,333 @@
+# This file contains a content-addressed on-disk cache and per-call metrics for LLM chat completions
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import hashlib
+import random
+import threading
+from openai import APIConnectionError
+from openai.types.chat import ChatCompletion
+
+# Cache settings (overridable with LLM_CACHE_PATH, LLM_CACHE_MODE and LLM_CACHE_MAX_MB)
+# mode: "on" reads and writes the cache, "replay" only reads it and fails on a miss (offline runs),
+#       "refresh" always calls the API and overwrites cached responses, "off" bypasses the cache.
+# The cache is opt-in: sampled generation (temperature 0.9) is re-run to get new samples,
+# which a cache would answer with the same sentences.
+LLM_CACHE = {
+    "path": os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_cache.db")),
+    "mode": os.getenv("LLM_CACHE_MODE", "off"),
+    "max_bytes": int(float(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024)
+}
+LLM_CACHE_STATS = {"hits": 0, "misses": 0, "time_saved": 0.0, "api_time": 0.0}
+LLM_CACHE_STATE = {"conn": None, "size": 0, "reported": False}
+LLM_CACHE_LOCK = threading.Lock()
+
+# Per-call metrics records (appended as json lines to LLM_METRICS_PATH, set LLM_METRICS=off to disable).
+# Records are flushed every flush_every records or flush_seconds, so an interrupted run keeps them.
+LLM_METRICS = {
+    "enabled": os.getenv("LLM_METRICS", "on") != "off",
+    "path": os.getenv("LLM_METRICS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_metrics.jsonl")),
+    "flush_every": 20,
+    "flush_seconds": 30.0
+}
+LLM_METRICS_RECORDS = []
+LLM_METRICS_BY_RESPONSE = {}
+LLM_METRICS_STATE = {"unwritten": [], "flushed": time.time()}
+
+# Retry settings of chat_completion (the client itself must not retry, see chat_completion)
+LLM_RETRY = {"max_retries": 6, "base_delay": 1.0, "max_delay": 60.0}
+
+# Status codes worth retrying (timeout, conflict, rate limit, server errors)
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# USD per 1M prompt and completion tokens
+LLM_PRICES = {"gpt-4o-mini": (0.15, 0.60)}
+
+# Number of identical requests made so far in this run, so repeated requests map to
+# different cached samples (e.g. the 5 identical calls of generate_diverse_mwo)
+REQUEST_COUNTS = {}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        elapsed REAL NOT NULL,
+        created REAL NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+# Function to set the cache mode and location
+def configure_cache(mode=None, path=None, max_mb=None):
+    """ Change cache settings before the first call (mode: on, replay, refresh, off) """
+    if mode is not None:
+        if mode not in ("on", "replay", "refresh", "off"):
+            raise ValueError(f"Unknown LLM cache mode '{mode}'")
+        LLM_CACHE["mode"] = mode
+    if path is not None and path != LLM_CACHE["path"]:
+        LLM_CACHE["path"] = path
+        LLM_CACHE_STATE["conn"] = None
+    if max_mb is not None:
+        LLM_CACHE["max_bytes"] = int(max_mb * 1024 * 1024)
+
+# Function to open the cache database
+def get_cache_conn():
+    """ Open cache database once per process """
+    if LLM_CACHE_STATE["conn"] is None:
+        conn = sqlite3.connect(LLM_CACHE["path"], timeout=30, check_same_thread=False)
+        conn.executescript(SCHEMA)
+        LLM_CACHE_STATE["size"] = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        LLM_CACHE_STATE["conn"] = conn
+        if not LLM_CACHE_STATE["reported"]:
+            LLM_CACHE_STATE["reported"] = True
+            atexit.register(report_cache_stats)
+    return LLM_CACHE_STATE["conn"]
+
+# Function to create the cache key of a request
+def request_key(model, messages, params, sample_index=None):
+    """ Hash model, messages and sampling parameters. Without sample_index, identical requests
+        in a run get indexes 0, 1, 2, ... so each repeat replays its own cached sample. """
+    request = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, default=str)
+    base_key = hashlib.sha256(request.encode("utf-8")).hexdigest()
+    if sample_index is None:
+        with LLM_CACHE_LOCK:
+            sample_index = REQUEST_COUNTS.get(base_key, 0)
+            REQUEST_COUNTS[base_key] = sample_index + 1
+    return f"{base_key}:{sample_index}"
+
+# Function to read a cached response
+def cache_lookup(key):
+    """ Return cached response or None """
+    with LLM_CACHE_LOCK:
+        conn = get_cache_conn()
+        row = conn.execute("SELECT response, elapsed FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            LLM_CACHE_STATS["misses"] += 1
+            return None
+        with conn:
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        LLM_CACHE_STATS["hits"] += 1
+        LLM_CACHE_STATS["time_saved"] += row[1]
+    return ChatCompletion.model_validate_json(row[0])
+
+# Function to store a response and evict least recently used responses over the size limit
+def cache_store(key, response, elapsed):
+    """ Store response and keep the cache under its size limit """
+    data = response.model_dump_json()
+    now = time.time()
+    with LLM_CACHE_LOCK:
+        conn = get_cache_conn()
+        with conn:
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, data, len(data), elapsed, now, now))
+            LLM_CACHE_STATE["size"] += len(data) - (old[0] if old else 0)
+            if LLM_CACHE_STATE["size"] > LLM_CACHE["max_bytes"]:
+                # Evict down to 90% of the limit
+                target = LLM_CACHE["max_bytes"] * 0.9
+                for old_key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+                    if LLM_CACHE_STATE["size"] <= target:
+                        break
+                    conn.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    LLM_CACHE_STATE["size"] -= size
+
+# Function to get a cached response or report a replay miss
+def cached_response(key, model):
+    """ Return cached response, None to call the API, or raise on a miss in replay mode """
+    if LLM_CACHE["mode"] == "refresh":
+        return None
+    response = cache_lookup(key)
+    if response is None and LLM_CACHE["mode"] == "replay":
+        raise RuntimeError(f"LLM cache miss in replay mode ({model}, key {key}); "
+                           f"run with LLM_CACHE_MODE=on to fill the cache")
+    return response
+
+# Function to start a request through the cache
+def begin_request(model, messages, params, sample_index=None):
+    """ Return (key, cached response or None); key is None when the cache is off """
+    if LLM_CACHE["mode"] == "off":
+        return None, None
+    key = request_key(model, messages, params, sample_index)
+    return key, cached_response(key, model)
+
+# Function to record a response from the API
+def finish_request(key, response, elapsed):
+    """ Count API time and store the response under its key """
+    LLM_CACHE_STATS["api_time"] += elapsed
+    if key is not None:
+        cache_store(key, response, elapsed)
+
+# Function to record the metrics of a call
+def record_call(stage, model, messages, response, latency, cached, retries=0, fewshot=0):
+    """ Record latency, tokens, retries and cost of a call. fewshot is the number of leading
+        few-shot messages; their share of prompt tokens is estimated from their share of characters. """
+    if not LLM_METRICS["enabled"]:
+        return None
+    usage = getattr(response, "usage", None)
+    chars = [len(message["content"]) for message in messages]
+    prompt_tokens = usage.prompt_tokens if usage is not None else sum(chars) // 4
+    completion_tokens = usage.completion_tokens if usage is not None else 0
+    prompt_price, completion_price = LLM_PRICES.get(model, (0.0, 0.0))
+    record = {
+        "time": time.time(), "stage": stage, "model": model, "cached": cached,
+        "latency": round(latency, 4), "retries": retries,
+        "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+        "fewshot_tokens": round(prompt_tokens * sum(chars[:fewshot]) / max(sum(chars), 1)),
+        "cost": 0.0 if cached else (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6,
+        "sentences": None
+    }
+    with LLM_CACHE_LOCK:
+        if not LLM_METRICS_RECORDS:
+            atexit.register(report_metrics)
+        LLM_METRICS_RECORDS.append(record)
+        LLM_METRICS_STATE["unwritten"].append(record)
+        LLM_METRICS_BY_RESPONSE[id(response)] = record
+    maybe_flush_metrics()
+    return record
+
+# Function to record the number of sentences extracted from a response
+def record_sentences(response, num_sentences):
+    """ Add the number of sentences parsed from response to the record of its call """
+    record = LLM_METRICS_BY_RESPONSE.pop(id(response), None)
+    if record is not None:
+        record["sentences"] = num_sentences
+        maybe_flush_metrics()
+
+# Function to append finished call records to the metrics file
+def flush_metrics(final=False):
+    """ Append unwritten call records to the metrics file and return how many were written.
+        Records still waiting for their sentence count (record_sentences) are held back for
+        up to flush_seconds, unless final. """
+    with LLM_CACHE_LOCK:
+        now = time.time()
+        waiting = {id(record) for record in LLM_METRICS_BY_RESPONSE.values()}
+        ready = [record for record in LLM_METRICS_STATE["unwritten"]
+                 if final or id(record) not in waiting or now - record["time"] >= LLM_METRICS["flush_seconds"]]
+        LLM_METRICS_STATE["flushed"] = now
+        if not ready:
+            return 0
+        with open(LLM_METRICS["path"], "a", encoding='utf-8') as f:
+            f.write("".join(json.dumps(record) + "\n" for record in ready))
+        written = {id(record) for record in ready}
+        LLM_METRICS_STATE["unwritten"] = [record for record in LLM_METRICS_STATE["unwritten"] if id(record) not in written]
+    return len(ready)
+
+# Function to flush call records when enough of them or enough time has accumulated
+def maybe_flush_metrics():
+    """ Flush records every flush_every records or flush_seconds """
+    if (len(LLM_METRICS_STATE["unwritten"]) >= LLM_METRICS["flush_every"]
+            or time.time() - LLM_METRICS_STATE["flushed"] >= LLM_METRICS["flush_seconds"]):
+        flush_metrics()
+
+# Function to check if a failed request should be retried
+def is_retryable(error):
+    """ Retry connection errors, timeouts, rate limits and server errors """
+    if isinstance(error, APIConnectionError):
+        return True
+    return getattr(error, "status_code", None) in RETRY_STATUS
+
+# Function to get the backoff delay of a retry
+def get_retry_delay(error, attempt, limits=LLM_RETRY):
+    """ Exponential backoff with jitter, or the server's retry-after if given """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return min(float(retry_after), limits["max_delay"])
+    except (TypeError, ValueError):
+        delay = min(limits["max_delay"], limits["base_delay"] * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+# Function to make a cached chat completion
+def chat_completion(client, model, messages, sample_index=None, stage="other", fewshot=0, **params):
+    """ client.chat.completions.create with a content-addressed cache of responses.
+        Failed requests are retried here with backoff (the client's own retries are turned off),
+        so the number of retries of each call is known. Each call is recorded under stage,
+        with fewshot leading few-shot messages. """
+    call_start = time.perf_counter()
+    key, response = begin_request(model, messages, params, sample_index)
+    cached = response is not None
+    attempt = 0
+    if not cached:
+        if getattr(client, "max_retries", 0):
+            client = client.with_options(max_retries=0)
+        for attempt in range(LLM_RETRY["max_retries"] + 1):
+            try:
+                start = time.perf_counter()
+                response = client.chat.completions.create(model=model, messages=messages, **params)
+                break
+            except Exception as error:
+                if attempt == LLM_RETRY["max_retries"] or not is_retryable(error):
+                    raise
+                time.sleep(get_retry_delay(error, attempt))
+        finish_request(key, response, time.perf_counter() - start)
+    record_call(stage, model, messages, response, time.perf_counter() - call_start, cached, retries=attempt, fewshot=fewshot)
+    return response
+
+# Function to get a percentile of values
+def percentile(values, q):
+    """ Return the q-th percentile (0-100) of values by linear interpolation """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+# Function to aggregate call metrics by stage
+def summarise_metrics(records=None):
+    """ Return {stage: aggregate} with call counts, latency percentiles of API calls,
+        token totals, few-shot share of prompt tokens, sentences per call and cost """
+    stages = {}
+    for record in LLM_METRICS_RECORDS if records is None else records:
+        stages.setdefault(record["stage"], []).append(record)
+    summary = {}
+    for stage, stage_records in stages.items():
+        latencies = [record["latency"] for record in stage_records if not record["cached"]]
+        sentences = [record["sentences"] for record in stage_records if record["sentences"] is not None]
+        prompt_tokens = sum(record["prompt_tokens"] for record in stage_records)
+        summary[stage] = {
+            "calls": len(stage_records),
+            "cached": len(stage_records) - len(latencies),
+            "retries": sum(record["retries"] for record in stage_records),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "prompt_tokens": prompt_tokens,
+            "fewshot_tokens": sum(record["fewshot_tokens"] for record in stage_records),
+            "fewshot_share": sum(record["fewshot_tokens"] for record in stage_records) / max(prompt_tokens, 1),
+            "completion_tokens": sum(record["completion_tokens"] for record in stage_records),
+            "sentences_per_call": sum(sentences) / len(sentences) if sentences else None,
+            "cost": sum(record["cost"] for record in stage_records)
+        }
+    return summary
+
+# Function to save call records and print the summary by stage
+def report_metrics():
+    """ Append the remaining call records to the metrics file and print latency, token and cost summary by stage """
+    if not LLM_METRICS_RECORDS:
+        return
+    flush_metrics(final=True)
+    print(f"LLM calls ({len(LLM_METRICS_RECORDS)} records appended to {LLM_METRICS['path']}):")
+    for stage, stats in summarise_metrics().items():
+        sentences = f"{stats['sentences_per_call']:.1f}" if stats["sentences_per_call"] is not None else "-"
+        print(f"  {stage}: {stats['calls']} calls ({stats['cached']} cached, {stats['retries']} retries), "
+              f"latency p50/p90/p99 {stats['latency_p50']:.2f}/{stats['latency_p90']:.2f}/{stats['latency_p99']:.2f}s, "
+              f"{stats['prompt_tokens']} prompt tokens ({100 * stats['fewshot_share']:.0f}% few-shot), "
+              f"{stats['completion_tokens']} completion tokens, {sentences} sentences/call, ${stats['cost']:.4f}")
+    LLM_METRICS_RECORDS.clear()
+
+# Function to report cache hit rate and time saved
+def report_cache_stats():
+    """ Print cache hit rate and API time saved by cached responses """
+    total = LLM_CACHE_STATS["hits"] + LLM_CACHE_STATS["misses"]
+    if not total:
+        return
+    print(f"LLM cache ({LLM_CACHE['mode']}): {LLM_CACHE_STATS['hits']}/{total} hits "
+          f"({100 * LLM_CACHE_STATS['hits'] / total:.1f}%), {LLM_CACHE_STATS['time_saved']:.1f}s saved, "
+          f"{LLM_CACHE_STATS['api_time']:.1f}s spent on API calls")
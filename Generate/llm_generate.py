@@ -3,7 +3,10 @@ import re
 import sys
 import csv
 import json
+import time
 import random
+import argparse
+import threading
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -11,28 +14,31 @@ sys.path.append(os.path.abspath('../PathExtraction'))
 
 from path_queries import direct_queries, complex_queries
 from llm_prompt import initialise_prompts
+from path_store import open_path_store, query_paths, sample_paths
+from llm_calls import chat_completion, record_sentences
+from run_manifest import open_run, pending_paths, add_result, commit_shard, merge_run
 
 BLACKLIST = ['shows signs of', 'showing signs of', 'detected', 
              'observed', 'requires attention', 'identified', 'application']
 
+# Fewshot messages built once per prompt variation set and shared by all generation calls
+FEWSHOT_CACHE = {}
+FEWSHOT_LOCK = threading.Lock()
+FEWSHOT_JSON = "fewshot_messages/fewshot_generate.json"
+
 # Read all the paths extracted from MaintIE KG
 def get_all_paths(valid=True, label=False):
     """ Read all the paths extracted from MaintIE Gold Dataset KG """
     queries = direct_queries + complex_queries
     paths_list = []
     paths_dict = {}
+    store = open_path_store()
     for query in queries:
-        with open(f"../PathExtraction/path_patterns/{query['outfile']}.json", encoding='utf-8') as f:
-            paths_json = json.load(f)
-            if valid and label:
-                paths_json = [path for path in paths_json if path['valid'] == valid and 'failure_mode' in path]
-            elif valid:
-                paths_json = [path for path in paths_json if path['valid'] == valid]
-            elif label:
-                paths_json = [path for path in paths_json if 'failure_mode' in path]
-            print(f"{len(paths_json)}\tpaths in {query['outfile']}")
-            paths_dict[query['outfile']] = paths_json
-            paths_list.extend(paths_json)
+        paths_json = query_paths(store, pattern=query['outfile'], valid=valid, label=label)
+        print(f"{len(paths_json)}\tpaths in {query['outfile']}")
+        paths_dict[query['outfile']] = paths_json
+        paths_list.extend(paths_json)
+    store.close()
     print(f"Total number of paths: {len(paths_list)}")
     return paths_list, paths_dict
 
@@ -60,9 +66,9 @@ def get_generate_prompt(prompt_variations, object, event):
     prompt += f"Do not use these terms: {blacklist}."
     return prompt
 
-# Get fewshot message from fewshot csv file
-def get_generate_fewshot(prompt_variations):
-    """ Get fewshot message from fewshot csv file """
+# Build fewshot message from fewshot csv file
+def build_generate_fewshot(prompt_variations):
+    """ Build fewshot message from fewshot csv file """
     message = [{"role": "system", "content": "You are a technician recording maintenance work orders."}]
     with open("fewshot_messages/fewshot_generate.csv", encoding='utf-8') as f:
         fewshot_data = csv.reader(f)
@@ -76,12 +82,35 @@ def get_generate_fewshot(prompt_variations):
             assistant = {"role": "assistant", "content": example}
             message.append(user)
             message.append(assistant)
+    return message
 
-    # Save fewshot message to json file
-    with open("fewshot_messages/fewshot_generate.json", "w", encoding='utf-8') as f:
-        json.dump(message, f, indent=4)
+# Save fewshot message to json file if it changed
+def save_fewshot_snapshot(message, filepath=FEWSHOT_JSON):
+    """ Save fewshot message to json file, skipping the write if the file already holds it """
+    content = json.dumps(message, indent=4)
+    if os.path.exists(filepath):
+        with open(filepath, encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+    with open(filepath, "w", encoding='utf-8') as f:
+        f.write(content)
+    return True
 
-    return message
+# Get fewshot message from fewshot csv file
+def get_generate_fewshot(prompt_variations):
+    """ Get fewshot message for a prompt variation set. The message is built (and its json
+        snapshot saved) once per set and returned as a shared tuple; add turns with
+        list(fewshot) + [...] rather than modifying it. """
+    key = tuple(tuple(variants) for variants in prompt_variations)
+    fewshot = FEWSHOT_CACHE.get(key)
+    if fewshot is None:
+        with FEWSHOT_LOCK:
+            fewshot = FEWSHOT_CACHE.get(key)
+            if fewshot is None:
+                message = build_generate_fewshot(prompt_variations)
+                save_fewshot_snapshot(message)
+                fewshot = FEWSHOT_CACHE[key] = tuple(message)
+    return fewshot
 
 # Overall generation for MWO sentences
 def generate_mwo(client, prompt_variations, path):
@@ -91,17 +120,21 @@ def generate_mwo(client, prompt_variations, path):
     event = path['event_name']
     prompt = get_generate_prompt(prompt_variations, object, event)
     fewshot = get_generate_fewshot(prompt_variations)
-    message = fewshot + [{"role": "user", "content": prompt}]
+    message = list(fewshot) + [{"role": "user", "content": prompt}]
     
     # Generate 1 completion for path (max 5 sentences)
-    response = client.chat.completions.create(
+    response = chat_completion(
+                    client,
                     model="gpt-4o-mini",
                     messages=message,
+                    stage="generate",
+                    fewshot=len(fewshot),
                     temperature=0.9,
                     top_p=0.9,
                     n=1
             )
     sentences = process_mwo_response(response.choices[0].message.content)
+    record_sentences(response, len(sentences))
     print(f"{object} {event} - {len(sentences)} sentences")
     return sentences
 
@@ -120,15 +153,19 @@ def generate_diverse_mwo(client, prompt_variations, path):
     # Generate 5 completions (max 5x5 sentences) for each path
     sentences = [] # Max 25 sentences (avg 10)
     for _ in range(num):
-        message = fewshot + [{"role": "user", "content": prompt}]
-        response = client.chat.completions.create(
+        message = list(fewshot) + [{"role": "user", "content": prompt}]
+        response = chat_completion(
+                        client,
                         model="gpt-4o-mini",
                         messages=message,
+                        stage="generate_diverse",
+                        fewshot=len(fewshot),
                         temperature=0.9,
                         top_p=0.9,
                         n=1
                 )
         response_sentences = process_mwo_response(response.choices[0].message.content)
+        record_sentences(response, len(response_sentences))
         sentences.extend(response_sentences)
     sentences = list(set(sentences)) # Remove duplicates
     print(f"{object} {event} - {len(sentences)} sentences")
@@ -162,41 +199,46 @@ def get_samples(paths_dict, num_samples=30, exclude=[]):
     return samples
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate MWO sentences for sampled paths")
+    parser.add_argument("--num-samples", type=int, default=1, help="paths sampled per path type")
+    parser.add_argument("--run-dir", help="directory of the run manifest and shards (default: mwo_sentences/runs/<time>)")
+    parser.add_argument("--resume", action="store_true", help="continue the run in --run-dir, skipping completed paths")
+    parser.add_argument("--shard-size", type=int, default=50, help="paths per committed shard")
+    args = parser.parse_args()
+
     # Set OpenAI API key
     load_dotenv()
     api_key = os.getenv("API_KEY")
-    client = OpenAI(api_key=api_key)
+    client = OpenAI(api_key=api_key, max_retries=0) # Retries are made (and counted) by chat_completion
     out_logfile = "mwo_sentences/log.txt"         # Log file for generated sentences (includes equipment + failure)
     out_csvfile = "mwo_sentences/order_synthetic.csv"   # CSV file for generated sentences (just sentences)
-    
-    # Read all the paths extracted from MaintIE KG
-    paths_list, paths_dict = get_all_paths(valid=True)
+
+    if args.resume:
+        if not args.run_dir:
+            parser.error("--resume needs --run-dir")
+        run = open_run(args.run_dir, resume=True)
+    else:
+        # Open the indexed store of paths extracted from MaintIE KG
+        store = open_path_store()
+
+        # Sample random paths from each path type
+        paths = sample_paths(store, num_samples=args.num_samples, valid=True)
+
+        # Custom path
+        # paths = [{'object_name': 'fuel', 'event_name': 'leaking'}]
+
+        run_dir = args.run_dir or os.path.join("mwo_sentences", "runs", time.strftime("%Y%m%d-%H%M%S"))
+        run = open_run(run_dir, paths)
 
     # Initialise base prompts and instructions
     prompt_variations = initialise_prompts(client, num_variants=5, num_examples=5)
-    
-    # Sample random paths from each path type
-    paths = get_samples(paths_dict, num_samples=1)
 
-    # Custom path
-    # paths = [{'object_name': 'fuel', 'event_name': 'leaking'}]
-    
-    # Generate MWO sentences for each path
-    for path in paths:
-        sentences = generate_mwo(client, prompt_variations, path)
-        
-        # Save generated sentences to log text file
-        with open(out_logfile, "a", encoding='utf-8') as f:
-            f.write("========================================\n")
-            f.write(f"Object: {path['object_name']}\n")
-            f.write(f"Event: {path['event_name']}\n")
-            f.write(f"Number of sentences: {len(sentences)}\n")
-            f.write("----------------------------------------\n")
-            for sentence in sentences:
-                f.write(f"~ {sentence}\n")
-            f.write("========================================\n")
-
-        # Save generated sentences to csv file
-        with open(out_csvfile, "a", encoding='utf-8') as f:
-            for sentence in sentences:
-                f.write(f"{sentence},{path['object_type']},{path['object_name']},{path['event_name']}\n")
\ No newline at end of file
+    # Generate MWO sentences for each path not completed yet
+    # Sentences are committed to the run in shards and appended to the log and csv files once the run is done
+    try:
+        for path in pending_paths(run):
+            sentences = generate_mwo(client, prompt_variations, path)
+            add_result(run, path, sentences, args.shard_size)
+    finally:
+        commit_shard(run)
+    merge_run(run, out_logfile, out_csvfile)
@@ -1,13 +1,18 @@
 import os
 import re
 import sys
+import time
 from openai import OpenAI
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+
+from llm_calls import chat_completion, record_sentences
+from embeddings import EMBEDDING_STATS, encode, cosine_similarity, embedding_stats
 
 # Initialise list of prompt variants
 def initialise_prompts(openai, num_variants, num_examples):
     """ Initialise list of prompt variants. """
+    start = time.perf_counter()
+    stats = dict(EMBEDDING_STATS)
 
     # Base prompt for generating MWO sentences
     base_prompts = []
@@ -56,20 +61,21 @@ def initialise_prompts(openai, num_variants, num_examples):
     base_prompts = base_prompts[:num_variants]
     limit_words = limit_words[:num_variants]
     limit_count = limit_count[:num_variants]
+    print(f"Initialised prompt variants in {time.perf_counter() - start:.2f}s ({embedding_stats(stats)})")
     return (base_prompts, limit_words, limit_count)
 
 # Check semantic similarity for the paraphrased sentences
 def check_similarity(original, paraphrases):
-    """ Check semantic similarity for the paraphrased sentences. """
-    model = SentenceTransformer('sentence-transformers/paraphrase-MiniLM-L6-v2')
-    original_embedding = model.encode(original)
-    paraphrases_embeddings = model.encode(paraphrases)
-    similarities = model.similarity(original_embedding, paraphrases_embeddings)
+    """ Check semantic similarity for the paraphrased sentences.
+        Embeddings come from the shared embedding service (embeddings.py), which loads
+        the model once per process and caches embeddings on disk. """
+    embeddings = encode([original] + list(paraphrases))
+    similarities = cosine_similarity(embeddings[0], embeddings[1:])
     
     # Uncomment this to print sentence and their similarity scores
-    # for sentence, similarity in zip(paraphrases, similarities.tolist()[0]):
+    # for sentence, similarity in zip(paraphrases, similarities.tolist()):
     #     print(f"{similarity:.4f} - {sentence}")
-    return similarities.tolist()[0]
+    return similarities.tolist()
 
 # Post-process LLM response of prompt paraphrases into a list of sentences
 def process_prompt_response(response):
@@ -90,24 +96,27 @@ def paraphrase_prompt(openai, prompt, keywords=None, num_paraphrases=5):
     if keywords:
         string_keywords = ", ".join(keywords)
         paraphrase_prompt += "Must include the following keywords: " + string_keywords
-    response = openai.chat.completions.create(
+    response = chat_completion(
+                    openai,
                     model="gpt-4o-mini",
                     messages=[
                             {"role": "system", "content": "You are a sentence paraphraser."},
                             {"role": "user", "content": paraphrase_prompt},
                         ],
+                    stage="paraphrase",
                     top_p=0.9,
                     temperature=0.9,
                     n=1
                 )
     output = process_prompt_response(response.choices[0].message.content)
+    record_sentences(response, len(output))
     return output
 
 if __name__ == "__main__":
     # Set OpenAI API key
     load_dotenv()
     api_key = os.getenv("API_KEY")
-    client = OpenAI(api_key=api_key)
+    client = OpenAI(api_key=api_key, max_retries=0) # Retries are made (and counted) by chat_completion
     
     # Test Paraphrase Instruction Prompt
     instruction = "The sentence can have a maximum of 8 words."
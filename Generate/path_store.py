@@ -0,0 +1,175 @@
+# This file contains an indexed SQLite store of the paths extracted from MaintIE KG
+
+import os
+import sys
+import json
+import random
+import sqlite3
+
+sys.path.append(os.path.abspath('../PathExtraction'))
+
+from path_queries import direct_queries, complex_queries
+
+# Resolved from this file so the store opens from any working directory
+PATTERN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PathExtraction', 'path_patterns')
+PATH_STORE = os.path.join(PATTERN_DIR, 'paths.db')
+SCHEMA_VERSION = 2 # Stores of an older schema are dropped and rebuilt
+
+# Paths are kept as json (returned unchanged) next to the columns they are filtered on.
+# stratum_pos numbers the paths of each (pattern, valid, has_failure_mode) stratum from 0,
+# so a sample of k paths is fetched by position through the index instead of scanning the stratum.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS paths (
+        pattern TEXT NOT NULL,
+        pattern_index INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        object_name TEXT,
+        object_type TEXT,
+        event_name TEXT,
+        valid INTEGER NOT NULL,
+        alternate INTEGER NOT NULL,
+        failure_mode TEXT,
+        has_failure_mode INTEGER NOT NULL,
+        stratum_pos INTEGER NOT NULL,
+        path TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS paths_stratum ON paths (pattern, valid, has_failure_mode, stratum_pos);
+    CREATE INDEX IF NOT EXISTS paths_order ON paths (pattern_index, position);
+    CREATE INDEX IF NOT EXISTS paths_object ON paths (object_name);
+    CREATE INDEX IF NOT EXISTS paths_event ON paths (event_name);
+    CREATE INDEX IF NOT EXISTS paths_failure_mode ON paths (failure_mode);
+    CREATE TABLE IF NOT EXISTS strata (
+        pattern TEXT NOT NULL,
+        valid INTEGER NOT NULL,
+        has_failure_mode INTEGER NOT NULL,
+        num_paths INTEGER NOT NULL,
+        PRIMARY KEY (pattern, valid, has_failure_mode)
+    );
+    CREATE TABLE IF NOT EXISTS sources (
+        pattern TEXT PRIMARY KEY,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL
+    );
+"""
+
+# Function to list the path pattern files in query order
+def get_pattern_files(pattern_dir=None):
+    """ Return [(pattern, json file)] of all path queries (pattern_dir defaults to PATTERN_DIR) """
+    pattern_dir = PATTERN_DIR if pattern_dir is None else pattern_dir
+    return [(query["outfile"], os.path.join(pattern_dir, f"{query['outfile']}.json"))
+            for query in direct_queries + complex_queries]
+
+# Function to check if the store is older than the path pattern files
+def is_stale(conn, pattern_dir=None):
+    """ Compare modification time and size of the json files with those they were loaded from """
+    stored = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT pattern, mtime, size FROM sources")}
+    for pattern, filepath in get_pattern_files(pattern_dir):
+        stat = os.stat(filepath)
+        if stored.get(pattern) != (stat.st_mtime, stat.st_size):
+            return True
+    return False
+
+# Function to load the path pattern files into the store
+def build_path_store(conn, pattern_dir=None):
+    """ Replace the stored paths with the paths of the json files in pattern_dir """
+    rows, strata, sources = [], {}, []
+    for pattern_index, (pattern, filepath) in enumerate(get_pattern_files(pattern_dir)):
+        stat = os.stat(filepath)
+        with open(filepath, encoding='utf-8') as f:
+            paths = json.load(f)
+        for position, path in enumerate(paths):
+            key = (pattern, int(bool(path['valid'])), int('failure_mode' in path))
+            stratum_pos = strata.get(key, 0)
+            strata[key] = stratum_pos + 1
+            rows.append((pattern, pattern_index, position, path.get('object_name'), path.get('object_type'),
+                         path.get('event_name'), key[1], int(bool(path['alternate'])),
+                         path.get('failure_mode'), key[2], stratum_pos, json.dumps(path)))
+        sources.append((pattern, stat.st_mtime, stat.st_size))
+
+    with conn:
+        conn.execute("DELETE FROM paths")
+        conn.execute("DELETE FROM strata")
+        conn.execute("DELETE FROM sources")
+        conn.executemany("INSERT INTO paths VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO strata VALUES (?, ?, ?, ?)", [key + (n,) for key, n in strata.items()])
+        conn.executemany("INSERT INTO sources VALUES (?, ?, ?)", sources)
+    print(f"Loaded {len(rows)} paths into path store")
+
+# Function to open the path store
+def open_path_store(db_path=None, pattern_dir=None):
+    """ Open the path store, (re)loading it if the path pattern files changed since it was built.
+        db_path and pattern_dir default to PATH_STORE and PATTERN_DIR. """
+    conn = sqlite3.connect(PATH_STORE if db_path is None else db_path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.executescript("DROP TABLE IF EXISTS paths; DROP TABLE IF EXISTS strata; DROP TABLE IF EXISTS sources;")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(SCHEMA)
+    if is_stale(conn, pattern_dir):
+        build_path_store(conn, pattern_dir)
+    return conn
+
+# Function to build the WHERE clause of the valid / label filters
+def path_filters(valid=True, label=False):
+    """ Return (conditions, parameters) matching get_all_paths: valid=True keeps valid paths,
+        label=True keeps paths with a failure mode, False means no filter """
+    conditions, parameters = [], []
+    if valid:
+        conditions.append("valid = ?")
+        parameters.append(int(valid))
+    if label:
+        conditions.append("has_failure_mode = 1")
+    return conditions, parameters
+
+# Function to count stored paths of each pattern
+def count_paths(conn, valid=True, label=False):
+    """ Return {pattern: number of paths} from the strata counts """
+    conditions, parameters = path_filters(valid, label)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    counts = {pattern: 0 for pattern, _ in get_pattern_files()}
+    for pattern, num_paths in conn.execute(f"SELECT pattern, SUM(num_paths) FROM strata {where} GROUP BY pattern", parameters):
+        counts[pattern] = num_paths
+    return counts
+
+# Function to read stored paths
+def query_paths(conn, pattern=None, valid=True, label=False, object_name=None, event_name=None, failure_mode=None):
+    """ Return paths matching the filters in pattern file order """
+    conditions, parameters = path_filters(valid, label)
+    for column, value in [("pattern", pattern), ("object_name", object_name),
+                          ("event_name", event_name), ("failure_mode", failure_mode)]:
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT path FROM paths {where} ORDER BY pattern_index, position"
+    return [json.loads(row[0]) for row in conn.execute(query, parameters)]
+
+# Function to sample paths from each pattern
+def sample_paths(conn, num_samples=30, valid=True, label=False, exclude=[], rng=random):
+    """ Sample up to num_samples paths from each pattern (as get_samples does).
+        Positions are drawn from the strata counts and fetched by index, so the
+        cost depends on the number of samples and not on the number of stored paths. """
+    conditions, parameters = path_filters(valid, label)
+    where = f"AND {' AND '.join(conditions)}" if conditions else ""
+    samples = []
+    for pattern, _ in get_pattern_files():
+        if pattern in exclude:
+            continue
+        strata = conn.execute(f"SELECT valid, has_failure_mode, num_paths FROM strata WHERE pattern = ? {where} "
+                              f"ORDER BY valid, has_failure_mode", [pattern] + parameters).fetchall()
+        total = sum(num_paths for _, _, num_paths in strata)
+        for index in rng.sample(range(total), min(num_samples, total)):
+            # Map the index across the strata of the pattern to a stratum position
+            for valid_flag, has_failure_mode, num_paths in strata:
+                if index < num_paths:
+                    break
+                index -= num_paths
+            row = conn.execute("SELECT path FROM paths WHERE pattern = ? AND valid = ? AND has_failure_mode = ? "
+                               "AND stratum_pos = ?", (pattern, valid_flag, has_failure_mode, index)).fetchone()
+            samples.append(json.loads(row[0]))
+    return samples
+
+if __name__ == "__main__":
+    conn = open_path_store()
+    for pattern, num_paths in count_paths(conn, valid=False).items():
+        print(f"{num_paths}\tpaths in {pattern}")
+    conn.close()
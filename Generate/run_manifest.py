@@ -0,0 +1,160 @@
+# This file contains checkpointed generation runs: a manifest of completed paths and atomically committed shards
+
+import os
+import json
+import time
+import hashlib
+
+# Function to create a stable key of a path
+def path_key(path):
+    """ Hash object name, object type and event name of a path """
+    fields = [path['object_name'], path.get('object_type', ""), path['event_name']]
+    return hashlib.sha1(json.dumps(fields).encode("utf-8")).hexdigest()[:16]
+
+# Function to write a file atomically
+def atomic_write(filepath, content):
+    """ Write content to a temporary file and rename it over filepath, so readers
+        (and a resumed run) only ever see the old or the complete new file """
+    tmp_filepath = f"{filepath}.tmp"
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    with open(tmp_filepath, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filepath, filepath)
+
+# Function to save the manifest of a run
+def save_manifest(run):
+    """ Atomically save the run manifest """
+    atomic_write(os.path.join(run["dir"], "manifest.json"), json.dumps(run["manifest"], indent=4))
+
+# Function to start or resume a generation run
+def open_run(run_dir, paths=None, resume=False, settings=None):
+    """ Start a run over paths in run_dir, or resume the run in run_dir.
+        A resumed run uses the paths saved when it started and drops shards
+        that were written but not committed to the manifest. """
+    manifest_file = os.path.join(run_dir, "manifest.json")
+    if resume:
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = json.load(f)
+        with open(os.path.join(run_dir, "paths.json"), encoding='utf-8') as f:
+            paths = json.load(f)
+        for filename in os.listdir(run_dir):
+            if filename.endswith(".tmp") or (filename.startswith("shard-") and filename not in manifest["shards"]):
+                os.remove(os.path.join(run_dir, filename))
+    else:
+        if os.path.exists(manifest_file):
+            raise FileExistsError(f"Run '{run_dir}' already exists, use --resume to continue it")
+        os.makedirs(run_dir, exist_ok=True)
+        atomic_write(os.path.join(run_dir, "paths.json"), json.dumps(paths))
+        manifest = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "settings": settings or {},
+                    "num_paths": len(paths), "shards": [], "completed": [], "merged": False}
+    run = {"dir": run_dir, "manifest": manifest, "paths": paths, "buffer": [],
+           "completed": set(manifest["completed"])}
+    if not resume:
+        save_manifest(run)
+    return run
+
+# Function to list the paths a run still has to generate
+def pending_paths(run):
+    """ Return paths of the run not completed in a committed shard """
+    return [path for path in run["paths"] if path_key(path) not in run["completed"]]
+
+# Function to commit buffered results as a shard
+def commit_shard(run):
+    """ Atomically write buffered results as the next shard, then record them in the manifest """
+    if not run["buffer"]:
+        return
+    manifest = run["manifest"]
+    shard = f"shard-{len(manifest['shards']):05d}.jsonl"
+    atomic_write(os.path.join(run["dir"], shard), "".join(json.dumps(result) + "\n" for result in run["buffer"]))
+    keys = [result["key"] for result in run["buffer"]]
+    manifest["shards"].append(shard)
+    manifest["completed"].extend(keys)
+    run["completed"].update(keys)
+    save_manifest(run)
+    run["buffer"] = []
+
+# Function to add the generated sentences of a path to a run
+def add_result(run, path, sentences, shard_size=50):
+    """ Buffer the result of a path, committing a shard every shard_size paths """
+    run["buffer"].append({"key": path_key(path), "path": path, "sentences": sentences})
+    if len(run["buffer"]) >= shard_size:
+        commit_shard(run)
+
+# Function to read the committed results of a run
+def iter_results(run):
+    """ Yield committed results of the run in shard order """
+    for shard in run["manifest"]["shards"]:
+        with open(os.path.join(run["dir"], shard), encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+# Function to format the log entry of a path
+def format_log(path, sentences):
+    """ Format generated sentences of a path for the log text file """
+    lines = ["========================================",
+             f"Object: {path['object_name']}",
+             f"Event: {path['event_name']}",
+             f"Number of sentences: {len(sentences)}",
+             "----------------------------------------"]
+    lines += [f"~ {sentence}" for sentence in sentences]
+    lines.append("========================================")
+    return "\n".join(lines) + "\n"
+
+# Function to format the csv rows of a path
+def format_csv(path, sentences):
+    """ Format generated sentences of a path as csv rows (sentence, type, object, event) """
+    return "".join(f"{sentence},{path['object_type']},{path['object_name']},{path['event_name']}\n"
+                   for sentence in sentences)
+
+# Function to append content to a file once
+def append_once(filepath, content, start):
+    """ Append content to filepath, where a previous attempt may have appended it from byte offset start.
+        Returns the offset the content starts at. Only the bytes from start are read, so this does not
+        depend on the file size, and lines other runs appended in the meantime are kept. """
+    size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+    written = b""
+    if start is not None and start < size:
+        with open(filepath, "rb") as f:
+            f.seek(start)
+            written = f.read(len(content))
+    common = len(os.path.commonprefix([written, content]))
+    if common == len(content):
+        return start # Appended completely before
+    if common == 0:
+        start = size # Never appended (the bytes at start belong to another run)
+    elif start + common != size:
+        raise RuntimeError(f"Partial merge in {filepath} at byte {start} was followed by other writes, fix it by hand")
+    with open(filepath, "ab") as f:
+        f.write(content[common:])
+        f.flush()
+        os.fsync(f.fileno())
+    return start
+
+# Function to append a finished run to the log and csv files
+def merge_run(run, out_logfile, out_csvfile):
+    """ Append all results of a finished run to the output files once. The offset each file is
+        appended at is recorded first, so an interrupted merge is completed rather than duplicated. """
+    manifest = run["manifest"]
+    if manifest["merged"]:
+        return False
+    if pending_paths(run):
+        raise RuntimeError(f"Run '{run['dir']}' has {len(pending_paths(run))} paths left, resume it before merging")
+    offsets = manifest.setdefault("merge_offsets", dict(manifest.get("merge_base", {})))
+
+    results = list(iter_results(run))
+    for filepath, format_result in [(out_logfile, format_log), (out_csvfile, format_csv)]:
+        content = "".join(format_result(result["path"], result["sentences"]) for result in results).encode("utf-8")
+        if filepath not in offsets:
+            offsets[filepath] = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+            save_manifest(run)
+        start = append_once(filepath, content, offsets[filepath])
+        if start != offsets[filepath]:
+            offsets[filepath] = start
+            save_manifest(run)
+    manifest["merged"] = True
+    save_manifest(run)
+    print(f"Merged {len(results)} paths from '{run['dir']}' into {out_logfile} and {out_csvfile}")
+    return True
@@ -0,0 +1,87 @@
+# This file contains a local OpenAI-compatible stub server for testing generation without the API
+
+import re
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Function to create a canned completion for a chat request
+def stub_completion(messages):
+    """ Answer generation prompts with 5 sentences from the given equipment and event,
+        and paraphrase prompts with numbered variants of the given sentence """
+    prompt = messages[-1]["content"]
+    paraphrase = re.match(r"Paraphrase the following sentence (\d+) times.\n(.*)\n", prompt)
+    if paraphrase:
+        num, sentence = int(paraphrase.group(1)), paraphrase.group(2)
+        suffixes = ["", " Please.", " Thanks.", " Now.", " Today.", " Here.", " Again."]
+        return "\n".join(f"{i + 1}. {sentence}{suffixes[i % len(suffixes)]}" for i in range(num))
+    equipment = re.search(r"Equipment: (.*)", prompt)
+    event = re.search(r"Undesirable Event: (.*)", prompt)
+    equipment = equipment.group(1) if equipment else "equipment"
+    event = event.group(1) if event else "fault"
+    sentences = [f"{equipment} {event}", f"{event} on {equipment}", f"{equipment} has {event}",
+                 f"{equipment} is {event}", f"{event} {equipment}"]
+    return "\n".join(f"{i + 1}. {sentence}" for i, sentence in enumerate(sentences))
+
+# Request handler of the stub server
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    error_rate = 0.0
+    error_status = 429
+
+    def do_POST(self):
+        """ Handle POST /v1/chat/completions """
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            if self.error_status == 429:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                               {"retry-after": "0.1"})
+            else:
+                self.send_json(self.error_status, {"error": {"message": "Server error", "type": "server_error"}})
+            return
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        choices = [{"index": i, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": stub_completion(messages)}}
+                   for i in range(body.get("n", 1))]
+        completion_tokens = sum(len(choice["message"]["content"]) for choice in choices) // 4
+        self.send_json(200, {
+            "id": f"chatcmpl-stub-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": choices,
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    def send_json(self, status, data, headers={}):
+        """ Send json response """
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=429, help="status of error responses (429 or 5xx)")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.error_rate = args.error_rate
+    StubHandler.error_status = args.error_status
+    print(f"Stub server on http://127.0.0.1:{args.port}/v1")
+    ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler).serve_forever()
@@ -0,0 +1,31 @@
+import os
+import sys
+import threading
+import pytest
+from http.server import ThreadingHTTPServer
+
+# Generate scripts import each other (and PathExtraction) as top-level modules
+GENERATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, GENERATE_DIR)
+sys.path.insert(0, os.path.join(GENERATE_DIR, '..', 'PathExtraction'))
+
+from llm_calls import LLM_CACHE, LLM_METRICS
+from stub_server import StubHandler
+
+@pytest.fixture(autouse=True)
+def offline_llm(monkeypatch, tmp_path):
+    """ Keep tests away from the LLM cache and metrics files of the repo """
+    monkeypatch.setitem(LLM_CACHE, "mode", "off")
+    monkeypatch.setitem(LLM_METRICS, "enabled", False)
+    monkeypatch.chdir(GENERATE_DIR)
+
+@pytest.fixture
+def stub_server():
+    """ Start stub_server.py on an ephemeral port; yields (base url, handler class to configure) """
+    handler = type("TestStubHandler", (StubHandler,), {})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1", handler
+    server.shutdown()
+    server.server_close()
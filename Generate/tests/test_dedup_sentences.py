@@ -0,0 +1,24 @@
+# Tests of the LSH band choice and candidate recall of dedup_sentences.py
+
+import pytest
+
+from dedup_sentences import LSH_RECALL, read_sentences, get_shingles, minhash_signatures, choose_bands, lsh_recall, lsh_candidates
+
+@pytest.mark.parametrize("num_perm", [64, 128])
+@pytest.mark.parametrize("threshold", [0.5, 0.6, 0.7, 0.8, 0.9])
+def test_bands_reach_the_expected_recall(threshold, num_perm):
+    bands, rows = choose_bands(threshold, num_perm)
+    assert bands * rows <= num_perm
+    assert lsh_recall(threshold, bands, rows) >= LSH_RECALL
+    assert (1 / bands) ** (1 / rows) < threshold # S-curve midpoint below the threshold
+
+@pytest.mark.parametrize("threshold", [0.6, 0.8])
+def test_candidates_cover_similar_pairs(threshold):
+    sentences = [row[0] for row in read_sentences("mwo_sentences/order_synthetic.csv")]
+    shingle_sets = list(dict.fromkeys(frozenset(get_shingles(sentence)) for sentence in sentences))
+    similar = {(a, b) for a in range(len(shingle_sets)) for b in range(a + 1, len(shingle_sets))
+               if len(shingle_sets[a] & shingle_sets[b]) >= threshold * len(shingle_sets[a] | shingle_sets[b])}
+    bands, rows = choose_bands(threshold)
+    candidates = {tuple(sorted(pair)) for pair in lsh_candidates(minhash_signatures(shingle_sets, bands * rows),
+                                                                   [0] * len(shingle_sets), bands, rows)}
+    assert len(similar & candidates) >= LSH_RECALL * len(similar)
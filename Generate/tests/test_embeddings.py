@@ -0,0 +1,71 @@
+# Tests of the embedding service and its on-disk cache with a deterministic encoder
+
+import zlib
+import numpy as np
+import pytest
+
+from embeddings import EMBEDDINGS, EMBEDDING_STATS, EMBEDDING_STATE, set_encoder, configure_embeddings, encode, cosine_similarity
+from llm_prompt import check_similarity
+
+ORIGINAL = "Avoid verbosity and use minimal stop words."
+PARAPHRASES = ["Use minimal stop words and avoid verbosity.", "Be brief and skip filler words.", "Each sentence can have a maximum of 8 words."]
+
+# Function to embed texts as hashed character trigram counts
+def trigram_encoder(texts, calls):
+    """ Deterministic stand-in for the sentence transformer; records each batch it encodes """
+    calls.append(list(texts))
+    vectors = np.zeros((len(texts), 64), dtype=np.float32)
+    for i, text in enumerate(texts):
+        text = f"  {text.lower()} "
+        for j in range(len(text) - 2):
+            vectors[i, zlib.crc32(text[j:j + 3].encode("utf-8")) % 64] += 1
+    return vectors
+
+@pytest.fixture
+def encoder_calls(monkeypatch, tmp_path):
+    """ Use the trigram encoder and a temporary cache; yields the list of encoded batches """
+    calls = []
+    for name in ("encoder", "name", "conn"):
+        monkeypatch.setitem(EMBEDDING_STATE, name, None)
+    monkeypatch.setitem(EMBEDDINGS, "path", EMBEDDINGS["path"])
+    for name in list(EMBEDDING_STATS):
+        monkeypatch.setitem(EMBEDDING_STATS, name, 0)
+    set_encoder(lambda texts: trigram_encoder(texts, calls), "trigram-test")
+    configure_embeddings(path=str(tmp_path / "embedding_cache.db"))
+    yield calls
+    if EMBEDDING_STATE["conn"] is not None:
+        EMBEDDING_STATE["conn"].close()
+
+def test_cold_and_warm_cache(encoder_calls, tmp_path):
+    texts = [ORIGINAL] + PARAPHRASES
+    cold = encode(texts)
+    assert (EMBEDDING_STATS["hits"], EMBEDDING_STATS["misses"]) == (0, 4)
+    assert encoder_calls == [texts] # Uncached texts are encoded in one batch
+
+    warm = encode(texts)
+    assert (EMBEDDING_STATS["hits"], EMBEDDING_STATS["misses"]) == (4, 4)
+    assert len(encoder_calls) == 1
+    np.testing.assert_array_equal(cold, warm)
+
+    # Only the new text is encoded, and the cache is read back from disk after reopening
+    configure_embeddings(path=str(tmp_path / "other.db"))
+    configure_embeddings(path=str(tmp_path / "embedding_cache.db"))
+    encode([ORIGINAL, "Pump is leaking."])
+    assert (EMBEDDING_STATS["hits"], EMBEDDING_STATS["misses"]) == (5, 5)
+    assert encoder_calls[1:] == [["Pump is leaking."]]
+
+def test_encoders_do_not_share_cached_embeddings(encoder_calls):
+    encode(PARAPHRASES)
+    set_encoder(lambda texts: 2 * trigram_encoder(texts, encoder_calls), "trigram-test-2")
+    encode(PARAPHRASES)
+    assert (EMBEDDING_STATS["hits"], EMBEDDING_STATS["misses"]) == (0, 6)
+
+def test_check_similarity_matches_direct_cosine(encoder_calls):
+    vectors = trigram_encoder([ORIGINAL] + PARAPHRASES, [])
+    expected = [float(np.dot(vectors[0], vector) / (np.linalg.norm(vectors[0]) * np.linalg.norm(vector)))
+                for vector in vectors[1:]]
+    for _ in range(2): # Cold and warm cache
+        similarity = check_similarity(ORIGINAL, PARAPHRASES)
+        assert similarity == pytest.approx(expected, abs=1e-6)
+    assert similarity[0] > similarity[2] # The reordered paraphrase is closest
+    assert cosine_similarity(vectors[0], vectors[:1]) == pytest.approx([1.0])
@@ -0,0 +1,99 @@
+# Tests of the async generation engine against the local stub server
+
+import time
+import random
+import asyncio
+import pytest
+from openai import AsyncOpenAI, BadRequestError
+
+import llm_generate
+from llm_async import new_limits, limited_completion, generate_all
+from llm_generate import process_mwo_response
+from stub_server import StubHandler, stub_completion
+
+PROMPT_VARIATIONS = (
+    ["Generate 5 different Maintenance Work Order (MWO) sentences describing the following equipment and undesirable event."],
+    ["Avoid verbosity and use minimal stop words."],
+    ["Each sentence can have a maximum of 8 words."]
+)
+PATHS = [{"object_name": f"pump {i}", "object_type": "PhysicalObject", "event_name": "leaking"} for i in range(20)]
+
+@pytest.fixture(autouse=True)
+def fewshot(monkeypatch):
+    """ Use a one-message few-shot prefix instead of building (and saving) the fewshot json """
+    key = tuple(tuple(variants) for variants in PROMPT_VARIATIONS)
+    monkeypatch.setitem(llm_generate.FEWSHOT_CACHE, key,
+                        ({"role": "system", "content": "You are a technician recording maintenance work orders."},))
+
+# Function to run generate_all and collect its results in callback order
+def run_generate_all(base_url, limits, paths=PATHS):
+    results = []
+    client = AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=0)
+    stats = asyncio.run(generate_all(client, PROMPT_VARIATIONS, paths, lambda path, sentences: results.append((path, sentences)),
+                                     limits, report_every=0))
+    return results, stats
+
+# Function to make n concurrent requests through the limits
+async def make_requests(base_url, limits, n):
+    client = AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=0)
+    messages = [{"role": "user", "content": "Generate MWO sentences.\nEquipment: pump\nUndesirable Event: leaking"}]
+    return await asyncio.gather(*[limited_completion(client, limits, messages) for _ in range(n)])
+
+def test_results_are_passed_in_path_order(stub_server):
+    base_url, handler = stub_server
+    def jittered_post(self):
+        time.sleep(random.uniform(0, 0.05)) # Later paths often finish first
+        StubHandler.do_POST(self)
+    handler.do_POST = jittered_post
+
+    results, stats = run_generate_all(base_url, new_limits(concurrency=8))
+    assert [path for path, _ in results] == PATHS
+    for path, sentences in results:
+        expected = process_mwo_response(stub_completion([{"role": "user", "content":
+                                        f"Equipment: {path['object_name']}\nUndesirable Event: {path['event_name']}"}]))
+        assert sentences == expected
+    assert stats["requests"] == len(PATHS)
+    assert stats["retries"] == 0
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retryable_errors_are_retried(stub_server, status):
+    base_url, handler = stub_server
+    handler.error_rate, handler.error_status = 0.3, status
+    random.seed(status)
+    limits = new_limits(concurrency=4, max_retries=20, base_delay=0.01, max_delay=0.05)
+    results, stats = run_generate_all(base_url, limits)
+    assert [path for path, _ in results] == PATHS
+    assert stats["requests"] == len(PATHS)
+    assert stats["retries"] > 0
+
+def test_other_errors_are_not_retried(stub_server):
+    base_url, handler = stub_server
+    handler.error_rate, handler.error_status = 1.0, 400
+    limits = new_limits(concurrency=1, max_retries=5, base_delay=0.01)
+    with pytest.raises(BadRequestError):
+        asyncio.run(make_requests(base_url, limits, 1))
+    assert limits["stats"]["retries"] == 0
+
+def test_requests_per_minute_limit(stub_server):
+    base_url, _ = stub_server
+    async def run():
+        limits = new_limits(concurrency=8, rpm=600, tpm=10 ** 7)
+        limits["requests"]["tokens"] = 0 # Start from an empty bucket: 10 requests per second
+        start = time.perf_counter()
+        await make_requests(base_url, limits, 6)
+        return time.perf_counter() - start
+    elapsed = asyncio.run(run())
+    assert 0.5 <= elapsed < 3.0
+
+def test_tokens_per_minute_limit(stub_server):
+    base_url, _ = stub_server
+    async def run():
+        limits = new_limits(concurrency=8, rpm=10 ** 6, tpm=60 * 500)
+        limits["tokens"]["tokens"] = 0 # Start from an empty bucket: 500 tokens per second
+        start = time.perf_counter()
+        await make_requests(base_url, limits, 6)
+        return time.perf_counter() - start, limits["stats"]["tokens"]
+    elapsed, tokens = asyncio.run(run())
+    # Every token used (estimates are corrected to the actual usage) had to be refilled first
+    assert elapsed >= 0.8 * tokens / 500
+    assert elapsed < 10.0
@@ -0,0 +1,90 @@
+# Tests of the batch mode round trip (compile, simulate, ingest, merge) without the API
+
+import os
+import json
+import pytest
+
+import llm_generate
+from llm_batch import PROMPTS_FILE, save_prompts, get_run_prompts, request_id, compile_batch, simulate_batch, ingest_results
+from llm_generate import process_mwo_response
+from run_manifest import open_run, pending_paths, merge_run
+from stub_server import stub_completion
+
+PROMPT_VARIATIONS = (
+    ["Generate 5 different Maintenance Work Order (MWO) sentences describing the following equipment and undesirable event."],
+    ["Avoid verbosity and use minimal stop words."],
+    ["Each sentence can have a maximum of 8 words."]
+)
+PATHS = [{"object_name": f"pump {i}", "object_type": "PhysicalObject", "event_name": "leaking"} for i in range(6)]
+
+@pytest.fixture(autouse=True)
+def no_fewshot_snapshot(monkeypatch):
+    """ Build the few-shot messages from the csv without saving them over the repo snapshot """
+    monkeypatch.setattr(llm_generate, "save_fewshot_snapshot", lambda message: False)
+
+# Function to run compile and simulate on the latest batch of a run
+def compile_and_simulate(run, num_completions=1):
+    filename = compile_batch(run, get_run_prompts(run), num_completions)
+    results_file = os.path.join(run["dir"], filename.replace(".jsonl", ".results.jsonl"))
+    simulate_batch(os.path.join(run["dir"], filename), results_file)
+    return filename, results_file
+
+# Function to read the json lines of a file
+def read_jsonl(filepath):
+    with open(filepath, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_run_prompts_are_reused(tmp_path):
+    prompts_file = tmp_path / "prompts.json"
+    save_prompts(prompts_file, PROMPT_VARIATIONS)
+    run = open_run(str(tmp_path / "run"), PATHS)
+    assert get_run_prompts(run, prompts_file=prompts_file) == PROMPT_VARIATIONS
+    # Later compiles read the copy in the run directory and never need a client
+    assert os.path.exists(os.path.join(run["dir"], PROMPTS_FILE))
+    assert get_run_prompts(open_run(run["dir"], resume=True)) == PROMPT_VARIATIONS
+
+@pytest.mark.parametrize("num_completions", [1, 5])
+def test_local_round_trip(tmp_path, num_completions):
+    run = open_run(str(tmp_path / "run"), PATHS)
+    save_prompts(os.path.join(run["dir"], PROMPTS_FILE), PROMPT_VARIATIONS)
+    filename, results_file = compile_and_simulate(run, num_completions)
+
+    requests = read_jsonl(os.path.join(run["dir"], filename))
+    assert [request["custom_id"] for request in requests] == \
+           [request_id(path, completion) for path in PATHS for completion in range(num_completions)]
+    num_paths, errors = ingest_results(run, results_file, num_completions)
+    assert (num_paths, errors) == (len(PATHS), {})
+    assert pending_paths(run) == []
+
+    out_log, out_csv = str(tmp_path / "log.txt"), str(tmp_path / "order_synthetic.csv")
+    assert merge_run(run, out_log, out_csv)
+    with open(out_csv, encoding='utf-8') as f:
+        rows = f.read().splitlines()
+    for path in PATHS:
+        expected = process_mwo_response(stub_completion([{"role": "user", "content":
+                                        f"Equipment: {path['object_name']}\nUndesirable Event: {path['event_name']}"}]))
+        written = [row.split(",")[0] for row in rows if row.endswith(f",{path['object_name']},{path['event_name']}")]
+        assert sorted(written) == sorted(set(expected))
+    assert not merge_run(open_run(run["dir"], resume=True), out_log, out_csv) # Merged once
+
+def test_failed_requests_are_compiled_again(tmp_path):
+    run = open_run(str(tmp_path / "run"), PATHS)
+    save_prompts(os.path.join(run["dir"], PROMPTS_FILE), PROMPT_VARIATIONS)
+    _, results_file = compile_and_simulate(run)
+
+    # Fail the requests of the first two paths
+    results = read_jsonl(results_file)
+    for result in results[:2]:
+        result["response"]["status_code"] = 500
+    with open(results_file, "w", encoding='utf-8') as f:
+        f.write("".join(json.dumps(result) + "\n" for result in results))
+    num_paths, errors = ingest_results(run, results_file)
+    assert num_paths == len(PATHS) - 2 and len(errors) == 2
+
+    # A resumed compile only writes requests for the failed paths, with the same prompts
+    run = open_run(run["dir"], resume=True)
+    assert pending_paths(run) == PATHS[:2]
+    filename, results_file = compile_and_simulate(run)
+    assert len(read_jsonl(os.path.join(run["dir"], filename))) == 2
+    assert ingest_results(run, results_file) == (2, {})
+    assert pending_paths(run) == []
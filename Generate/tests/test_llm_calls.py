@@ -0,0 +1,75 @@
+# Tests of retry counting and metrics flushing of llm_calls.chat_completion against the local stub server
+
+import json
+import pytest
+from openai import OpenAI, BadRequestError
+
+import llm_calls
+from llm_calls import LLM_METRICS, LLM_METRICS_STATE, LLM_RETRY, chat_completion, record_sentences, report_metrics
+from stub_server import StubHandler
+
+MESSAGES = [{"role": "user", "content": "Generate MWO sentences.\nEquipment: pump\nUndesirable Event: leaking"}]
+
+@pytest.fixture
+def metrics(monkeypatch, tmp_path):
+    """ Record metrics into a temporary file; yields the file path """
+    path = tmp_path / "llm_metrics.jsonl"
+    monkeypatch.setitem(LLM_METRICS, "enabled", True)
+    monkeypatch.setitem(LLM_METRICS, "path", str(path))
+    monkeypatch.setitem(LLM_METRICS, "flush_every", 2)
+    monkeypatch.setattr(llm_calls, "LLM_METRICS_RECORDS", [])
+    monkeypatch.setitem(LLM_METRICS_STATE, "unwritten", [])
+    monkeypatch.setitem(LLM_RETRY, "base_delay", 0.01)
+    yield path
+    report_metrics() # Writes the rest now rather than into the repo file at exit
+
+# Function to fail the first failures requests to the stub server with status
+def failing_handler(handler, failures, status):
+    """ Make handler answer the first failures requests with status; returns the list of request statuses """
+    statuses = []
+    def do_POST(self):
+        if len(statuses) < failures:
+            statuses.append(status)
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_json(status, {"error": {"message": "Stub error", "type": "stub_error"}})
+        else:
+            statuses.append(200)
+            StubHandler.do_POST(self)
+    handler.do_POST = do_POST
+    return statuses
+
+# Function to read the records of a metrics file
+def read_records(path):
+    if not path.exists():
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+@pytest.mark.parametrize("status", [429, 500])
+def test_retries_are_counted(stub_server, metrics, status):
+    base_url, handler = stub_server
+    statuses = failing_handler(handler, 2, status)
+    # The client's own retries (2 by default) are turned off by chat_completion
+    client = OpenAI(api_key="stub", base_url=base_url)
+    response = chat_completion(client, "gpt-4o-mini", MESSAGES, stage="test")
+    assert response.choices[0].message.content
+    assert statuses == [status, status, 200]
+    assert llm_calls.LLM_METRICS_RECORDS[-1]["retries"] == 2
+
+def test_other_errors_are_not_retried(stub_server, metrics):
+    base_url, handler = stub_server
+    statuses = failing_handler(handler, 5, 400)
+    with pytest.raises(BadRequestError):
+        chat_completion(OpenAI(api_key="stub", base_url=base_url), "gpt-4o-mini", MESSAGES, stage="test")
+    assert statuses == [400]
+
+def test_metrics_are_flushed_during_the_run(stub_server, metrics):
+    base_url, _ = stub_server
+    client = OpenAI(api_key="stub", base_url=base_url, max_retries=0)
+    for i in range(5):
+        response = chat_completion(client, "gpt-4o-mini", MESSAGES, stage="test")
+        record_sentences(response, i)
+    # Records of calls with their sentence counts are flushed every flush_every records
+    assert [record["sentences"] for record in read_records(metrics)] == [0, 1, 2, 3]
+    report_metrics()
+    assert [record["sentences"] for record in read_records(metrics)] == [0, 1, 2, 3, 4]
@@ -0,0 +1,122 @@
+# Tests of the SQLite path store against the path pattern json files it is loaded from
+
+import os
+import json
+import random
+import pytest
+
+import path_store
+from path_store import SCHEMA_VERSION, get_pattern_files, open_path_store, count_paths, query_paths, sample_paths
+from llm_generate import get_all_paths
+
+# Function to create the paths of a pattern with every valid / failure mode combination
+def make_paths(pattern, num_paths):
+    paths = []
+    for i in range(num_paths):
+        path = {"object_name": f"{pattern} object {i}", "object_type": "PhysicalObject",
+                "event_name": f"event {i % 3}", "valid": i % 3 != 0, "alternate": i % 4 == 0}
+        if i % 2:
+            path["failure_mode"] = f"FM{i % 5}"
+        paths.append(path)
+    return paths
+
+# Function to keep the paths of a pattern file as get_all_paths did when reading the json files
+def filter_paths(paths, valid, label):
+    if valid and label:
+        return [path for path in paths if path['valid'] == valid and 'failure_mode' in path]
+    elif valid:
+        return [path for path in paths if path['valid'] == valid]
+    elif label:
+        return [path for path in paths if 'failure_mode' in path]
+    return paths
+
+# Function to write a pattern file
+def write_paths(filepath, paths):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(paths, f)
+
+@pytest.fixture
+def patterns(monkeypatch, tmp_path):
+    """ Write pattern files of 0 to 16 paths into a tmp dir used as PATTERN_DIR; yields {pattern: paths} """
+    pattern_dir = tmp_path / "path_patterns"
+    pattern_dir.mkdir()
+    monkeypatch.setattr(path_store, "PATTERN_DIR", str(pattern_dir))
+    monkeypatch.setattr(path_store, "PATH_STORE", str(pattern_dir / "paths.db"))
+    patterns = {}
+    for i, (pattern, filepath) in enumerate(get_pattern_files()):
+        patterns[pattern] = make_paths(pattern, 2 * i)
+        write_paths(filepath, patterns[pattern])
+    yield patterns
+
+def test_default_paths_do_not_depend_on_cwd(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    assert all(os.path.exists(filepath) for _, filepath in get_pattern_files())
+    assert os.path.dirname(path_store.PATH_STORE) == path_store.PATTERN_DIR
+
+@pytest.mark.parametrize("valid", [True, False])
+@pytest.mark.parametrize("label", [True, False])
+def test_store_matches_pattern_files(patterns, valid, label):
+    paths_list, paths_dict = get_all_paths(valid=valid, label=label)
+    expected = {pattern: filter_paths(paths, valid, label) for pattern, paths in patterns.items()}
+    assert paths_dict == expected
+    assert paths_list == [path for paths in expected.values() for path in paths]
+    store = open_path_store()
+    assert count_paths(store, valid=valid, label=label) == {pattern: len(paths) for pattern, paths in expected.items()}
+    store.close()
+
+@pytest.mark.parametrize("valid", [True, False])
+@pytest.mark.parametrize("label", [True, False])
+@pytest.mark.parametrize("num_samples", [1, 5, 100])
+def test_sample_paths(patterns, valid, label, num_samples):
+    store = open_path_store()
+    exclude = [next(iter(patterns))]
+    samples = sample_paths(store, num_samples=num_samples, valid=valid, label=label, exclude=exclude,
+                           rng=random.Random(num_samples))
+    store.close()
+    for pattern, paths in patterns.items():
+        expected = [json.dumps(path, sort_keys=True) for path in filter_paths(paths, valid, label)]
+        sampled = [json.dumps(path, sort_keys=True) for path in samples if path["object_name"].startswith(f"{pattern} ")]
+        # Distinct paths of the stratum, as many as asked for or all of them
+        assert len(sampled) == len(set(sampled))
+        assert set(sampled) <= set(expected)
+        assert len(sampled) == (0 if pattern in exclude else min(num_samples, len(expected)))
+
+def test_store_is_rebuilt_when_a_pattern_file_changes(patterns):
+    pattern, filepath = get_pattern_files()[-1]
+    store = open_path_store()
+    assert query_paths(store, pattern=pattern, valid=False) == patterns[pattern]
+    store.close()
+
+    # Size changes
+    paths = patterns[pattern] + make_paths(pattern, 3)[1:]
+    write_paths(filepath, paths)
+    store = open_path_store()
+    assert query_paths(store, pattern=pattern, valid=False) == paths
+    store.close()
+
+    # Same size, only the modification time changes
+    paths[0]["object_name"], paths[1]["object_name"] = paths[1]["object_name"], paths[0]["object_name"]
+    size = os.path.getsize(filepath)
+    mtime = os.stat(filepath).st_mtime
+    write_paths(filepath, paths)
+    os.utime(filepath, (mtime + 10, mtime + 10))
+    assert os.path.getsize(filepath) == size
+    store = open_path_store()
+    assert query_paths(store, pattern=pattern, valid=False) == paths
+    store.close()
+
+def test_store_of_an_older_schema_is_rebuilt(patterns):
+    store = open_path_store()
+    num_paths = sum(count_paths(store, valid=False).values())
+    # A store of another schema version keeps its (up to date) sources, so it is only rebuilt if dropped
+    store.execute("INSERT INTO paths (pattern, pattern_index, position, valid, alternate, has_failure_mode, "
+                  "stratum_pos, path) VALUES ('stale', 0, 0, 1, 0, 0, 0, '{}')")
+    store.execute(f"PRAGMA user_version = {SCHEMA_VERSION - 1}")
+    store.commit()
+    store.close()
+
+    store = open_path_store()
+    assert store.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert store.execute("SELECT COUNT(*) FROM paths WHERE pattern = 'stale'").fetchone()[0] == 0
+    assert store.execute("SELECT COUNT(*) FROM paths").fetchone()[0] == num_paths
+    store.close()
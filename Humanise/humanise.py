@@ -1,35 +1,214 @@
 import os
 import re
 import csv
+import sys
+import glob
+import pickle
+import hashlib
 import random
 import nltk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
 from nltk.corpus import cmudict
 from Levenshtein import distance as levenshtein_distance
 
+sys.path.append(os.path.abspath('../Generate'))
+
+from llm_calls import chat_completion, record_sentences
+from typo_model import read_typo_pairs, compile_typo_model, apply_typo
+
 # Global variables
 CONTRACTIONS_DICT = {}      # {expand: [contractions]}
 ABBREVIATIONS_DICT = {}     # {original: [variations]}
 KEYBOARD_DICT = {}          # {key: [adjacent]}
 CMU_DICT = {}               # CMU pronouncing dictionary
+CONTRACTIONS_MATCHER = {}   # Phrase matcher of CONTRACTIONS_DICT keys
+ABBREVIATIONS_MATCHER = {}  # Phrase matcher of ABBREVIATIONS_DICT keys
+HOMOPHONE_DICT = {}         # {word: [homophones within edit distance 1]}
+PRONUNCIATION_DICT = {}     # {first pronunciation: [words]}, built from CMU_DICT for words not in HOMOPHONE_DICT
+CMU_FILE = None             # Pickled CMU_DICT of the resource bundle (cmudict-<checksum>.pkl), loaded on first use
+TYPO_MODEL = {}             # Alias tables of typo edits learned from MaintNorm (typo_model.py)
+
+# Typo types of the LLM typo prompts (single sentence and batched)
+TYPO_INSTRUCTIONS = (
+    f"Use a mix of the following typo types, but avoid overdoing it. The typo types are:\n"
+    f"1. Missing space between words (e.g., air conditioner -> airconditioner)\n"
+    f"2. Additional space within words (e.g., permalube -> perma lube)\n"
+    f"3. Swapped adjacent characters (e.g., crack -> carck)\n"
+    f"4. Missing characters in a word (e.g., crack -> crak)\n"
+    f"5. Double-up characters in a word (e.g., crack -> craack)\n"
+    f"6. Incorrect character in a word (due to keys proximity) (e.g., crack -> xrack)\n"
+    f"7. Extra characters in a word (due to keys proximity) (e.g., crack -> cracvk)\n"
+    f"8. Incorrect spelling (homophones) (e.g., motor -> moter)\n\n"
+)
+TYPO_SYSTEM = "You are an expert in adding realistic typos to sentences."
+
+# Resource bundle of dictionaries and derived indexes (rebuilt when its sources change)
+RESOURCE_BUNDLE = 'humanise_resources.pkl'
+BUNDLE_VERSION = 4
+BUNDLE_KEYS = ('sources', 'contractions', 'abbreviations', 'keyboard', 'contractions_matcher',
+               'abbreviations_matcher', 'homophones', 'typo_model', 'cmudict')
+
+# The CMU dictionary is pickled on its own, named by its checksum, so it outlives bundle versions
+CMU_FILE_PATTERN = 'cmudict-*.pkl'
 
 def initialise_globals(dirpath):
-    global CONTRACTIONS_DICT, ABBREVIATIONS_DICT, KEYBOARD_DICT, CMU_DICT
+    global CONTRACTIONS_DICT, ABBREVIATIONS_DICT, KEYBOARD_DICT, CMU_DICT, CMU_FILE, PRONUNCIATION_DICT
+    global CONTRACTIONS_MATCHER, ABBREVIATIONS_MATCHER, HOMOPHONE_DICT, TYPO_MODEL
     path = os.path.join(dirpath, 'data', 'Corrections')
-    
-    # Load contractions {expand: [contractions]}
-    CONTRACTIONS_DICT = load_dictionary(os.path.join(path, 'contractions.csv'))
 
-    # Load abbreviations {original: [variations]}
-    ABBREVIATIONS_DICT = load_dictionary(os.path.join(path, 'abbreviations.csv'))
+    # Load the resource bundle, rebuilding it if the dictionaries or the words of the generated sentences changed
+    # or its CMU dictionary file is gone
+    bundle_file = os.path.join(path, RESOURCE_BUNDLE)
+    sources = get_source_hashes(dirpath)
+    bundle = load_bundle(bundle_file)
+    if bundle is None or bundle['sources'] != sources or not os.path.exists(os.path.join(path, bundle['cmudict'])):
+        bundle = build_bundle(dirpath, sources, bundle)
+        save_bundle(bundle_file, bundle)
 
-    # Load keyboard adjacent letters {key: [adjacent]}
-    KEYBOARD_DICT = load_dictionary(os.path.join(path, 'keyboard.csv'))
-    
-    # Load CMU pronouncing dictionary
-    nltk.download('cmudict')
-    CMU_DICT = cmudict.dict()
+    CONTRACTIONS_DICT = bundle['contractions']          # {expand: [contractions]}
+    ABBREVIATIONS_DICT = bundle['abbreviations']        # {original: [variations]}
+    KEYBOARD_DICT = bundle['keyboard']                  # {key: [adjacent]}
+    CONTRACTIONS_MATCHER = bundle['contractions_matcher']
+    ABBREVIATIONS_MATCHER = bundle['abbreviations_matcher']
+    HOMOPHONE_DICT = bundle['homophones']               # {word: [homophones]} of the generated vocabulary
+    TYPO_MODEL = bundle['typo_model']                   # Empirical typo model of MaintNorm
+
+    # CMU pronouncing dictionary is only needed for words outside HOMOPHONE_DICT
+    CMU_DICT, CMU_FILE, PRONUNCIATION_DICT = {}, os.path.join(path, bundle['cmudict']), {}
+
+# Hash the sources of the resource bundle
+def get_source_hashes(dirpath):
+    """ Return {file: sha1} of the dictionary csv files and MaintNorm typo data, and the sha1 of the
+        vocabulary of the generated sentences. Only the vocabulary is hashed for the sentences, as the
+        homophone index depends on nothing else, so new sentences of known words keep the bundle. """
+    files = [os.path.join(dirpath, 'data', 'Corrections', f'{name}.csv')
+             for name in ('contractions', 'abbreviations', 'keyboard', 'maintnorm_corrections')]
+    files += sorted(glob.glob(os.path.join(dirpath, 'data', 'MaintNorm', '*.norm')))
+    hashes = {}
+    for file in files:
+        with open(file, 'rb') as f:
+            hashes[os.path.relpath(file, dirpath)] = hashlib.sha1(f.read()).hexdigest()
+    vocabulary = get_vocabulary(dirpath, [])
+    hashes['vocabulary'] = hashlib.sha1('\n'.join(vocabulary).encode('utf-8')).hexdigest()
+    return hashes
+
+# Build the resource bundle
+def build_bundle(dirpath, sources, old_bundle=None):
+    """ Load the dictionaries, build the phrase matchers and the homophone index. The CMU
+        dictionary file of the old bundle (or another saved one) is reused, so a rebuild does
+        not need NLTK data; without one it is loaded from NLTK and saved. """
+    global CMU_DICT, PRONUNCIATION_DICT
+    path = os.path.join(dirpath, 'data', 'Corrections')
+    contractions = load_dictionary(os.path.join(path, 'contractions.csv'))
+    abbreviations = load_dictionary(os.path.join(path, 'abbreviations.csv'))
+    cmu_name, CMU_DICT, PRONUNCIATION_DICT = find_cmu_file(path, old_bundle['cmudict'] if old_bundle else None), None, {}
+    if cmu_name is not None:
+        CMU_DICT = load_cmu_file(os.path.join(path, cmu_name))
+    if not CMU_DICT:
+        CMU_DICT = load_cmudict()
+        cmu_name = save_cmu_file(path, CMU_DICT)
+    bundle = {
+        'sources': sources,
+        'contractions': contractions,
+        'abbreviations': abbreviations,
+        'keyboard': load_dictionary(os.path.join(path, 'keyboard.csv')),
+        'contractions_matcher': build_matcher(contractions),
+        'abbreviations_matcher': build_matcher(abbreviations),
+        'homophones': build_homophone_index(get_vocabulary(dirpath, [contractions, abbreviations])),
+        'typo_model': compile_typo_model(read_typo_pairs(dirpath)),
+        'cmudict': cmu_name
+    }
+    print(f"Built humanise resource bundle ({len(bundle['homophones'])} words in homophone index)")
+    return bundle
+
+# Save a pickle with a checksum
+def save_checksummed(file, payload, version=None):
+    """ Pickle payload bytes with their sha256 checksum (and a format version), replacing the file atomically """
+    tmp_file = f'{file}.{os.getpid()}.tmp' # One temporary file per process, in case several rebuild at once
+    with open(tmp_file, 'wb') as f:
+        pickle.dump({'version': version, 'checksum': hashlib.sha256(payload).hexdigest(),
+                     'payload': payload}, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, file)
+
+# Load a pickle saved by save_checksummed
+def load_checksummed(file, version=None):
+    """ Return the payload bytes, or None if the file is missing, unreadable, of another version or fails its checksum """
+    try:
+        with open(file, 'rb') as f:
+            wrapper = pickle.load(f)
+        if wrapper['version'] == version and hashlib.sha256(wrapper['payload']).hexdigest() == wrapper['checksum']:
+            return wrapper['payload']
+    except Exception: # Missing, truncated, corrupt or not written by save_checksummed
+        pass
+    return None
+
+# Save the resource bundle
+def save_bundle(file, bundle):
+    """ Pickle the bundle with its version and a sha256 checksum, replacing the file atomically """
+    save_checksummed(file, pickle.dumps(bundle, pickle.HIGHEST_PROTOCOL), BUNDLE_VERSION)
+
+# Load the resource bundle
+def load_bundle(file):
+    """ Return the bundle, or None if it is missing, of another version, fails its checksum or
+        cannot be unpickled as a bundle (it is then rebuilt) """
+    payload = load_checksummed(file, BUNDLE_VERSION)
+    if payload is None:
+        return None
+    try:
+        bundle = pickle.loads(payload)
+        if all(key in bundle for key in BUNDLE_KEYS):
+            return bundle
+    except Exception:
+        pass
+    return None
+
+# Save the CMU pronouncing dictionary
+def save_cmu_file(path, cmu_dict):
+    """ Pickle the CMU dictionary to cmudict-<checksum>.pkl in path and return the file name """
+    payload = pickle.dumps(cmu_dict, pickle.HIGHEST_PROTOCOL)
+    name = CMU_FILE_PATTERN.replace('*', hashlib.sha256(payload).hexdigest()[:16])
+    save_checksummed(os.path.join(path, name), payload)
+    return name
+
+# Load a saved CMU pronouncing dictionary
+def load_cmu_file(file):
+    """ Return the CMU dictionary of a cmudict-<checksum>.pkl file, or None if it is missing or invalid """
+    payload = load_checksummed(file)
+    if payload is None or os.path.basename(file) != CMU_FILE_PATTERN.replace('*', hashlib.sha256(payload).hexdigest()[:16]):
+        return None
+    try:
+        return pickle.loads(payload)
+    except Exception:
+        return None
+
+# Find a saved CMU pronouncing dictionary
+def find_cmu_file(path, preferred=None):
+    """ Return the name of the preferred CMU dictionary file if it exists, else of the newest one in path, or None """
+    if preferred and os.path.exists(os.path.join(path, preferred)):
+        return preferred
+    files = sorted(glob.glob(os.path.join(path, CMU_FILE_PATTERN)), key=os.path.getmtime, reverse=True)
+    return os.path.basename(files[0]) if files else None
+
+# Load CMU pronouncing dictionary from NLTK data
+def load_cmudict():
+    """ Load CMU pronouncing dictionary, downloading it only if NLTK data does not have it """
+    try:
+        return cmudict.dict()
+    except LookupError:
+        nltk.download('cmudict')
+        return cmudict.dict()
+
+# Get CMU pronouncing dictionary
+def get_cmu_dict():
+    """ Unpickle CMU pronouncing dictionary from the file of the resource bundle on first use
+        (from NLTK data if there is no bundle or its file is invalid) """
+    global CMU_DICT
+    if not CMU_DICT:
+        CMU_DICT = (load_cmu_file(CMU_FILE) if CMU_FILE else None) or load_cmudict()
+    return CMU_DICT
 
 # Load abbreviations dictionary
 def load_dictionary(file):
@@ -50,54 +229,112 @@ def load_dictionary(file):
     dictionary = dict(sorted(dictionary.items()))
     return dictionary
 
-# Shuffle the dictionary
-def shuffle_dictionary(d):
-    """ Shuffle the dictionary """
-    items = list(d.items())  # Convert dictionary to list of items
-    random.shuffle(items)    # Shuffle the list
-    return dict(items)       # Convert list back to dictionary
+# Build a phrase matcher of dictionary keys
+def build_matcher(dictionary):
+    """ Build an Aho-Corasick automaton of the (case-folded) dictionary keys, so every key
+        occurring in a sentence is found in one pass, and compile the whole-word pattern of each key """
+    keys = list(dictionary)
+    goto, fail, output = [{}], [0], [set()]
+    for index, key in enumerate(keys):
+        state = 0
+        for char in key.lower():
+            if char not in goto[state]:
+                goto[state][char] = len(goto)
+                goto.append({})
+                fail.append(0)
+                output.append(set())
+            state = goto[state][char]
+        output[state].add(index)
+    # Failure links in breadth-first order, each state also reports the keys of its failure state
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            link = fail[state]
+            while link and char not in goto[link]:
+                link = fail[link]
+            fail[next_state] = goto[link].get(char, 0)
+            output[next_state] |= output[fail[next_state]]
+    # Match whole word. Keys are not re.escape'd on purpose: the rules substituted with the raw key
+    # before the matcher existed, and seeded runs must stay the same (no key has regex metacharacters)
+    patterns = [re.compile(r'\b' + key + r'\b', re.I) for key in keys]
+    return {"keys": keys, "goto": goto, "fail": fail, "output": output, "patterns": patterns}
+
+# Find the dictionary keys occurring in a sentence
+def find_keys(matcher, sentence):
+    """ Return indexes of keys occurring anywhere in the sentence (case-insensitive) """
+    goto, fail, output = matcher["goto"], matcher["fail"], matcher["output"]
+    state, found = 0, set()
+    for char in sentence.lower():
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        if output[state]:
+            found |= output[state]
+    return found
+
+# Count an application of a humanise rule
+def count_rule(counts, rule):
+    """ Increment counts[rule] if counts are being collected """
+    if counts is not None:
+        counts[rule] = counts.get(rule, 0) + 1
 
 # Introduce contractions in a sentence (default probability=0.5)
-def introduce_contractions(sentence, chance=0.5):
+def introduce_contractions(sentence, chance=0.5, rng=random, counts=None):
     """ Introduce contractions in a sentence """
-    contractions = shuffle_dictionary(CONTRACTIONS_DICT) # Shuffle
-    for expanded, contracted in contractions.items():
-        pattern = r'\b' + expanded + r'\b' # Match whole word
-        if re.search(expanded, sentence, re.I) and random.random() < chance: # Case-insensitive
-            sentence = re.sub(pattern, random.choice(contracted), sentence, flags=re.I)
+    keys = CONTRACTIONS_MATCHER["keys"]
+    order = list(range(len(keys)))
+    rng.shuffle(order) # Shuffle (same random draws as shuffling the dictionary)
+    found = find_keys(CONTRACTIONS_MATCHER, sentence)
+    for index in order:
+        if index in found and rng.random() < chance: # Case-insensitive
+            contracted = CONTRACTIONS_DICT[keys[index]]
+            replaced = CONTRACTIONS_MATCHER["patterns"][index].sub(rng.choice(contracted), sentence)
+            if replaced != sentence:
+                sentence = replaced
+                found = find_keys(CONTRACTIONS_MATCHER, sentence)
+                count_rule(counts, 'contractions')
     return sentence
 
 # Introduce abbreviations in a sentence (default probability=0.4)
-def introduce_abbreviations(sentence, chance=0.4):
+def introduce_abbreviations(sentence, chance=0.4, rng=random, counts=None):
     """ Introduce abbreviations in a sentence """
-    abbreviations = shuffle_dictionary(ABBREVIATIONS_DICT) # Shuffle
-    for original, variations in abbreviations.items():
-        pattern = r'\b' + original + r'\b' # Match whole word
+    keys = ABBREVIATIONS_MATCHER["keys"]
+    order = list(range(len(keys)))
+    rng.shuffle(order) # Shuffle (same random draws as shuffling the dictionary)
+    found = find_keys(ABBREVIATIONS_MATCHER, sentence)
+    for index in order:
         # Check if original word is in sentence
-        if re.search(original, sentence, re.I) and random.random() < chance: # Case-insensitive
-            variation = random.choice(variations)
-            variation = add_periods(original, variation)
-            sentence = re.sub(pattern, variation, sentence, flags=re.I)
+        if index in found and rng.random() < chance: # Case-insensitive
+            original = keys[index]
+            variation = rng.choice(ABBREVIATIONS_DICT[original])
+            variation = add_periods(original, variation, rng=rng)
+            replaced = ABBREVIATIONS_MATCHER["patterns"][index].sub(variation, sentence)
+            if replaced != sentence:
+                sentence = replaced
+                found = find_keys(ABBREVIATIONS_MATCHER, sentence)
+                count_rule(counts, 'abbreviations')
     return sentence
 
 # Add periods to abbreviations if condition is met (default probability=0.08)
-def add_periods(original_word, abbreviated_word, chance=0.08):
+def add_periods(original_word, abbreviated_word, chance=0.08, rng=random):
     """ Add periods to an abbreviation if the condition is met """
     original = original_word.lower()
     abbreviation = abbreviated_word.lower()
     words = original.split()
     initials = ''.join(word[0] for word in words if word)
     # Check if abbreviation matches initials
-    if initials == abbreviation and random.random() < chance:
+    if initials == abbreviation and rng.random() < chance:
         return '.'.join(initials) + '.'
     # Check if original starts with abbreviation
-    elif words[0].startswith(abbreviation) and words[0] != abbreviation and random.random() < chance:
+    elif words[0].startswith(abbreviation) and words[0] != abbreviation and rng.random() < chance:
         return abbreviation + '.'
     # Check if original contains abbreviation
-    elif original.find(abbreviation) != -1 and words[0] != abbreviation and random.random() < chance:
+    elif original.find(abbreviation) != -1 and words[0] != abbreviation and rng.random() < chance:
         return abbreviation + '.'
     # Check if original has all abbreviation characters in order
-    elif all(char in iter(original) for char in abbreviation) and random.random() < chance:
+    elif all(char in iter(original) for char in abbreviation) and rng.random() < chance:
         if original.replace('-', '') == abbreviation: # auto-greaser -> autogreaser
             return abbreviation
         if abbreviation in words:
@@ -106,155 +343,306 @@ def add_periods(original_word, abbreviated_word, chance=0.08):
     return abbreviation
 
 # Missing spaces in a sentence
-def omit_space(sentence):
+def omit_space(sentence, rng=random):
     """ Randomly omits a space from the given sentence. """
     space_idx = [idx for idx, char in enumerate(sentence) if char == ' ']
     if not space_idx: # No spaces to omit
         return sentence
-    remove_idx = random.choice(space_idx)
+    remove_idx = rng.choice(space_idx)
     return sentence[:remove_idx] + sentence[remove_idx+1:]
 
 # Extra space in a word
-def add_space(word):
+def add_space(word, rng=random):
     """ Randomly adds a space within a word. """
     if len(word) < 3:
         return word  # Not enough characters to add a space
-    index = random.randint(1, len(word) - 1)  # Ensure space is not at the beginning
+    index = rng.randint(1, len(word) - 1)  # Ensure space is not at the beginning
     return word[:index] + ' ' + word[index:]
 
 # Swap adjacent letters in a word
-def swap_adjacent(word):
+def swap_adjacent(word, rng=random):
     """ Randomly swaps two adjacent letters in a given word. """
     if len(word) < 3: # Not enough letters to swap
         return word
-    index = random.randint(1, len(word) - 2)
+    index = rng.randint(1, len(word) - 2)
     return word[:index] + word[index + 1] + word[index] + word[index + 2:]
 
 # Missing letter in a word
-def omit_letter(word):
+def omit_letter(word, rng=random):
     """ Randomly omits one letter from a given word. """
     if len(word) < 3: # Do not omit from short words
         return word
-    index = random.randint(1, len(word) - 1)
+    index = rng.randint(1, len(word) - 1)
     return word[:index] + word[index + 1:]
 
 # Double up a letter in a word
-def double_letter(word):
+def double_letter(word, rng=random):
     """ Randomly doubles one letter in a given word. """
     if len(word) < 1: # Not a word
         return word
-    index = random.randint(0, len(word) - 1)
+    index = rng.randint(0, len(word) - 1)
     return word[:index + 1] + word[index] + word[index + 1:]
 
 # Replace a letter in a word with an adjacent letter (keyboard)
-def adjacent_key(word):
+def adjacent_key(word, rng=random):
     """ Randomly replaces a letter in a given word with an adjacent letter. """
     if len(word) < 2: # Cannot replace only letter
         return word
-    index = random.randint(1, len(word) - 1)
+    index = rng.randint(1, len(word) - 1)
     letter = word[index]
     if letter in KEYBOARD_DICT:
-        replacement = random.choice(KEYBOARD_DICT[letter])
+        replacement = rng.choice(KEYBOARD_DICT[letter])
         return word[:index] + replacement  + word[index + 1:]
     return word
 
 # Add adjacent letter before or after a letter in a word
-def adjacent_add(word):
+def adjacent_add(word, rng=random):
     """ Randomly adds an adjacent letter before or after a letter in a given word. """
     if len(word) < 2: # Not a word
         return word
-    index = random.randint(1, len(word) - 1)
+    index = rng.randint(1, len(word) - 1)
     letter = word[index]
     if letter in KEYBOARD_DICT:
-        addition = random.choice(KEYBOARD_DICT[letter])
-        if random.random() < 0.5:
+        addition = rng.choice(KEYBOARD_DICT[letter])
+        if rng.random() < 0.5:
             return word[:index] + addition + word[index:]           # Add before
         else:
             return word[:index + 1] + addition + word[index + 1:]   # Add after
     return word
 
+# Get the vocabulary of generated sentences
+def get_vocabulary(dirpath, dictionaries):
+    """ Return the sorted words of the generated MWO sentences (first csv column) and of the
+        dictionary variations (contractions, abbreviations) humanise can introduce into them.
+        Words are split as rule_introduce_typos splits sentences and lowercased as replace_homophone
+        looks them up, so the index holds exactly the words typos are made in. """
+    vocabulary = set()
+    for file in glob.glob(os.path.join(dirpath, 'Generate', 'mwo_sentences', '*.csv')):
+        with open(file, encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if row:
+                    vocabulary.update(word.lower() for word in row[0].split())
+    for dictionary in dictionaries:
+        for variations in dictionary.values():
+            for variation in variations:
+                vocabulary.update(word.lower() for word in variation.split())
+    return sorted(vocabulary)
+
+# Group CMU words by first pronunciation
+def build_pronunciation_dict():
+    """ Group the words of CMU_DICT by their first pronunciation, in CMU_DICT order """
+    pronunciations = {}
+    for w, pron in get_cmu_dict().items():
+        pronunciations.setdefault(tuple(pron[0]), []).append(w)
+    return pronunciations
+
+# Find homophones of a word
+def find_homophones(word):
+    """ Find words with the same first pronunciation and Levenshtein distance <= 1 (in CMU_DICT order) """
+    global PRONUNCIATION_DICT
+    cmu_dict = get_cmu_dict()
+    if word not in cmu_dict:
+        return []  # No pronunciation found
+    if not PRONUNCIATION_DICT:
+        PRONUNCIATION_DICT = build_pronunciation_dict()
+    # Find homophones with the same pronunciation
+    homophones = [w for w in PRONUNCIATION_DICT[tuple(cmu_dict[word][0])] if w != word]
+    # Filter homophones with Levenshtein distance <= 1
+    return [w for w in homophones if levenshtein_distance(word, w) <= 1]
+
+# Build the homophone index of a vocabulary
+def build_homophone_index(vocabulary):
+    """ Return {word: [homophones]} for the words of the vocabulary in CMU_DICT """
+    cmu_dict = get_cmu_dict()
+    return {word: find_homophones(word) for word in vocabulary if word in cmu_dict}
+
 # Replace word with its homophone
-def replace_homophone(word):
+def replace_homophone(word, rng=random):
     """ Replace a word with one of its homophones, if available. """
     word = word.lower()
-    if word not in CMU_DICT:
-        return word  # No pronunciation found
-    word_pron = CMU_DICT[word][0]
-    # Find homophones with the same pronunciation
-    homophones = [w for w, pron in CMU_DICT.items() if pron[0] == word_pron and w != word]
-    # Filter homophones with Levenshtein distance <= 1
-    homophones = [w for w in homophones if levenshtein_distance(word, w) <= 1]
+    homophones = HOMOPHONE_DICT.get(word)
+    if homophones is None: # Word outside the indexed vocabulary
+        homophones = HOMOPHONE_DICT[word] = find_homophones(word)
     if homophones: # Homophones found
-        return random.choice(homophones)
+        return rng.choice(homophones)
     return word # No homophones found
 
 # Introduce different typos in a sentence (default probability=0.08)
-def rule_introduce_typos(sentence, chance=0.05, max_typos=3):
-    """ Introduce typos in a sentence with a given probability. """
+def rule_introduce_typos(sentence, chance=0.05, max_typos=3, rng=random, counts=None, engine='rules'):
+    """ Introduce typos in a sentence with a given probability. engine 'rules' uses the typo
+        functions above with fixed weights, 'empirical' samples edits from TYPO_MODEL. """
+    if engine == 'empirical':
+        return empirical_introduce_typos(sentence, chance, max_typos, rng, counts)
     typo_funcs = [add_space, swap_adjacent, omit_letter, double_letter, adjacent_key, adjacent_add, replace_homophone]
     typo_probs = [8, 16, 16, 17, 13, 16, 14]  # Probabilities for each typo function
     
-    if random.random() < chance:
-        sentence = omit_space(sentence)
+    if rng.random() < chance:
+        sentence = omit_space(sentence, rng=rng)
+        count_rule(counts, 'omit_space')
     
     words = sentence.split()
     # Randomly select up to 3 words for chance to introduce typos
-    typos = random.sample(range(len(words)), min(len(words), max_typos))
+    typos = rng.sample(range(len(words)), min(len(words), max_typos))
     for i in typos:
-        if random.random() < chance:
+        if rng.random() < chance:
             word = words[i]
-            typo_func = random.choices(typo_funcs, weights=typo_probs, k=1)[0]
-            words[i] = typo_func(word)
+            typo_func = rng.choices(typo_funcs, weights=typo_probs, k=1)[0]
+            words[i] = typo_func(word, rng=rng)
+            if words[i] != word:
+                count_rule(counts, typo_func.__name__)
 
     return ' '.join(words)
 
+# Introduce typos in a sentence sampled from the empirical typo model
+def empirical_introduce_typos(sentence, chance=0.05, max_typos=3, rng=random, counts=None):
+    """ Introduce typos in up to max_typos words, each with a given probability. Edit type,
+        position and letters follow the typos of MaintNorm; a missing space joins a word with the next one. """
+    words = sentence.split()
+    typos = rng.sample(range(len(words)), min(len(words), max_typos))
+    joined = set()
+    for i in typos:
+        if rng.random() < chance:
+            word = words[i]
+            words[i], edit = apply_typo(word, TYPO_MODEL, rng)
+            if edit == 'omit_space' and i + 1 < len(words):
+                joined.add(i)
+                count_rule(counts, edit)
+            elif words[i] != word:
+                count_rule(counts, edit)
+    return ''.join(word + ('' if i in joined else ' ') for i, word in enumerate(words)).rstrip(' ')
+
 # Introduce typos in a sentence using OpenAI GPT-4
-def llm_introduce_typos(openai, sentence):
+def llm_introduce_typos(openai, sentence, rng=random):
     # Chance for no typos
-    if random.random() < 0.15:
+    if rng.random() < 0.15:
         return sentence
+    return llm_typo_sentence(openai, sentence)
+
+# Ask the LLM for typos in one sentence
+def llm_typo_sentence(openai, sentence, stats=None):
+    """ Return the sentence with typos from one chat completion, adding its calls and tokens to stats """
     prompt = (
         f"Introduce a few typos into the following sentence to make it look like it was written by a human. "
-        f"Use a mix of the following typo types, but avoid overdoing it. The typo types are:\n"
-        f"1. Missing space between words (e.g., air conditioner -> airconditioner)\n"
-        f"2. Additional space within words (e.g., permalube -> perma lube)\n"
-        f"3. Swapped adjacent characters (e.g., crack -> carck)\n"
-        f"4. Missing characters in a word (e.g., crack -> crak)\n"
-        f"5. Double-up characters in a word (e.g., crack -> craack)\n"
-        f"6. Incorrect character in a word (due to keys proximity) (e.g., crack -> xrack)\n"
-        f"7. Extra characters in a word (due to keys proximity) (e.g., crack -> cracvk)\n"
-        f"8. Incorrect spelling (homophones) (e.g., motor -> moter)\n\n"
+        f"{TYPO_INSTRUCTIONS}"
         f"Here is the sentence to modify: '{sentence}'"
         f"Return the modified sentence and nothing else."
     )
-    response = openai.chat.completions.create(
+    messages = [{"role": "system", "content": TYPO_SYSTEM}, {"role": "user", "content": prompt}]
+    response = chat_completion(
+        openai,
         model="gpt-4o-mini",
-        messages=[{"role": "system", "content": "You are an expert in adding realistic typos to sentences."},
-                  {"role": "user", "content": prompt}],
+        messages=messages,
+        stage="typos",
         temperature=0.9,
         top_p=0.9,
         n=1
     )
-    if response.choices[0].message.content.startswith("'") and response.choices[0].message.content.endswith("'"):
-        return response.choices[0].message.content[1:-1]
-    return response.choices[0].message.content
+    count_call(stats, messages, response)
+    return strip_quotes(response.choices[0].message.content)
+
+# Remove quotes around an LLM answer
+def strip_quotes(text):
+    """ Remove single quotes around text """
+    if text.startswith("'") and text.endswith("'"):
+        return text[1:-1]
+    return text
+
+# Ask the LLM for typos in several sentences at once
+def llm_typo_batch(openai, sentences):
+    """ Return (sentences with typos, stats) of one request with the numbered sentences.
+        If the response does not have exactly one numbered line per sentence (dropped, merged
+        or extra lines), each sentence is sent on its own instead. """
+    stats = {'batches': 1}
+    if len(sentences) == 1:
+        return [llm_typo_sentence(openai, sentences[0], stats)], stats
+    numbered = "\n".join(f"{i}. {sentence}" for i, sentence in enumerate(sentences, 1))
+    prompt = (
+        f"Introduce a few typos into each of the following sentences to make them look like they were written by a human. "
+        f"{TYPO_INSTRUCTIONS}"
+        f"Here are the sentences to modify, one per line:\n{numbered}\n\n"
+        f"Return the modified sentences with the same numbers, one per line, and nothing else."
+    )
+    messages = [{"role": "system", "content": TYPO_SYSTEM}, {"role": "user", "content": prompt}]
+    response = chat_completion(openai, model="gpt-4o-mini", messages=messages, stage="typos_batch",
+                               temperature=0.9, top_p=0.9, n=1)
+    count_call(stats, messages, response)
+    lines, unnumbered = {}, False
+    for line in response.choices[0].message.content.splitlines():
+        match = re.match(r"\s*(\d+)[.):]\s*(.*\S)", line)
+        if match:
+            lines.setdefault(int(match.group(1)), []).append(strip_quotes(match.group(2)))
+        elif line.strip():
+            unnumbered = True
+    if not unnumbered and sorted(lines) == list(range(1, len(sentences) + 1)) and all(len(line) == 1 for line in lines.values()):
+        record_sentences(response, len(sentences))
+        return [lines[i][0] for i in range(1, len(sentences) + 1)], stats
+    record_sentences(response, 0)
+
+    # Fall back to one request per sentence
+    stats['fallbacks'] = 1
+    return [llm_typo_sentence(openai, sentence, stats) for sentence in sentences], stats
+
+# Count the calls and tokens of a chat completion
+def count_call(stats, messages, response):
+    """ Add a call and its prompt and completion tokens (4 characters per token without usage) to stats """
+    if stats is None:
+        return
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        tokens = usage.prompt_tokens + usage.completion_tokens
+    else:
+        tokens = (sum(len(message["content"]) for message in messages) + len(response.choices[0].message.content)) // 4
+    stats['calls'] = stats.get('calls', 0) + 1
+    stats['tokens'] = stats.get('tokens', 0) + tokens
+
+# Introduce typos in many sentences with batched LLM requests
+def llm_introduce_typos_batched(openai, sentences, batch_size=20, workers=4, rng=random, stats=None, no_typo_chance=0.15):
+    """ Introduce typos in sentences with requests of up to batch_size numbered sentences, running
+        up to workers requests at once. As in llm_introduce_typos, each sentence has a no_typo_chance
+        of no typos (drawn up front, so the result does not depend on request order).
+        stats is an optional dictionary to add sentences, calls, batches, fallbacks and tokens to. """
+    stats = {} if stats is None else stats
+    typos = list(sentences)
+    selected = [i for i in range(len(sentences)) if rng.random() >= no_typo_chance]
+    batches = [selected[i:i + batch_size] for i in range(0, len(selected), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda batch: llm_typo_batch(openai, [sentences[i] for i in batch]), batches)
+        for batch, (batch_typos, batch_stats) in zip(batches, results):
+            for i, typo in zip(batch, batch_typos):
+                typos[i] = typo
+            for name, value in batch_stats.items():
+                stats[name] = stats.get(name, 0) + value
+    stats['sentences'] = stats.get('sentences', 0) + len(sentences)
+    return typos
+
+# Report calls and tokens per sentence of batched LLM typos
+def typo_stats(stats, batch_size):
+    """ Return a one-line summary of llm_introduce_typos_batched stats """
+    sentences = max(stats.get('sentences', 0), 1)
+    return (f"LLM typos: {stats.get('sentences', 0)} sentences in {stats.get('calls', 0)} calls "
+            f"({stats.get('batches', 0)} batches of up to {batch_size}, {stats.get('fallbacks', 0)} fell back to "
+            f"one call per sentence), {stats.get('calls', 0) / sentences:.3f} calls and "
+            f"{stats.get('tokens', 0) / sentences:.0f} tokens per sentence")
 
 # Humanise a MWO sentence
-def humanise_sentence(sentence, llm=False):
-    """ Humanise a sentence by introducing contractions, abbreviations, and typos. """
-    sentence = introduce_contractions(sentence)
-    sentence = introduce_abbreviations(sentence)
+def humanise_sentence(sentence, llm=False, rng=random, counts=None, typo_engine='rules'):
+    """ Humanise a sentence by introducing contractions, abbreviations, and typos.
+        rng is the random generator to draw from (e.g. random.Random per sentence),
+        counts is an optional {rule: applications} dictionary to update,
+        typo_engine is the engine of rule_introduce_typos ('rules' or 'empirical'). """
+    sentence = introduce_contractions(sentence, rng=rng, counts=counts)
+    sentence = introduce_abbreviations(sentence, rng=rng, counts=counts)
     if llm:
-        sentence = llm_introduce_typos(llm, sentence)
+        sentence = llm_introduce_typos(llm, sentence, rng=rng)
     else:
-        sentence = rule_introduce_typos(sentence)
+        sentence = rule_introduce_typos(sentence, rng=rng, counts=counts, engine=typo_engine)
     return sentence
 
 if __name__ == '__main__':
     # Load environment variables
     load_dotenv()
     api_key = os.getenv("API_KEY")
-    client = OpenAI(api_key=api_key)
+    client = OpenAI(api_key=api_key, max_retries=0) # Retries are made (and counted) by chat_completion
     
     # Initialise global variables (dictionaries)
     current_dir = os.path.dirname(os.path.abspath("__file__"))
@@ -0,0 +1,144 @@
+# This file contains a parallel, deterministic corpus-level humanise pipeline
+
+import os
+import csv
+import time
+import random
+import argparse
+import itertools
+from collections import deque
+from multiprocessing import Pool
+
+from humanise import initialise_globals, humanise_sentence, introduce_contractions, introduce_abbreviations, llm_introduce_typos_batched, typo_stats
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CHUNK_SIZE = 1000
+TYPO_BATCH_SIZE = 20
+
+# Function to create the random generator of a sentence
+def sentence_rng(seed, index):
+    """ Random generator seeded from the run seed and sentence index, so a sentence is
+        humanised the same way whichever worker or chunk it lands in """
+    return random.Random(f"{seed}:{index}")
+
+# Function to humanise a chunk of rows
+def humanise_chunk(chunk):
+    """ Humanise the sentence (first column) of each row of a chunk (start index, rows, seed, typo engine).
+        Returns the humanised rows and {rule: applications} of the chunk. """
+    start, rows, seed, typo_engine = chunk
+    counts = {}
+    humanised = [[humanise_sentence(row[0], rng=sentence_rng(seed, start + offset), counts=counts,
+                                    typo_engine=typo_engine)] + row[1:]
+                 for offset, row in enumerate(rows)]
+    return humanised, counts
+
+# Function to humanise chunks of rows with batched LLM typos
+def llm_humanise_chunks(chunks, client, batch_size=TYPO_BATCH_SIZE, llm_workers=4, counts=None, stats=None):
+    """ Introduce contractions and abbreviations in the sentences of each chunk, then typos with
+        batched LLM requests (llm_introduce_typos_batched). Yields the humanised rows in input order. """
+    for start, rows, seed, _ in chunks:
+        sentences, selected = [], []
+        for offset, row in enumerate(rows):
+            rng = sentence_rng(seed, start + offset)
+            sentence = introduce_contractions(row[0], rng=rng, counts=counts)
+            sentences.append(introduce_abbreviations(sentence, rng=rng, counts=counts))
+            if rng.random() >= 0.15: # Chance for no typos, as in llm_introduce_typos
+                selected.append(offset)
+        typos = llm_introduce_typos_batched(client, [sentences[i] for i in selected], batch_size, llm_workers,
+                                            stats=stats, no_typo_chance=0)
+        for offset, typo in zip(selected, typos):
+            sentences[offset] = typo
+        for sentence, row in zip(sentences, rows):
+            yield [sentence] + row[1:]
+
+# Function to split rows into chunks
+def iter_chunks(rows, seed=0, chunk_size=CHUNK_SIZE, typo_engine='rules'):
+    """ Yield (start index, rows, seed, typo engine) chunks of chunk_size rows """
+    rows = iter(rows)
+    start = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield start, chunk, seed, typo_engine
+        start += len(chunk)
+
+# Function to humanise a corpus of rows
+def humanise_corpus(rows, seed=0, workers=1, chunk_size=CHUNK_SIZE, counts=None, dirpath=MAIN_DIR, typo_engine='rules',
+                    client=None, batch_size=TYPO_BATCH_SIZE, stats=None):
+    """ Humanise the sentences of rows (sentence, ...) with rule-based or empirical typos and yield the
+        humanised rows in input order. Rows are read lazily in chunks, with at most a few chunks
+        per worker in flight. Output is the same for any number of workers.
+        typo_engine 'llm' asks the OpenAI client for typos in requests of batch_size sentences,
+        with workers requests at once, adding calls and tokens to stats. """
+    counts = {} if counts is None else counts
+    chunks = iter_chunks(rows, seed, chunk_size, typo_engine)
+    initialise_globals(dirpath) # Rebuild a stale resource bundle once, before the workers load it
+    if typo_engine == 'llm':
+        yield from llm_humanise_chunks(chunks, client, batch_size, workers, counts, stats)
+        return
+    if workers <= 1:
+        for chunk in chunks:
+            humanised, chunk_counts = humanise_chunk(chunk)
+            merge_counts(counts, chunk_counts)
+            yield from humanised
+        return
+
+    with Pool(workers, initializer=initialise_globals, initargs=(dirpath,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(humanise_chunk, (chunk,)))
+            if len(pending) >= 4 * workers:
+                humanised, chunk_counts = pending.popleft().get()
+                merge_counts(counts, chunk_counts)
+                yield from humanised
+        while pending:
+            humanised, chunk_counts = pending.popleft().get()
+            merge_counts(counts, chunk_counts)
+            yield from humanised
+
+# Function to add rule counts of a chunk to the totals
+def merge_counts(counts, chunk_counts):
+    """ Add chunk_counts into counts """
+    for rule, count in chunk_counts.items():
+        counts[rule] = counts.get(rule, 0) + count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Humanise a csv file of generated MWO sentences")
+    parser.add_argument("infile", nargs="?", default="../Generate/mwo_sentences/order_synthetic.csv")
+    parser.add_argument("outfile", nargs="?", default="order_humanised.csv")
+    parser.add_argument("--seed", type=int, default=0, help="run seed (with the sentence index) of each sentence")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="worker processes, or concurrent requests with --typo-engine llm")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="sentences per worker task")
+    parser.add_argument("--typo-engine", choices=["rules", "empirical", "llm"], default="rules",
+                        help="fixed-weight typo rules, typos sampled from MaintNorm (typo_model.py) or LLM typos")
+    parser.add_argument("--batch-size", type=int, default=TYPO_BATCH_SIZE,
+                        help="sentences per LLM typo request (1 sends each sentence on its own)")
+    args = parser.parse_args()
+
+    client, stats = None, {}
+    if args.typo_engine == 'llm':
+        from openai import OpenAI
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        client = OpenAI(api_key=os.getenv("API_KEY"), max_retries=0) # Retries are made (and counted) by chat_completion
+
+    start = time.perf_counter()
+    counts = {}
+    num_sentences = 0
+    with open(args.infile, encoding='utf-8') as f_in, open(args.outfile, 'w', encoding='utf-8', newline='') as f_out:
+        writer = csv.writer(f_out, lineterminator='\n')
+        for row in humanise_corpus((row for row in csv.reader(f_in) if row), args.seed, args.workers,
+                                   args.chunk_size, counts, typo_engine=args.typo_engine,
+                                   client=client, batch_size=args.batch_size, stats=stats):
+            writer.writerow(row)
+            num_sentences += 1
+    elapsed = time.perf_counter() - start
+    print(f"Humanised {num_sentences} sentences in {elapsed:.1f}s ({num_sentences / elapsed:.0f} sentences/s, "
+          f"{args.workers} workers) into {args.outfile}")
+    for rule, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"{count}\t{rule}")
+    if args.typo_engine == 'llm':
+        print(typo_stats(stats, args.batch_size))
@@ -0,0 +1,61 @@
+import os
+import csv
+import sys
+import shutil
+import pytest
+
+# Humanise scripts import each other (and Generate) as top-level modules
+HUMANISE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, HUMANISE_DIR)
+sys.path.insert(0, os.path.join(HUMANISE_DIR, '..', 'Generate'))
+
+import humanise
+from humanise import save_cmu_file
+from llm_calls import LLM_CACHE, LLM_METRICS
+
+MAIN_DIR = os.path.join(HUMANISE_DIR, '..')
+GLOBALS = ['CONTRACTIONS_DICT', 'ABBREVIATIONS_DICT', 'KEYBOARD_DICT', 'CMU_DICT', 'CONTRACTIONS_MATCHER',
+           'ABBREVIATIONS_MATCHER', 'HOMOPHONE_DICT', 'PRONUNCIATION_DICT', 'CMU_FILE', 'TYPO_MODEL']
+
+@pytest.fixture(autouse=True)
+def offline_llm(monkeypatch):
+    """ Keep tests away from the LLM cache and metrics files of the repo """
+    monkeypatch.setitem(LLM_CACHE, "mode", "off")
+    monkeypatch.setitem(LLM_METRICS, "enabled", False)
+    monkeypatch.chdir(HUMANISE_DIR)
+
+@pytest.fixture
+def cmu_dict():
+    """ A few words of the CMU pronouncing dictionary, so tests do not need NLTK data """
+    return {
+        "motor": [["M", "OW1", "T", "ER0"]], "moter": [["M", "OW1", "T", "ER0"]],
+        "seal": [["S", "IY1", "L"]], "seel": [["S", "IY1", "L"]], "ceil": [["S", "IY1", "L"]],
+        "pump": [["P", "AH1", "M", "P"]], "leak": [["L", "IY1", "K"]], "leek": [["L", "IY1", "K"]],
+        "valve": [["V", "AE1", "L", "V"]],
+    }
+
+# Function to write rows to a csv file
+def write_csv(filepath, rows):
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+@pytest.fixture
+def dirpath(monkeypatch, tmp_path, cmu_dict):
+    """ Create the data humanise reads (the repo dictionaries, a little MaintNorm data, generated
+        sentences and a saved CMU dictionary) in a tmp dir; yields the dir. The humanise globals
+        are restored afterwards, and NLTK data must not be needed. """
+    for name in GLOBALS:
+        monkeypatch.setattr(humanise, name, getattr(humanise, name))
+    monkeypatch.setattr(humanise, "load_cmudict", lambda: pytest.fail("CMU dictionary loaded from NLTK data"))
+    path = tmp_path / "data" / "Corrections"
+    path.mkdir(parents=True)
+    for name in ('contractions', 'abbreviations', 'keyboard'):
+        shutil.copy(os.path.join(MAIN_DIR, 'data', 'Corrections', f'{name}.csv'), path)
+    write_csv(path / "maintnorm_corrections.csv", [["Correct", "Wrong"], ["bearing", "baering"], ["motor", "moter"]])
+    (tmp_path / "data" / "MaintNorm").mkdir()
+    (tmp_path / "data" / "MaintNorm" / "train.norm").write_text("pmup\tpump\nsteering\tsteering\nleakign\tleaking\n")
+    (tmp_path / "Generate" / "mwo_sentences").mkdir(parents=True)
+    write_csv(tmp_path / "Generate" / "mwo_sentences" / "synthetic.csv",
+              [["motor seal leaking"], ["replace pump seal"], ["motor running hot"]])
+    save_cmu_file(str(path), cmu_dict)
+    yield str(tmp_path)
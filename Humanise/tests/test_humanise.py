@@ -0,0 +1,87 @@
+# Tests pinning the contraction and abbreviation rules to their recorded output for fixed seeds
+
+import os
+import re
+import csv
+import random
+import pytest
+
+import humanise
+from humanise import build_matcher, load_dictionary, add_periods, introduce_contractions, introduce_abbreviations
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+# Applying one key can remove the match of another (it is / is not) or create one (heat exchanger -> hx unit)
+CONTRACTIONS = {"do not": ["don't"], "not": ["n't"], "it is": ["it's"], "is not": ["isn't"]}
+ABBREVIATIONS = {"heat exchanger": ["hx"], "hx unit": ["hxu"], "pump": ["pmp", "p"]}
+
+# Function to use dictionaries in the humanise rules
+def set_dictionaries(monkeypatch, contractions, abbreviations):
+    monkeypatch.setattr(humanise, "CONTRACTIONS_DICT", contractions)
+    monkeypatch.setattr(humanise, "CONTRACTIONS_MATCHER", build_matcher(contractions))
+    monkeypatch.setattr(humanise, "ABBREVIATIONS_DICT", abbreviations)
+    monkeypatch.setattr(humanise, "ABBREVIATIONS_MATCHER", build_matcher(abbreviations))
+
+# Function to introduce contractions as the rule did before it used a phrase matcher
+def legacy_contractions(sentence, contractions, chance=0.5, rng=random):
+    items = list(contractions.items())
+    rng.shuffle(items)
+    for expanded, contracted in items:
+        pattern = r'\b' + expanded + r'\b'
+        if re.search(expanded, sentence, re.I) and rng.random() < chance:
+            sentence = re.sub(pattern, rng.choice(contracted), sentence, flags=re.I)
+    return sentence
+
+# Function to introduce abbreviations as the rule did before it used a phrase matcher
+def legacy_abbreviations(sentence, abbreviations, chance=0.4, rng=random):
+    items = list(abbreviations.items())
+    rng.shuffle(items)
+    for original, variations in items:
+        pattern = r'\b' + original + r'\b'
+        if re.search(original, sentence, re.I) and rng.random() < chance:
+            variation = add_periods(original, rng.choice(variations), rng=rng)
+            sentence = re.sub(pattern, variation, sentence, flags=re.I)
+    return sentence
+
+@pytest.mark.parametrize("seed, contracted, abbreviated, counts", [
+    (0, "it's n't working, don't start", "hx unit and p", {"contractions": 3, "abbreviations": 2}),
+    (1, "It isn't working, don't start", "hx unit and p.", {"contractions": 2, "abbreviations": 2}),
+    (2, "it's n't working, do n't start", "hxu and pmp", {"contractions": 2, "abbreviations": 3}),
+    (3, "It isn't working, don't start", "hxu and p", {"contractions": 2, "abbreviations": 3}),
+])
+def test_recorded_output(monkeypatch, seed, contracted, abbreviated, counts):
+    set_dictionaries(monkeypatch, CONTRACTIONS, ABBREVIATIONS)
+    rng, rule_counts = random.Random(seed), {}
+    assert introduce_contractions("It is not working, do not start", chance=1.0, rng=rng, counts=rule_counts) == contracted
+    assert introduce_abbreviations("Heat exchanger unit and pump", chance=1.0, rng=rng, counts=rule_counts) == abbreviated
+    assert rule_counts == counts
+
+@pytest.mark.parametrize("seed", range(4))
+def test_recorded_output_matches_legacy_rules(monkeypatch, seed):
+    set_dictionaries(monkeypatch, CONTRACTIONS, ABBREVIATIONS)
+    for chance in (1.0, 0.5):
+        rng, legacy_rng = random.Random(seed), random.Random(seed)
+        assert introduce_contractions("It is not working, do not start", chance=chance, rng=rng) == \
+               legacy_contractions("It is not working, do not start", CONTRACTIONS, chance=chance, rng=legacy_rng)
+        assert introduce_abbreviations("Heat exchanger unit and pump", chance=chance, rng=rng) == \
+               legacy_abbreviations("Heat exchanger unit and pump", ABBREVIATIONS, chance=chance, rng=legacy_rng)
+        assert rng.random() == legacy_rng.random()
+
+def test_repo_dictionaries_match_legacy_rules(monkeypatch):
+    path = os.path.join(MAIN_DIR, 'data', 'Corrections')
+    contractions = load_dictionary(os.path.join(path, 'contractions.csv'))
+    abbreviations = load_dictionary(os.path.join(path, 'abbreviations.csv'))
+    set_dictionaries(monkeypatch, contractions, abbreviations)
+    with open(os.path.join(MAIN_DIR, 'Generate', 'mwo_sentences', 'synthetic.csv'), encoding='utf-8') as f:
+        sentences = [row[0] for row in csv.reader(f)][:300]
+    sentences += ["it is not the air conditioner condenser, we will not have the auto-greaser by-pass fixed"]
+    num_changed = 0
+    for seed, sentence in enumerate(sentences):
+        rng, legacy_rng = random.Random(seed), random.Random(seed)
+        humanised = introduce_abbreviations(introduce_contractions(sentence, rng=rng), rng=rng)
+        assert humanised == legacy_abbreviations(legacy_contractions(sentence, contractions, rng=legacy_rng),
+                                                 abbreviations, rng=legacy_rng)
+        # Same random draws, so the rest of a seeded run is unchanged
+        assert rng.random() == legacy_rng.random()
+        num_changed += humanised != sentence
+    assert num_changed > 50
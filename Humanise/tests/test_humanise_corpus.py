@@ -0,0 +1,44 @@
+# Tests that a humanised corpus depends on the seed only, not on workers or chunk sizes
+
+import io
+import os
+import csv
+import pytest
+
+from humanise_corpus import humanise_corpus
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+@pytest.fixture(scope="module")
+def rows():
+    with open(os.path.join(MAIN_DIR, 'Generate', 'mwo_sentences', 'synthetic.csv'), encoding='utf-8') as f:
+        rows = [row for row in csv.reader(f) if row][:60]
+    # Sentences with contractions and abbreviations to introduce
+    return rows + [["it is not the air conditioner condenser", "PhysicalObject"],
+                   ["we will not bypass the motor seal", "PhysicalObject"]]
+
+# Function to humanise rows into csv bytes as humanise_corpus.py writes them
+def humanise_csv(rows, dirpath, **kwargs):
+    counts, f = {}, io.StringIO()
+    writer = csv.writer(f, lineterminator='\n')
+    for row in humanise_corpus(iter(rows), counts=counts, dirpath=dirpath, **kwargs):
+        writer.writerow(row)
+    return f.getvalue().encode('utf-8'), counts
+
+@pytest.mark.parametrize("typo_engine", ["rules", "empirical"])
+def test_output_is_the_same_for_any_workers_and_chunk_size(rows, dirpath, typo_engine):
+    expected, expected_counts = humanise_csv(rows, dirpath, seed=3, workers=1, typo_engine=typo_engine)
+    assert expected.decode('utf-8').count('\n') == len(rows)
+    assert sum(expected_counts.values()) > 0
+    for workers, chunk_size in [(1, 1), (1, 7), (2, 1), (2, 7), (2, 1000)]:
+        output, counts = humanise_csv(rows, dirpath, seed=3, workers=workers, chunk_size=chunk_size,
+                                      typo_engine=typo_engine)
+        assert output == expected
+        assert counts == expected_counts
+
+def test_seed_changes_the_output(rows, dirpath):
+    outputs = {humanise_csv(rows, dirpath, seed=seed, workers=2, chunk_size=7)[0] for seed in (0, 1)}
+    assert len(outputs) == 2
+    # Columns after the sentence are kept
+    output = humanise_csv(rows, dirpath, seed=0, chunk_size=7)[0].decode('utf-8')
+    assert [row[1:] for row in csv.reader(io.StringIO(output))] == [row[1:] for row in rows]
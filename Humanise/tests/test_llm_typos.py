@@ -0,0 +1,93 @@
+# Tests of batched LLM typos with a fake OpenAI client: parsing numbered lines and the per-sentence fallback
+
+import re
+import random
+import threading
+from types import SimpleNamespace
+import pytest
+
+from humanise import llm_typo_batch, llm_introduce_typos_batched, typo_stats
+
+SENTENCES = ["pump seal leaking", "motor running hot", "replace belt"]
+
+# Function to add the typos of the fake client to a sentence
+def typo(sentence):
+    return sentence.upper()
+
+# Client stand-in answering typo prompts, with replies to batched prompts made by reply(sentences)
+class FakeClient:
+    def __init__(self, reply=None):
+        self.reply = reply or (lambda sentences: "\n".join(f"{i}. {typo(s)}" for i, s in enumerate(sentences, 1)))
+        self.requests = []
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **params):
+        prompt = messages[-1]["content"]
+        single = re.search(r"Here is the sentence to modify: '(.*)'Return", prompt)
+        if single:
+            sentences, content = [single.group(1)], f"'{typo(single.group(1))}'"
+        else:
+            numbered = prompt.split("one per line:\n", 1)[1].split("\n\n", 1)[0]
+            sentences = [re.sub(r"^\d+\. ", "", line) for line in numbered.splitlines()]
+            content = self.reply(sentences)
+        with self.lock:
+            self.requests.append(sentences)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                               usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+
+@pytest.mark.parametrize("content", [
+    "1. PUMP SEAL LEAKING\n2. MOTOR RUNNING HOT\n3. REPLACE BELT",
+    "1) 'PUMP SEAL LEAKING'\n\n2: MOTOR RUNNING HOT  \n   3. REPLACE BELT\n",
+    "3. REPLACE BELT\n1. PUMP SEAL LEAKING\n2. MOTOR RUNNING HOT",
+])
+def test_numbered_lines_are_parsed(content):
+    client = FakeClient(lambda sentences: content)
+    typos, stats = llm_typo_batch(client, SENTENCES)
+    assert typos == [typo(sentence) for sentence in SENTENCES]
+    assert stats == {"batches": 1, "calls": 1, "tokens": 15}
+    assert client.requests == [SENTENCES]
+
+@pytest.mark.parametrize("content", [
+    "1. PUMP SEAL LEAKING\n3. REPLACE BELT",                                            # missing
+    "1. PUMP SEAL LEAKING\n2. MOTOR RUNNING HOT\n2. MOTOR RUNING HOT\n3. REPLACE BELT",  # duplicated
+    "1. PUMP SEAL LEAKING 2. MOTOR RUNNING HOT\n3. REPLACE BELT",                       # merged
+    "Here are the sentences:\n1. PUMP SEAL LEAKING\n2. MOTOR RUNNING HOT\n3. REPLACE BELT",  # unnumbered
+    "1. PUMP SEAL LEAKING\n2. MOTOR RUNNING HOT\n3. REPLACE BELT\n4. CHECK OIL",        # extra
+])
+def test_malformed_response_falls_back_to_one_request_per_sentence(content):
+    client = FakeClient(lambda sentences: content.replace("PUMP SEAL", "PUMP SAEL"))
+    typos, stats = llm_typo_batch(client, SENTENCES)
+    # Each sentence gets the typos of its own request, not a line of the malformed response
+    assert typos == [typo(sentence) for sentence in SENTENCES]
+    assert stats == {"batches": 1, "fallbacks": 1, "calls": 4, "tokens": 60}
+    assert client.requests == [SENTENCES] + [[sentence] for sentence in SENTENCES]
+
+def test_single_sentence_is_sent_on_its_own():
+    client = FakeClient(lambda sentences: pytest.fail("batched prompt for one sentence"))
+    assert llm_typo_batch(client, SENTENCES[:1]) == ([typo(SENTENCES[0])], {"batches": 1, "calls": 1, "tokens": 15})
+
+@pytest.mark.parametrize("batch_size, workers", [(1, 1), (3, 1), (3, 4), (20, 2)])
+def test_batched_typos_land_at_their_index(batch_size, workers):
+    sentences = [f"sentence {i} leaking" for i in range(11)]
+    # Batches with sentence 5 drop its line, so they fall back
+    def reply(batch):
+        return "\n".join(f"{i}. {typo(s)}" for i, s in enumerate(batch, 1) if s != "sentence 5 leaking")
+    client, stats = FakeClient(reply), {}
+    typos = llm_introduce_typos_batched(client, sentences, batch_size=batch_size, workers=workers,
+                                        rng=random.Random(0), stats=stats, no_typo_chance=0.3)
+
+    rng = random.Random(0)
+    selected = [i for i in range(len(sentences)) if rng.random() >= 0.3]
+    assert 5 in selected and len(selected) < len(sentences)
+    assert typos == [typo(sentence) if i in selected else sentence for i, sentence in enumerate(sentences)]
+
+    batches = [selected[i:i + batch_size] for i in range(0, len(selected), batch_size)]
+    fallback = next(batch for batch in batches if 5 in batch)
+    calls = len(batches) + (len(fallback) if len(fallback) > 1 else 0)
+    expected = {"sentences": len(sentences), "batches": len(batches), "calls": calls, "tokens": 15 * calls}
+    if len(fallback) > 1:
+        expected["fallbacks"] = 1
+    assert stats == expected
+    assert len(client.requests) == calls
+    assert f"{len(sentences)} sentences in {calls} calls" in typo_stats(stats, batch_size)
@@ -0,0 +1,133 @@
+# Tests of loading, validating and rebuilding the humanise resource bundle
+
+import os
+import csv
+import pickle
+import shutil
+import pytest
+
+import humanise
+from humanise import (RESOURCE_BUNDLE, BUNDLE_VERSION, BUNDLE_KEYS, initialise_globals, get_source_hashes,
+                      load_bundle, save_bundle, save_checksummed, save_cmu_file, load_cmu_file)
+
+# Function to write rows to a csv file
+def write_csv(filepath, rows):
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+# Function to count bundle builds of initialise_globals
+def count_builds(monkeypatch):
+    builds = []
+    build_bundle = humanise.build_bundle
+    def counting_build_bundle(*args):
+        builds.append(args[0])
+        return build_bundle(*args)
+    monkeypatch.setattr(humanise, "build_bundle", counting_build_bundle)
+    return builds
+
+# Function to get the bundle file of a dir
+def bundle_file(dirpath):
+    return os.path.join(dirpath, 'data', 'Corrections', RESOURCE_BUNDLE)
+
+def test_bundle_is_built_once(monkeypatch, dirpath, cmu_dict):
+    builds = count_builds(monkeypatch)
+    initialise_globals(dirpath)
+    initialise_globals(dirpath)
+    assert len(builds) == 1
+    assert humanise.HOMOPHONE_DICT["motor"] == ["moter"]
+    assert humanise.HOMOPHONE_DICT["seal"] == ["seel"] # ceil is 2 edits away
+    assert "valve" not in humanise.HOMOPHONE_DICT # Not in the sentences or dictionaries
+    assert humanise.replace_homophone("valve") == "valve" # Looked up in the CMU file on first use
+    assert humanise.CMU_DICT == cmu_dict
+    assert set(load_bundle(bundle_file(dirpath))) == set(BUNDLE_KEYS)
+
+# Function to replace a bundle file with bytes that are not a valid bundle
+def corrupt(kind, file):
+    if kind == "garbage":
+        with open(file, 'wb') as f:
+            f.write(b"not a pickle at all")
+    elif kind == "pickled list":
+        with open(file, 'wb') as f:
+            pickle.dump([1, 2, 3], f)
+    elif kind == "non-dict payload":
+        save_checksummed(file, pickle.dumps(["sources", "contractions"]), BUNDLE_VERSION)
+    elif kind == "payload not a pickle":
+        save_checksummed(file, b"\x80\x05garbage", BUNDLE_VERSION)
+    elif kind == "missing keys":
+        bundle = load_bundle(file)
+        del bundle['homophones']
+        save_bundle(file, bundle)
+    elif kind == "truncated":
+        with open(file, 'rb') as f:
+            data = f.read()
+        with open(file, 'wb') as f:
+            f.write(data[:len(data) // 2])
+    elif kind == "checksum mismatch":
+        with open(file, 'rb') as f:
+            wrapper = pickle.load(f)
+        wrapper['payload'] = wrapper['payload'].replace(b"moter", b"motor")
+        with open(file, 'wb') as f:
+            pickle.dump(wrapper, f)
+
+@pytest.mark.parametrize("kind", ["garbage", "pickled list", "non-dict payload", "payload not a pickle",
+                                  "missing keys", "truncated", "checksum mismatch"])
+def test_invalid_bundle_is_rebuilt(monkeypatch, dirpath, kind):
+    initialise_globals(dirpath)
+    corrupt(kind, bundle_file(dirpath))
+    assert load_bundle(bundle_file(dirpath)) is None
+    builds = count_builds(monkeypatch)
+    initialise_globals(dirpath)
+    assert len(builds) == 1
+    assert humanise.HOMOPHONE_DICT["motor"] == ["moter"]
+    assert load_bundle(bundle_file(dirpath)) is not None
+
+def test_bundle_of_another_version_is_rebuilt(monkeypatch, dirpath, cmu_dict):
+    initialise_globals(dirpath)
+    monkeypatch.setattr(humanise, "BUNDLE_VERSION", BUNDLE_VERSION + 1)
+    assert load_bundle(bundle_file(dirpath)) is None
+    builds = count_builds(monkeypatch)
+    initialise_globals(dirpath)
+    initialise_globals(dirpath)
+    assert len(builds) == 1
+    # The CMU dictionary file outlives bundle versions
+    assert humanise.get_cmu_dict() == cmu_dict
+
+def test_missing_cmu_file_rebuilds_from_another_saved_one(monkeypatch, dirpath, cmu_dict):
+    initialise_globals(dirpath)
+    path = os.path.join(dirpath, 'data', 'Corrections')
+    cmu_file = humanise.CMU_FILE
+    other = save_cmu_file(path, {**cmu_dict, "valve": [["V", "AE1", "L", "V"]], "valv": [["V", "AE1", "L", "V"]]})
+    os.remove(cmu_file)
+    builds = count_builds(monkeypatch)
+    initialise_globals(dirpath)
+    assert len(builds) == 1
+    assert humanise.CMU_FILE == os.path.join(path, other)
+    assert load_cmu_file(humanise.CMU_FILE)["valv"] == [["V", "AE1", "L", "V"]]
+    # A renamed or corrupt CMU file is not trusted
+    shutil.copy(humanise.CMU_FILE, os.path.join(path, "cmudict-0000000000000000.pkl"))
+    assert load_cmu_file(os.path.join(path, "cmudict-0000000000000000.pkl")) is None
+
+def test_sources_track_the_vocabulary_of_generated_sentences(monkeypatch, dirpath):
+    initialise_globals(dirpath)
+    sources = get_source_hashes(dirpath)
+    builds = count_builds(monkeypatch)
+
+    # Another generation run with known words only keeps the bundle
+    write_csv(os.path.join(dirpath, 'Generate', 'mwo_sentences', 'order_synthetic.csv'),
+              [["pump seal leaking", "PhysicalObject", "pump seal", "leaking"], ["Motor running HOT"]])
+    assert get_source_hashes(dirpath) == sources
+    initialise_globals(dirpath)
+    assert builds == []
+
+    # A new word is indexed
+    write_csv(os.path.join(dirpath, 'Generate', 'mwo_sentences', 'order_synthetic.csv'), [["leak in pump"]])
+    initialise_globals(dirpath)
+    assert len(builds) == 1
+    assert humanise.HOMOPHONE_DICT["leak"] == ["leek"]
+
+    # So is a change of a dictionary
+    with open(os.path.join(dirpath, 'data', 'Corrections', 'keyboard.csv'), 'a', encoding='utf-8') as f:
+        f.write("q,1\n")
+    initialise_globals(dirpath)
+    assert len(builds) == 2
+    assert "1" in humanise.KEYBOARD_DICT["q"]
@@ -0,0 +1,108 @@
+# Tests of the empirical typo model: edit alignment, alias sampling and the fixed-weight rules it sits next to
+
+import os
+import random
+from collections import Counter
+import pytest
+
+import humanise
+from humanise import load_dictionary, rule_introduce_typos
+from typo_model import align_edits, count_edits, build_alias_table, sample_alias, compile_typo_model, apply_typo
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+@pytest.mark.parametrize("clean, dirty, edits", [
+    ("crack", "carck", [("swap_adjacent", "middle", "r", "a")]),
+    ("pump", "upmp", [("swap_adjacent", "first", "p", "u")]),
+    ("leaking", "leakign", [("swap_adjacent", "last", "n", "g")]),
+    ("crack", "crak", [("omit_letter", "middle", "c", "")]),
+    ("motor", "moto", [("omit_letter", "last", "r", "")]),
+    ("crack", "craack", [("double_letter", "middle", "r", "a")]),
+    ("motor", "mmotor", [("double_letter", "first", "", "m")]),
+    ("crack", "xrack", [("substitute_letter", "first", "c", "x")]),
+    ("crack", "cracvk", [("add_letter", "middle", "c", "v")]),
+    ("air conditioner", "airconditioner", [("omit_space", "middle", " ", "")]),
+    ("permalube", "perma lube", [("add_space", "middle", "a", " ")]),
+    ("crack", "crack", []),
+    ("bearing", "baering pin", [("swap_adjacent", "middle", "e", "a"), ("add_space", "last", "g", " "),
+                                ("add_letter", "last", "g", "p"), ("add_letter", "last", "g", "i"),
+                                ("add_letter", "last", "g", "n")]),
+])
+def test_align_edits(clean, dirty, edits):
+    assert align_edits(clean, dirty) == edits
+
+def test_count_edits():
+    counts = count_edits([("carck", "crack"), ("xrack", "crack"), ("xeal", "seal"), ("cracvk", "crack")])
+    assert counts["types"] == {"swap_adjacent": 1, "substitute_letter": 2, "add_letter": 1}
+    assert counts["positions"]["substitute_letter"] == {"first": 2}
+    assert counts["substitute"] == {"c": {"x": 1}, "s": {"x": 1}}
+    assert counts["insert"] == {"c": {"v": 1}}
+
+@pytest.mark.parametrize("weights", [
+    {"a": 1, "b": 2, "c": 7},
+    {"swap": 5, "omit": 5},
+    {"x": 0.1, "y": 30, "z": 0, "w": 3.3, "v": 1},
+    {"only": 4},
+])
+def test_alias_sampling_follows_the_weights(weights):
+    table = build_alias_table(weights)
+    total = sum(weights.values())
+    n = len(table["labels"])
+    # Exact probability of each label: a uniform column, then its own label or its alias
+    exact = Counter()
+    for i, label in enumerate(table["labels"]):
+        exact[label] += table["prob"][i] / n
+        exact[table["labels"][table["alias"][i]]] += (1 - table["prob"][i]) / n
+    for label, weight in weights.items():
+        assert exact[label] == pytest.approx(weight / total, abs=1e-12)
+
+    # Sampled frequencies converge to the weights
+    rng, num_samples = random.Random(0), 200000
+    samples = Counter(sample_alias(table, rng) for _ in range(num_samples))
+    for label, weight in weights.items():
+        assert samples[label] / num_samples == pytest.approx(weight / total, abs=0.005)
+    assert "z" not in samples
+
+def test_applied_typos_align_to_their_edit():
+    pairs = [("carck", "crack"), ("crak", "crack"), ("craack", "crack"), ("xrack", "crack"), ("cracvk", "crack"),
+             ("perma lube", "permalube"), ("pmup", "pump"), ("motr", "motor"), ("bearng", "bearing")]
+    model = compile_typo_model(pairs)
+    rng, applied = random.Random(1), Counter()
+    for word in ["hydraulic", "bearing", "conveyor", "pump", "motor"] * 200:
+        dirty, edit = apply_typo(word, model, rng)
+        applied[edit] += 1
+        if edit == "omit_space" or dirty == word:
+            continue
+        edits = align_edits(word, dirty)
+        assert len(edits) == 1
+        # An inserted letter equal to a neighbour is read back as a doubled letter
+        assert edits[0][0] == edit or (edit, edits[0][0]) == ("add_letter", "double_letter")
+    assert set(applied) == set(model["counts"]["types"])
+
+# Words of the sentences without homophones, apart from a few
+SENTENCES = ["motor seal leaking", "replace pump seal on hydraulic motor", "air conditioner not cooling", "crack"]
+HOMOPHONES = {"motor": ["moter"], "seal": ["seel", "ceil"], "leaking": ["leeking"]}
+
+# Recorded with the rules engine before the empirical engine was added: typos with chance 1.0 then the default
+@pytest.mark.parametrize("seed, typos, counts, next_draw", [
+    (0, ["mottor sealeaking", "repladce pump sealon hydraulic motor", "aair cconditionernot copling", "crfack",
+         "motor seal leaking", "replace pump seal on hydraulic motor", "air conditioner not cooling", "crack"],
+     {"omit_space": 4, "double_letter": 3, "omit_letter": 1, "adjacent_add": 2, "adjacent_key": 1}, 0.5962868615831063),
+    (2, ["motorsela leakig", "replacepump ceil on hydraulc motopr", "ari conditioenr notcoolinng", "crac",
+         "motor seal leaking", "replace pump seal on hydraulic motor", "air conditioner not cooling", "crack"],
+     {"omit_space": 4, "swap_adjacent": 3, "omit_letter": 3, "adjacent_add": 1, "replace_homophone": 1,
+      "double_letter": 1}, 0.7062058063676047),
+    (5, ["mtor sealleaknig", "rplace pump swal onhydraulic motodr", "aircnditioner nog cokling", "carck",
+         "motor seal leaking", "replace pump seal on hydraulic motor", "air conditioner notcooling", "carck"],
+     {"omit_space": 5, "omit_letter": 3, "swap_adjacent": 3, "adjacent_add": 1, "adjacent_key": 3}, 0.11902055707377501),
+])
+def test_rules_engine_is_unchanged(monkeypatch, seed, typos, counts, next_draw):
+    monkeypatch.setattr(humanise, "KEYBOARD_DICT", load_dictionary(os.path.join(MAIN_DIR, 'data', 'Corrections', 'keyboard.csv')))
+    monkeypatch.setattr(humanise, "HOMOPHONE_DICT", {**{word: [] for sentence in SENTENCES for word in sentence.split()},
+                                                     **HOMOPHONES})
+    rng, rule_counts = random.Random(seed), {}
+    output = [rule_introduce_typos(sentence, chance=1.0, rng=rng, counts=rule_counts, engine='rules') for sentence in SENTENCES]
+    output += [rule_introduce_typos(sentence, rng=rng, counts=rule_counts) for sentence in SENTENCES]
+    assert output == typos
+    assert rule_counts == counts
+    assert rng.random() == next_draw
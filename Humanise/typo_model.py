@@ -0,0 +1,227 @@
+# This file contains an empirical typo model learned from MaintNorm dirty -> clean pairs, sampled with Vose alias tables
+
+import os
+import re
+import csv
+import glob
+import random
+import argparse
+
+# Edit types of the typo model (named after the typo functions of humanise.py they correspond to)
+EDIT_TYPES = ['add_space', 'omit_space', 'swap_adjacent', 'omit_letter', 'double_letter', 'substitute_letter', 'add_letter']
+
+# Relative position of an edit in a word
+POSITIONS = ['first', 'middle', 'last']
+
+# Function to read real typo pairs
+def read_typo_pairs(dirpath):
+    """ Return (dirty, clean) lowercase word pairs of MaintNorm and maintnorm_corrections.csv that
+        look like typos: letters and spaces only, at most 2 edits apart and not much shorter
+        than the clean word (which would be an abbreviation) """
+    pairs = []
+    for file in sorted(glob.glob(os.path.join(dirpath, 'data', 'MaintNorm', '*.norm'))):
+        with open(file, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) == 2:
+                    pairs.append((fields[0], fields[1]))
+    with open(os.path.join(dirpath, 'data', 'Corrections', 'maintnorm_corrections.csv'), encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader) # Ignore header
+        for row in reader:
+            pairs.append((row[1], row[0]))
+    typos = []
+    for dirty, clean in pairs:
+        dirty, clean = dirty.lower(), clean.lower()
+        if dirty == clean or len(clean) < 3 or len(dirty) < 0.75 * len(clean):
+            continue
+        if not re.fullmatch(r'[a-z ]+', dirty) or not re.fullmatch(r'[a-z ]+', clean):
+            continue
+        if len(align_edits(clean, dirty)) <= 2:
+            typos.append((dirty, clean))
+    return typos
+
+# Function to get the position bucket of an index in a word
+def position_bucket(index, length):
+    """ Return 'first', 'middle' or 'last' """
+    if index <= 0:
+        return 'first'
+    if index >= length - 1:
+        return 'last'
+    return 'middle'
+
+# Function to align a clean word with its typo
+def align_edits(clean, dirty):
+    """ Align clean and dirty with optimal string alignment (Damerau-Levenshtein without
+        repeated edits of a substring) and return the edits (type, position, char, new char) """
+    rows, cols = len(clean) + 1, len(dirty) + 1
+    cost = [[0] * cols for _ in range(rows)]
+    for i in range(rows):
+        cost[i][0] = i
+    for j in range(cols):
+        cost[0][j] = j
+    for i in range(1, rows):
+        for j in range(1, cols):
+            cost[i][j] = min(cost[i - 1][j] + 1, cost[i][j - 1] + 1,
+                             cost[i - 1][j - 1] + (clean[i - 1] != dirty[j - 1]))
+            if i > 1 and j > 1 and clean[i - 1] == dirty[j - 2] and clean[i - 2] == dirty[j - 1] and clean[i - 1] != clean[i - 2]:
+                cost[i][j] = min(cost[i][j], cost[i - 2][j - 2] + 1)
+
+    # Trace back the alignment and classify each edit
+    edits = []
+    i, j = len(clean), len(dirty)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and cost[i][j] == cost[i - 1][j - 1] and clean[i - 1] == dirty[j - 1]:
+            i, j = i - 1, j - 1
+        elif i > 1 and j > 1 and clean[i - 1] == dirty[j - 2] and clean[i - 2] == dirty[j - 1] \
+                and clean[i - 1] != clean[i - 2] and cost[i][j] == cost[i - 2][j - 2] + 1:
+            edits.append(('swap_adjacent', position_bucket(i - 2, len(clean) - 1), clean[i - 2], clean[i - 1]))
+            i, j = i - 2, j - 2
+        elif i > 0 and j > 0 and cost[i][j] == cost[i - 1][j - 1] + 1:
+            edits.append(('substitute_letter', position_bucket(i - 1, len(clean)), clean[i - 1], dirty[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and cost[i][j] == cost[i - 1][j] + 1:
+            edit = 'omit_space' if clean[i - 1] == ' ' else 'omit_letter'
+            edits.append((edit, position_bucket(i - 1, len(clean)), clean[i - 1], ''))
+            i -= 1
+        else:
+            # Insertion after clean[i - 1] (before the first letter if i == 0)
+            previous = clean[i - 1] if i > 0 else ''
+            following = clean[i] if i < len(clean) else ''
+            if dirty[j - 1] == ' ':
+                edit = 'add_space'
+            elif dirty[j - 1] in (previous, following):
+                edit = 'double_letter'
+            else:
+                edit = 'add_letter'
+            edits.append((edit, position_bucket(i - 1, len(clean)), previous, dirty[j - 1]))
+            j -= 1
+    return edits[::-1]
+
+# Function to count the edits of typo pairs
+def count_edits(pairs):
+    """ Count edit types, positions per type, substitutions per letter and insertions per preceding letter """
+    counts = {'types': {}, 'positions': {}, 'substitute': {}, 'insert': {}}
+    for dirty, clean in pairs:
+        for edit, position, char, new_char in align_edits(clean, dirty):
+            counts['types'][edit] = counts['types'].get(edit, 0) + 1
+            positions = counts['positions'].setdefault(edit, {})
+            positions[position] = positions.get(position, 0) + 1
+            if edit in ('substitute_letter', 'add_letter'):
+                table = counts['substitute' if edit == 'substitute_letter' else 'insert'].setdefault(char, {})
+                table[new_char] = table.get(new_char, 0) + 1
+    return counts
+
+# Function to build a Vose alias table
+def build_alias_table(weights):
+    """ Build a Vose alias table of {label: weight}, sampled in constant time by sample_alias """
+    labels = list(weights)
+    total = sum(weights.values())
+    scaled = [weights[label] * len(labels) / total for label in labels]
+    prob, alias = [1.0] * len(labels), list(range(len(labels)))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less], alias[less] = scaled[less], more
+        scaled[more] += scaled[less] - 1
+        (small if scaled[more] < 1 else large).append(more)
+    return {'labels': labels, 'prob': prob, 'alias': alias}
+
+# Function to sample a label from an alias table
+def sample_alias(table, rng=random):
+    """ Sample a label of an alias table with one uniform index and one coin flip """
+    i = rng.randrange(len(table['labels']))
+    return table['labels'][i] if rng.random() < table['prob'][i] else table['labels'][table['alias'][i]]
+
+# Function to compile the typo model
+def compile_typo_model(pairs):
+    """ Compile edit counts of typo pairs into alias tables of edit types, positions per edit type,
+        and letter confusions (substitutions per letter, insertions per preceding letter) """
+    counts = count_edits(pairs)
+    fallback = {}
+    for table in list(counts['substitute'].values()) + list(counts['insert'].values()):
+        for char, count in table.items():
+            fallback[char] = fallback.get(char, 0) + count
+    return {
+        'counts': counts,
+        'types': build_alias_table(counts['types']),
+        'positions': {edit: build_alias_table(positions) for edit, positions in counts['positions'].items()},
+        'substitute': {char: build_alias_table(table) for char, table in counts['substitute'].items()},
+        'insert': {char: build_alias_table(table) for char, table in counts['insert'].items()},
+        'letters': build_alias_table(fallback)
+    }
+
+# Function to pick the index of an edit in a word
+def sample_index(model, edit, length, rng=random):
+    """ Sample an index in a word of length letters from the position table of the edit type """
+    position = sample_alias(model['positions'][edit], rng) if edit in model['positions'] else 'middle'
+    if position == 'first':
+        return 0
+    if position == 'last':
+        return length - 1
+    return rng.randint(1, length - 2)
+
+# Function to introduce an empirical typo into a word
+def apply_typo(word, model, rng=random):
+    """ Sample an edit type, position and letters from the model and apply them to the word.
+        Returns (word, edit type); 'omit_space' leaves the word for the caller to join with the next one. """
+    edit = sample_alias(model['types'], rng)
+    if len(word) < 3 or edit == 'omit_space': # Do not change short words
+        return word, edit
+    if edit == 'swap_adjacent':
+        index = min(sample_index(model, edit, len(word), rng), len(word) - 2)
+        return word[:index] + word[index + 1] + word[index] + word[index + 2:], edit
+    index = sample_index(model, edit, len(word), rng)
+    if edit == 'omit_letter':
+        return word[:index] + word[index + 1:], edit
+    if edit == 'double_letter':
+        return word[:index + 1] + word[index] + word[index + 1:], edit
+    if edit == 'add_space':
+        index = min(max(index, 1), len(word) - 1)
+        return word[:index] + ' ' + word[index:], edit
+    table = model['substitute' if edit == 'substitute_letter' else 'insert'].get(word[index], model['letters'])
+    letter = sample_alias(table, rng)
+    if edit == 'substitute_letter':
+        return word[:index] + letter + word[index + 1:], edit
+    return word[:index + 1] + letter + word[index + 1:], edit
+
+# Function to get the share of each edit type
+def edit_distribution(pairs):
+    """ Return {edit type: share of all edits} of (dirty, clean) pairs """
+    counts = count_edits(pairs)['types']
+    total = sum(counts.values()) or 1
+    return {edit: counts.get(edit, 0) / total for edit in EDIT_TYPES}
+
+if __name__ == '__main__':
+    from humanise import initialise_globals, rule_introduce_typos
+
+    parser = argparse.ArgumentParser(description="Compare typo distributions of the rule-based and empirical engines with MaintNorm")
+    parser.add_argument("--sentences", default="../Generate/mwo_sentences/order_synthetic.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    initialise_globals(main_dir)
+    human = read_typo_pairs(main_dir)
+    with open(args.sentences, encoding='utf-8') as f:
+        sentences = [row[0] for row in csv.reader(f) if row]
+
+    # Typos of each engine, aligned word by word with the clean sentence (always introducing typos)
+    distributions = {'human (MaintNorm)': edit_distribution(human)}
+    for engine in ('rules', 'empirical'):
+        rng = random.Random(args.seed)
+        pairs = []
+        for sentence in sentences:
+            dirty = rule_introduce_typos(sentence, chance=1.0, rng=rng, engine=engine)
+            if dirty != sentence:
+                pairs.append((dirty, sentence))
+        distributions[engine] = edit_distribution(pairs)
+
+    print(f"{len(human)} human typo pairs, {len(sentences)} sentences")
+    print(f"{'edit':<20}" + "".join(f"{name:>20}" for name in distributions))
+    for edit in EDIT_TYPES:
+        print(f"{edit:<20}" + "".join(f"{100 * distribution[edit]:>19.1f}%" for distribution in distributions.values()))
+    for engine in ('rules', 'empirical'):
+        distance = sum(abs(distributions[engine][edit] - distributions['human (MaintNorm)'][edit]) for edit in EDIT_TYPES) / 2
+        print(f"Total variation distance of {engine} from human typos: {distance:.3f}")
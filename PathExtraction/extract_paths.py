@@ -0,0 +1,131 @@
+# This file contains a command line runner that extracts the paths of all path queries concurrently
+
+import os
+import json
+import time
+import argparse
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from path_queries import (direct_queries, complex_queries, get_connect_objects, get_failure_mode,
+                          get_connect_objects_bulk, get_failure_modes_bulk, LOOKUP_STATS)
+from path_processing import collect_lookup_keys, iter_new_paths
+from maintie_reader import iter_records, iter_chunks
+
+# Function to stream the records of a path query from Neo4j
+def iter_neo4j_records(driver, query):
+    """ Yield records of a path query as they arrive, using a session of the driver's pool """
+    with driver.session() as session:
+        yield from session.run(query["query"])
+
+# Function to resolve the lookups of a batch of records in Neo4j
+def prefetch_lookups(driver, entities, entry_ids):
+    """ Memoise connect objects and failure modes of a batch with one query each """
+    get_connect_objects_bulk(driver, entities)
+    get_failure_modes_bulk(driver, entry_ids)
+
+# Function to create the Neo4j backend of the runner
+def neo4j_backend(driver):
+    """ Return records, lookup and prefetch functions backed by Neo4j """
+    return {
+        "records": partial(iter_neo4j_records, driver),
+        "get_connect": partial(get_connect_objects, driver),
+        "get_failure": partial(get_failure_mode, driver),
+        "prefetch": partial(prefetch_lookups, driver)
+    }
+
+# Function to create the in-memory backend of the runner
+def memory_backend(graph):
+    """ Return records and lookup functions backed by the in-memory KG engine """
+    import kg_engine
+    return {
+        "records": partial(kg_engine.run_query, graph),
+        "get_connect": partial(kg_engine.get_connect_objects, graph),
+        "get_failure": partial(kg_engine.get_failure_mode, graph),
+        "prefetch": None
+    }
+
+# Function to extract the paths of a query into a JSONL file
+def run_query_to_jsonl(query, backend, outpath, batch_size=500):
+    """ Stream the records of a query through path expansion into <outfile>.jsonl.
+        Lookups are resolved in bulk for each batch of records as it arrives.
+        Returns row and path counts and the time taken. """
+    start = time.perf_counter()
+    complex = query in complex_queries
+    counts = {"outfile": query["outfile"], "rows": 0, "paths": 0, "valid": 0, "alternate": 0}
+    seen = set()
+    filepath = os.path.join(outpath, f"{query['outfile']}.jsonl")
+    with open(filepath, 'w', encoding='utf-8') as f:
+        for batch in iter_chunks(backend["records"](query), batch_size):
+            counts["rows"] += len(batch)
+            if backend["prefetch"]:
+                backend["prefetch"](*collect_lookup_keys(query, batch, complex=complex))
+            for path in iter_new_paths(query, batch, seen, backend["get_connect"], backend["get_failure"], complex=complex):
+                f.write(json.dumps(path) + "\n")
+                counts["paths"] += 1
+                counts["valid"] += path["valid"]
+                counts["alternate"] += path["alternate"]
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+# Function to run path queries concurrently
+def run_queries(queries, backend, outpath, workers=4, batch_size=500):
+    """ Run queries on a pool of workers, printing counts of each query as it finishes.
+        Wall time is close to the slowest single query when workers >= len(queries). """
+    start = time.perf_counter()
+    results = []
+    print(f"{'Pattern':<30}{'Rows':>8}{'Paths':>8}{'Valid':>8}{'Alternate':>11}{'Time':>9}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_query_to_jsonl, query, backend, outpath, batch_size) for query in queries]
+        for future in as_completed(futures):
+            counts = future.result()
+            results.append(counts)
+            print(f"{counts['outfile']:<30}{counts['rows']:>8}{counts['paths']:>8}{counts['valid']:>8}"
+                  f"{counts['alternate']:>11}{counts['seconds']:>8.2f}s")
+    wall_time = time.perf_counter() - start
+    print(f"{'-' * 74}")
+    print(f"Wall time {wall_time:.2f}s, sum of query times {sum(c['seconds'] for c in results):.2f}s, "
+          f"slowest query {max((c['seconds'] for c in results), default=0):.2f}s")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract paths of all path queries into per-pattern JSONL files")
+    parser.add_argument("--backend", choices=["neo4j", "memory"], default="neo4j")
+    parser.add_argument("--data", default="../data/MaintIE/gold_release.json",
+                        help="MaintIE records for the memory backend")
+    parser.add_argument("--failure-modes", default="../data/MaintIE/gold_undesirable_mapped.csv")
+    parser.add_argument("--snapshot", help="graph snapshot for the memory backend")
+    parser.add_argument("--outpath", default="path_patterns/")
+    parser.add_argument("--workers", type=int, default=len(direct_queries + complex_queries))
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="records per batch of bulk lookups")
+    parser.add_argument("--queries", nargs="+", help="outfiles of the queries to run (default: all)")
+    args = parser.parse_args()
+
+    queries = direct_queries + complex_queries
+    if args.queries:
+        queries = [query for query in queries if query["outfile"] in args.queries]
+    os.makedirs(args.outpath, exist_ok=True)
+
+    if args.backend == "neo4j":
+        from dotenv import load_dotenv
+        from neo4j import GraphDatabase
+
+        # Connect to Neo4j; each worker takes a session from the driver's connection pool
+        load_dotenv()
+        URI = os.getenv("NEO4J_URI")
+        USERNAME = os.getenv("NEO4J_USER")
+        PASSWORD = os.getenv("NEO4J_PASSWORD")
+        driver = GraphDatabase.driver(URI, auth=(USERNAME, PASSWORD), max_connection_pool_size=2 * args.workers)
+        run_queries(queries, neo4j_backend(driver), args.outpath, args.workers, args.batch_size)
+        print(f"Lookup memo: {LOOKUP_STATS['hits']} hits, {LOOKUP_STATS['misses']} misses")
+        driver.close()
+    else:
+        import kg_engine
+        from maintie_to_kg import read_failure_mode_mapping
+
+        if args.snapshot and os.path.exists(args.snapshot):
+            graph = kg_engine.load_snapshot(args.snapshot)
+        else:
+            graph = kg_engine.build_graph(iter_records(args.data), read_failure_mode_mapping(args.failure_modes))
+        run_queries(queries, memory_backend(graph), args.outpath, args.workers, args.batch_size)
@@ -0,0 +1,74 @@
+# This file contains the transitive closures of the isA and hasPart/contains hierarchies
+
+# Hierarchy relations: closure name -> (relations, lower end of relation, keep paths)
+# isA:      (o)-[:isA]->(x), x is the ancestor (substitute) of o
+# connect:  (a)-[:hasPart|contains]->(b), a is the ancestor (connect object) of b
+HIERARCHIES = {
+    "isA": {"relations": ["isA"], "lower": "head", "paths": False, "closure_type": "isAClosure"},
+    "connect": {"relations": ["hasPart", "contains"], "lower": "tail", "paths": True, "closure_type": "hasPartClosure"}
+}
+
+# Function to create an empty closure table
+def new_closure(keep_paths=False):
+    """ Create empty closure table.
+        up: {node: {ancestor: value}}, down: {ancestor: {node: value}}, where value is the
+        shortest path length, or the list of paths (ancestor-side nodes, nearest first) if keep_paths. """
+    return {"paths": keep_paths, "up": {}, "down": {}, "edges": set()}
+
+# Function to check that a path does not use the same relation twice
+def is_relation_unique(lower, path):
+    """ Check path (nodes above lower, nearest first) has no repeated relation """
+    nodes = (lower,) + path
+    pairs = list(zip(nodes, nodes[1:]))
+    return len(pairs) == len(set(pairs))
+
+# Function to add a hierarchy relation to a closure table
+def add_closure_edge(closure, lower, upper):
+    """ Add relation lower -> upper and update the closure incrementally.
+        Returns list of (node, ancestor) pairs whose closure value changed. """
+    if (lower, upper) in closure["edges"]:
+        return []
+    closure["edges"].add((lower, upper))
+    up, down = closure["up"], closure["down"]
+
+    # Nodes below lower and above upper, from the closure before this relation
+    if closure["paths"]:
+        lowers = [(lower, ())] + [(d, p) for d, paths in down.get(lower, {}).items() for p in paths]
+        uppers = [(upper, (upper,))] + [(a, (upper,) + p) for a, paths in up.get(upper, {}).items() for p in paths]
+    else:
+        lowers = [(lower, 0)] + list(down.get(lower, {}).items())
+        uppers = [(upper, 1)] + [(a, length + 1) for a, length in up.get(upper, {}).items()]
+
+    changed = []
+    for d, below in lowers:
+        for a, above in uppers:
+            if closure["paths"]:
+                path = below + above
+                if not is_relation_unique(d, path):
+                    continue
+                up.setdefault(d, {}).setdefault(a, []).append(path)
+                down.setdefault(a, {})[d] = up[d][a]
+            else:
+                length = below + above
+                if length >= up.get(d, {}).get(a, length + 1):
+                    continue
+                up.setdefault(d, {})[a] = length
+                down.setdefault(a, {})[d] = length
+            changed.append((d, a))
+    return list(dict.fromkeys(changed))
+
+# Function to build a closure table from hierarchy relations
+def build_closure(edges, keep_paths=False):
+    """ Build closure table from (lower, upper) relations """
+    closure = new_closure(keep_paths)
+    for lower, upper in edges:
+        add_closure_edge(closure, lower, upper)
+    return closure
+
+# Function to get ancestors of a node, nearest first
+def get_ancestors(closure, node):
+    """ Return ancestors of node ordered by shortest path length """
+    ancestors = closure["up"].get(node, {})
+    if closure["paths"]:
+        return sorted(ancestors, key=lambda a: min(len(p) for p in ancestors[a]))
+    return sorted(ancestors, key=ancestors.get)
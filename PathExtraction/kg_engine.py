@@ -0,0 +1,316 @@
+# This file contains an in-memory KG engine that runs the path queries without Neo4j
+
+import os
+import json
+import time
+import pickle
+import argparse
+from functools import partial
+from collections import Counter
+
+from maintie_to_kg import (resolve_graph, read_failure_mode_mapping, label_failure_modes,
+                           stable_id, diff_records, affected_patterns)
+from path_queries import direct_queries, complex_queries
+from maintie_reader import iter_records, iter_chunks
+from path_processing import list_to_json, print_path_counts, process_query_results
+from kg_closure import HIERARCHIES, new_closure, add_closure_edge, get_ancestors
+
+# isA substitute collections returned for each label (see *_RETURN in path_queries.py)
+SUBSTITUTE_NAMES = {
+    "PhysicalObject": "substitute_objects",
+    "Property": "substitute_property",
+    "Process": "substitute_process",
+    "State": "substitute_state",
+    "Activity": "substitute_activity"
+}
+
+# Function to add a node to the in-memory graph
+def add_node(graph, label, properties):
+    """ Add node to graph and its label, subtype and text indexes.
+        Nodes are keyed by (label, id) as entry ids overlap entity ids. """
+    key = (label, properties["id"])
+    graph["nodes"][key] = properties
+    graph["labels"].setdefault(label, []).append(key)
+    graph["subtypes"].setdefault((label, properties.get("subtype0")), []).append(key)
+    graph["text"][(label, properties["text"])] = key
+    return key
+
+# Function to add a relation to the in-memory graph
+def add_edge(graph, head, rel_type, tail):
+    """ Add relation to the outgoing and incoming adjacency indexes (merged like MERGE). """
+    tails = graph["out"].setdefault(rel_type, {}).setdefault(head, [])
+    if tail in tails:
+        return False
+    tails.append(tail)
+    graph["in"].setdefault(rel_type, {}).setdefault(tail, []).append(head)
+    return True
+
+# Function to update the hierarchy closures with a new relation
+def update_closures(graph, head, rel_type, tail):
+    """ Incrementally update the isA or hasPart/contains closure table """
+    for name, hierarchy in HIERARCHIES.items():
+        if rel_type in hierarchy["relations"]:
+            lower, upper = (head, tail) if hierarchy["lower"] == "head" else (tail, head)
+            add_closure_edge(graph["closure"][name], lower, upper)
+
+# Function to merge resolved rows into the in-memory graph
+def merge_rows(graph, entities, relations, entries, mentions):
+    """ Merge resolved entity, relation, entry and comesFrom rows into the graph.
+        Existing entities only get the entry ids they do not have yet. """
+    for label, rows in entities.items():
+        for row in rows:
+            node = graph["nodes"].get((label, row["id"]))
+            if node is None:
+                add_node(graph, label, row)
+            else:
+                node["entry_id"] += [x for x in row["entry_id"] if x not in node["entry_id"]]
+    for row in entries:
+        node = graph["nodes"].get(("Entry", row["id"]))
+        if node is None:
+            add_node(graph, "Entry", row)
+        else:
+            node.update(row)
+    for (head_label, rel_type, tail_label), rows in relations.items():
+        for row in rows:
+            head, tail = (head_label, row["head_id"]), (tail_label, row["tail_id"])
+            if add_edge(graph, head, rel_type, tail):
+                update_closures(graph, head, rel_type, tail)
+    for label, rows in mentions.items():
+        for row in rows:
+            entity_keys = graph["mentions"].setdefault(("Entry", row["entry_id"]), [])
+            if (label, row["entity_id"]) not in entity_keys:
+                entity_keys.append((label, row["entity_id"]))
+
+# Function to create in-memory graph
+def build_graph(data, failure_mode_mapping=None):
+    """ Create in-memory graph from MaintIE dataset, with the same nodes,
+        properties and relations as maintie_to_kg.py writes to Neo4j. """
+    entities, relations, entries, mentions = resolve_graph(data)
+    if failure_mode_mapping:
+        label_failure_modes(entries, failure_mode_mapping)
+
+    graph = {"nodes": {}, "labels": {}, "subtypes": {}, "text": {}, "out": {}, "in": {}, "mentions": {},
+             "closure": {name: new_closure(h["paths"]) for name, h in HIERARCHIES.items()}}
+    merge_rows(graph, entities, relations, entries, mentions)
+    return graph
+
+# Function to unlink changed entries from the entities they used to mention
+def unlink_entries(graph, entry_ids):
+    """ Remove entry ids of changed entries from their entities.
+        Returns the (label, subtype0) of the unlinked entities for each entry. """
+    removed_mentions = []
+    for entry_id in entry_ids:
+        types = set()
+        for key in graph["mentions"].pop(("Entry", entry_id), []):
+            node = graph["nodes"][key]
+            node["entry_id"] = [x for x in node["entry_id"] if x != entry_id]
+            types.add((key[0], node.get("subtype0")))
+        removed_mentions.append(types)
+    return removed_mentions
+
+# Function to ingest new or changed records into the in-memory graph
+def ingest_records(graph, data, failure_mode_mapping=None, chunk_size=10000):
+    """ Merge only new or changed records into the graph and
+        return the outfiles of path queries that need to be re-run. """
+    affected = set()
+    num_records, num_delta, num_changed = 0, 0, 0
+    for chunk in iter_chunks(data, chunk_size):
+        stored_hashes = {}
+        for entry in chunk:
+            entry_id = stable_id("Entry", entry["text"])
+            node = graph["nodes"].get(("Entry", entry_id))
+            if node is not None:
+                stored_hashes[entry_id] = node.get("record_hash")
+        delta, changed = diff_records(chunk, stored_hashes)
+        num_records += len(chunk)
+        num_delta += len(delta)
+        num_changed += len(changed)
+        if not delta:
+            continue
+        removed_mentions = unlink_entries(graph, changed)
+        entities, relations, entries, mentions = resolve_graph(delta)
+        if failure_mode_mapping:
+            label_failure_modes(entries, failure_mode_mapping)
+        merge_rows(graph, entities, relations, entries, mentions)
+        affected.update(affected_patterns(delta, relations, removed_mentions))
+    print(f"{num_delta} new or changed records ({num_changed} changed) out of {num_records}")
+    return [query["outfile"] for query in direct_queries + complex_queries if query["outfile"] in affected]
+
+# Function to save in-memory graph snapshot
+def save_snapshot(graph, filepath):
+    """ Save in-memory graph to a local snapshot file """
+    with open(filepath, 'wb') as f:
+        pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Function to load in-memory graph snapshot
+def load_snapshot(filepath):
+    """ Load in-memory graph from a local snapshot file """
+    with open(filepath, 'rb') as f:
+        graph = pickle.load(f)
+    # Snapshots saved before closures were kept: rebuild them from the hierarchy relations
+    if "closure" not in graph:
+        graph["closure"] = {name: new_closure(h["paths"]) for name, h in HIERARCHIES.items()}
+        for rel_type, heads in graph["out"].items():
+            for head, tails in heads.items():
+                for tail in tails:
+                    update_closures(graph, head, rel_type, tail)
+    return graph
+
+# Function to check if node has the label and subtype of a pattern variable
+def node_matches(graph, key, label, subtype):
+    """ Check node label and subtype0 against pattern constraints """
+    if key[0] != label:
+        return False
+    return subtype is None or graph["nodes"][key].get("subtype0") == subtype
+
+# Function to return isA* ancestors of a node with a given label
+def get_substitutes(graph, key, label):
+    """ Return nodes reachable by one or more isA relations, nearest first """
+    return [a for a in get_ancestors(graph["closure"]["isA"], key) if a[0] == label]
+
+# Function to match the MATCH clauses of a path query
+def match_pattern(graph, pattern):
+    """ Return list of variable bindings {variable: node key} matching the pattern """
+    nodes = pattern["nodes"]
+    bindings = [{}]
+    for head, rel_type, tail in pattern["edges"]:
+        out_edges = graph["out"].get(rel_type, {})
+        in_edges = graph["in"].get(rel_type, {})
+        next_bindings = []
+        for binding in bindings:
+            if head in binding:
+                pairs = [(binding[head], t) for t in out_edges.get(binding[head], [])]
+            elif tail in binding:
+                pairs = [(h, binding[tail]) for h in in_edges.get(binding[tail], [])]
+            else:
+                label, subtype = nodes[head]
+                candidates = graph["labels"].get(label, []) if subtype is None else graph["subtypes"].get((label, subtype), [])
+                pairs = [(h, t) for h in candidates for t in out_edges.get(h, [])]
+            for h, t in pairs:
+                if binding.get(head, h) != h or binding.get(tail, t) != t:
+                    continue
+                if not node_matches(graph, h, *nodes[head]) or not node_matches(graph, t, *nodes[tail]):
+                    continue
+                next_bindings.append({**binding, head: h, tail: t})
+        bindings = next_bindings
+    return bindings
+
+# Function to run a path query against the in-memory graph
+def run_query(graph, query):
+    """ Return records shaped like the Neo4j results of the query """
+    pattern = query["pattern"]
+    substitutes = pattern.get("substitutes", list(pattern["nodes"]))
+    records = []
+    for binding in match_pattern(graph, pattern):
+        record = {}
+        for var, name in pattern["returns"].items():
+            record[f"{name}_properties"] = graph["nodes"][binding[var]]
+        for var in substitutes:
+            label = pattern["nodes"][var][0]
+            record[SUBSTITUTE_NAMES[label]] = [graph["nodes"][k] for k in get_substitutes(graph, binding[var], label)]
+        records.append(record)
+    return records
+
+# Function to return recursive hasPart/contains PhysicalObjects
+def get_connect_objects(graph, entity):
+    """ Return recursive hasPart/contains PhysicalObjects, nearest first """
+    target = graph["text"].get(("PhysicalObject", entity))
+    if target is None:
+        return []
+    connect_objects = []
+    for ancestor, paths in graph["closure"]["connect"]["up"].get(target, {}).items():
+        if ancestor[0] != "PhysicalObject":
+            continue
+        for path in paths:
+            connect_objects.append([graph["nodes"][node]["text"] for node in path])
+    return connect_objects
+
+# Function to return failure mode of an entry entity
+def get_failure_mode(graph, entry_id):
+    """ Return failure mode of an entry entity """
+    entry = graph["nodes"].get(("Entry", entry_id))
+    if entry:
+        return entry.get("failure_mode")
+    return None
+
+# Function to extract paths of a query from the in-memory graph
+def extract_paths(graph, query, complex=False):
+    """ Run query and process its records into paths """
+    paths = []
+    process_query_results(query, run_query(graph, query), paths,
+                          partial(get_connect_objects, graph), partial(get_failure_mode, graph),
+                          complex=complex)
+    return paths
+
+# Function to compare extracted paths with recorded paths
+def compare_paths(paths, recorded, ignore=("valid", "failure_mode")):
+    """ Compare extracted paths against recorded paths (e.g. from Neo4j), ignoring order.
+        'valid' is ignored as recorded paths may be updated by human validation, and
+        'failure_mode' as it depends on which common entry is picked (see failure_mode_changes). """
+    def key(path):
+        return json.dumps({k: v for k, v in path.items() if k not in ignore}, sort_keys=True)
+    extracted = Counter(key(path) for path in paths)
+    recorded = Counter(key(path) for path in recorded)
+    missing = list((recorded - extracted).elements())
+    extra = list((extracted - recorded).elements())
+    return missing, extra
+
+# Function to compare failure modes of extracted paths with recorded paths
+def failure_mode_changes(paths, recorded):
+    """ Return (path, recorded failure mode, extracted failure mode) of paths whose failure mode differs.
+        Recorded paths picked an arbitrary common entry (set.pop() over Neo4j ids), so a path with
+        several common entries can get another failure mode, but should not lose it. """
+    def key(path):
+        return json.dumps({k: v for k, v in path.items() if k not in ("valid", "failure_mode")}, sort_keys=True)
+    extracted = {key(path): path.get("failure_mode") for path in paths}
+    return [(key(path), path.get("failure_mode"), extracted[key(path)]) for path in recorded
+            if key(path) in extracted and path.get("failure_mode") != extracted[key(path)]]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract paths from MaintIE with the in-memory KG engine")
+    parser.add_argument("--data", default="../data/MaintIE/gold_release.json")
+    parser.add_argument("--failure-modes", default="../data/MaintIE/gold_undesirable_mapped.csv")
+    parser.add_argument("--outpath", default="path_patterns/")
+    parser.add_argument("--snapshot", help="local graph snapshot to load (built from --data if missing) and save")
+    parser.add_argument("--ingest", help="json file of new or changed records to merge into the graph; "
+                                         "only affected path patterns are re-extracted")
+    parser.add_argument("--check", action="store_true",
+                        help="compare against existing path_patterns json files instead of writing them")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    failure_mode_mapping = read_failure_mode_mapping(args.failure_modes)
+    if args.snapshot and os.path.exists(args.snapshot):
+        graph = load_snapshot(args.snapshot)
+    else:
+        graph = build_graph(iter_records(args.data), failure_mode_mapping)
+    print(f"Loaded graph with {len(graph['nodes'])} nodes in {time.perf_counter() - start:.2f}s")
+
+    queries = direct_queries + complex_queries
+    if args.ingest:
+        affected = ingest_records(graph, iter_records(args.ingest), failure_mode_mapping)
+        print(f"Path patterns to re-run: {', '.join(affected) if affected else 'none'}")
+        queries = [query for query in queries if query["outfile"] in affected]
+    if args.snapshot:
+        save_snapshot(graph, args.snapshot)
+
+    num_mismatch = 0
+    for query in queries:
+        paths = extract_paths(graph, query, complex=query in complex_queries)
+        outfile = os.path.join(args.outpath, f"{query['outfile']}.json")
+        if args.check:
+            with open(outfile, encoding='utf-8') as f:
+                recorded = json.load(f)
+            missing, extra = compare_paths(paths, recorded)
+            changes = failure_mode_changes(paths, recorded)
+            lost = [change for change in changes if change[1] is not None and change[2] is None]
+            num_mismatch += len(missing) + len(extra) + len(lost)
+            print(f"{query['outfile']:<30}{len(paths):>6} paths, {len(missing)} missing, {len(extra)} extra, "
+                  f"{len(changes)} other failure modes ({len(lost)} lost)")
+        else:
+            print_path_counts(query, paths)
+            list_to_json(paths, outfile)
+
+    print(f"Finished in {time.perf_counter() - start:.2f}s")
+    if args.check and num_mismatch:
+        raise SystemExit(1)
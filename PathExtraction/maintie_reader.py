@@ -0,0 +1,93 @@
+# This file contains a streaming reader for MaintIE-format annotation corpora
+
+import json
+from itertools import islice
+
+# Fields kept from each record
+RECORD_FIELDS = ["text", "tokens", "entities", "relations"]
+
+# Function to validate entity spans and relation indexes of a record
+def validate_record(record, index):
+    """ Raise ValueError if a record has missing fields, invalid entity spans
+        or relations that point to entities outside the record. """
+    for field in RECORD_FIELDS:
+        if field not in record:
+            raise ValueError(f"Record {index}: missing '{field}'")
+    num_tokens = len(record["tokens"])
+    for i, entity in enumerate(record["entities"]):
+        if not 0 <= entity["start"] < entity["end"] <= num_tokens:
+            raise ValueError(f"Record {index}: entity {i} span [{entity['start']}, {entity['end']}) "
+                             f"outside {num_tokens} tokens")
+    num_entities = len(record["entities"])
+    for i, relation in enumerate(record["relations"]):
+        if not (0 <= relation["head"] < num_entities and 0 <= relation["tail"] < num_entities):
+            raise ValueError(f"Record {index}: relation {i} ({relation['head']} -> {relation['tail']}) "
+                             f"outside {num_entities} entities")
+
+# Function to iterate the items of a JSON array without loading the whole file
+def iter_json_array(file, chunk_size=1 << 20):
+    """ Yield the items of a top-level JSON array one at a time,
+        reading the file in chunks of chunk_size characters. """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    started = False
+    while True:
+        # Skip whitespace, the opening bracket and separators
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ',' or (not started and buffer[pos] == '[')):
+            started = started or buffer[pos] == '['
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            if pos >= len(buffer):
+                raise json.JSONDecodeError("Empty buffer", buffer, pos)
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Item is incomplete: drop consumed text and read the next chunk
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            if eof and not buffer.strip():
+                return
+            continue
+        yield item
+        pos = end
+
+# Function to iterate records of a MaintIE-format corpus
+def iter_records(filepath, validate=True, skip_invalid=False):
+    """ Yield records (text, tokens, entities, relations) one at a time
+        from a JSON array or JSONL file, validating them as they are read. """
+    with open(filepath, 'r', encoding='utf-8') as file:
+        first = file.read(1)
+        while first and first.isspace():
+            first = file.read(1)
+        file.seek(0)
+        if first == '[':
+            items = iter_json_array(file)
+        else:
+            items = (json.loads(line) for line in file if line.strip())
+
+        for index, item in enumerate(items):
+            record = {field: item.get(field) for field in RECORD_FIELDS if field in item}
+            if validate:
+                try:
+                    validate_record(record, index)
+                except ValueError as error:
+                    if not skip_invalid:
+                        raise
+                    print(f"Skipping invalid record: {error}")
+                    continue
+            yield record
+
+# Function to group records into chunks
+def iter_chunks(records, chunk_size):
+    """ Yield lists of up to chunk_size records from an iterable """
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
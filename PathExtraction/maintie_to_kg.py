@@ -1,8 +1,13 @@
 import os
 import csv
 import json
-from dotenv import load_dotenv
-from neo4j import GraphDatabase
+import time
+import hashlib
+import argparse
+
+from path_queries import direct_queries, complex_queries
+from maintie_reader import iter_records, iter_chunks
+from kg_closure import HIERARCHIES, add_closure_edge, build_closure
 
 # Function to create label names
 def create_label_name(tokens, start, end):
@@ -11,67 +16,6 @@ def create_label_name(tokens, start, end):
     label = label.lower().strip()
     return label
 
-# Function to create nodes
-def create_nodes(tx, entities, unique_entities, tokens, entry_id):
-    """ Create nodes for entities. """
-    current_entities = []
-    for entity in entities:
-        entity_text = create_label_name(tokens, entity["start"], entity["end"])
-        entity_type = entity["type"].split('/')[0]
-        sub_types = entity["type"].split('/')[1:]
-        unique_entity_key = (entity_text, entity_type)
-        current_entities.append(unique_entity_key)
-
-        if unique_entity_key not in unique_entities:
-            entity_id = len(unique_entities)
-            unique_entities[unique_entity_key] = entity_id
-            properties = {"id": entity_id, "text": entity_text, "type": entity_type, "entry_id": [entry_id]}
-            query = f"MERGE (n:{entity_type} {{id: $id, text: $text, type: $type, entry_id: $entry_id}}) "
-            for i, subtype in enumerate(sub_types):
-                properties[f"subtype{i}"] = subtype
-                query += f"SET n.subtype{i} = $subtype{i} "
-            tx.run(query, properties)
-        else:
-            entity_id = unique_entities[unique_entity_key]
-            tx.run(
-                "MATCH (n) WHERE n.id = $id "
-                "SET n.entry_id = n.entry_id + $entry_id",
-                id=entity_id, entry_id=[entry_id]
-            )
-    return current_entities, unique_entities
-
-# Function to create relations
-def create_relations(tx, relations, unique_entities, current_entities):
-    """ Create relations between entities. """
-    for relation in relations:
-        head = relation["head"]
-        tail = relation["tail"]
-        rel_type = relation["type"].replace("/", "_")
-        head_id = unique_entities[current_entities[head]]
-        tail_id = unique_entities[current_entities[tail]]
-        tx.run(
-            f"MATCH (a {{id: $head_id}}), (b {{id: $tail_id}}) "
-            "WHERE NOT a:Entry AND NOT b:Entry "
-            f"MERGE (a)-[:{rel_type}]->(b)", 
-            head_id=head_id, tail_id=tail_id, type=rel_type
-        )
-
-# Function to create entry nodes and connect to its entities
-def create_entry(tx, entry_text, entry_id):
-    """ Create nodes for entries and connect to its entities. """
-    # Create entry node
-    tx.run(
-        "MERGE (n:Entry {id: $id, text: $text})",
-        id=entry_id, text=entry_text
-    )
-    # Connect entry node to its entities
-    tx.run(
-        "MATCH (a:Entry {id: $id}), (b) "
-        "WHERE ANY(eid IN b.entry_id WHERE eid = $entry_id) "
-        "MERGE (b)-[:comesFrom]->(a)",
-        id=entry_id, entry_id=entry_id
-    )
-
 # Function to read MaintIE manual mapping of failure mode codes
 def read_failure_mode_mapping(filepath):
     with open(filepath, 'r', encoding='utf-8') as file:
@@ -83,33 +27,367 @@ def read_failure_mode_mapping(filepath):
                 failure_mode_mapping[row[0]] = row[3]
     return failure_mode_mapping # entry_text: failure_mode
 
-# Function to label entry to failure mode codes
-def entry_failure_mode(tx, failure_mode_mapping):
-    for entry_text, failure_mode in failure_mode_mapping.items():
-        tx.run(
-            "MATCH (a:Entry {text: $entry_text}) "
-            "SET a.failure_mode = $failure_mode",
-            entry_text=entry_text, failure_mode=failure_mode
-        )
-
-# Function to create graph
-def create_graph(tx, data):
-    """ Create graph from MaintIE dataset. """
-    unique_entities = {}
-    for entry_id, entry in enumerate(data):
-        entities = entry["entities"]
-        relations = entry["relations"]
+# Function to join failure mode codes to entry rows by text
+def label_failure_modes(entries, failure_mode_mapping):
+    """ Set failure_mode on entry rows whose text is in the mapping. """
+    num_labelled = 0
+    for entry in entries:
+        failure_mode = failure_mode_mapping.get(entry["text"])
+        if failure_mode is not None:
+            entry["failure_mode"] = failure_mode
+            num_labelled += 1
+    return num_labelled
+
+# Function to create stable content-derived ids
+def stable_id(*parts):
+    """ Return a stable 60-bit integer id derived from the given strings,
+        so the same entity/entry gets the same id in every build. """
+    digest = hashlib.sha1("\x1f".join(parts).encode('utf-8')).hexdigest()
+    return int(digest[:15], 16)
+
+# Function to hash the annotation content of a record
+def record_hash(entry):
+    """ Return content hash of a record (text, tokens, entities, relations). """
+    content = json.dumps([entry["text"], entry["tokens"], entry["entities"], entry["relations"]], sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+# Function to get the (label, subtype0) of every entity mentioned in a record
+def mention_types(entry):
+    """ Return set of (label, subtype0) of the entities in a record. """
+    types = set()
+    for entity in entry["entities"]:
+        type_parts = entity["type"].split('/')
+        types.add((type_parts[0], type_parts[1] if len(type_parts) > 1 else None))
+    return types
+
+# Function to resolve entities, relations and entries before writing to graph
+def resolve_graph(data):
+    """ Resolve entity, relation, entry and comesFrom rows from MaintIE dataset.
+        Entity ids derive from (type, text) and entry ids from entry text. """
+    unique_entities = {}    # (text, type): entity row
+    relations = {}          # (head_label, rel_type, tail_label): {(head_id, tail_id): None}
+    mentions = {}           # entity_label: {(entity_id, entry_id): None}
+    entries = {}            # entry_id: entry row
+    for entry in data:
+        entry_id = stable_id("Entry", entry["text"])
         tokens = entry["tokens"]
-        current_entities, unique_entities = create_nodes(tx, entities, unique_entities, tokens, entry_id)
-        create_relations(tx, relations, unique_entities, current_entities)
-        create_entry(tx, entry['text'], entry_id) 
-        entry_failure_mode(tx, read_failure_mode_mapping('../data/MaintIE/gold_undesirable_mapped.csv'))
+        current_entities = []
+        for entity in entry["entities"]:
+            entity_text = create_label_name(tokens, entity["start"], entity["end"])
+            entity_type = entity["type"].split('/')[0]
+            sub_types = entity["type"].split('/')[1:]
+            unique_entity_key = (entity_text, entity_type)
+            if unique_entity_key not in unique_entities:
+                entity_id = stable_id(entity_type, entity_text)
+                row = {"id": entity_id, "text": entity_text, "type": entity_type, "entry_id": []}
+                for i, subtype in enumerate(sub_types):
+                    row[f"subtype{i}"] = subtype
+                unique_entities[unique_entity_key] = row
+            row = unique_entities[unique_entity_key]
+            row["entry_id"].append(entry_id)
+            current_entities.append(row)
+            mentions.setdefault(entity_type, {})[(row["id"], entry_id)] = None
+
+        for relation in entry["relations"]:
+            head = current_entities[relation["head"]]
+            tail = current_entities[relation["tail"]]
+            rel_type = relation["type"].replace("/", "_")
+            key = (head["type"], rel_type, tail["type"])
+            relations.setdefault(key, {})[(head["id"], tail["id"])] = None
+
+        entries[entry_id] = {"id": entry_id, "text": entry["text"], "record_hash": record_hash(entry)}
 
-    print(f"Created {len(unique_entities)} entities.")
-    print(f"Created {len(data)} entry entities.")
-    print(f"Total number of nodes: {len(unique_entities) + len(data)}")
+    # Group entity rows by label (labels cannot be parameterised in Cypher)
+    entities = {}
+    for row in unique_entities.values():
+        entities.setdefault(row["type"], []).append(row)
+    relations = {key: [{"head_id": h, "tail_id": t} for h, t in pairs] for key, pairs in relations.items()}
+    mentions = {label: [{"entity_id": e, "entry_id": i} for e, i in pairs] for label, pairs in mentions.items()}
+    return entities, relations, list(entries.values()), mentions
+
+# Function to find new or changed records
+def diff_records(data, stored_hashes):
+    """ Return records that are new or changed compared to the stored record hashes
+        {entry_id: record_hash}, and the entry ids of the changed ones. """
+    delta, changed = [], []
+    for entry in data:
+        entry_id = stable_id("Entry", entry["text"])
+        stored = stored_hashes.get(entry_id)
+        if stored == record_hash(entry):
+            continue
+        if stored is not None:
+            changed.append(entry_id)
+        delta.append(entry)
+    return delta, changed
+
+# Function to list path queries affected by an ingested delta
+def affected_patterns(delta, relations, removed_mentions=(), queries=None):
+    """ Return outfiles of path queries whose paths may change with the delta.
+        A query is affected if the delta adds one of its relations or an isA/hasPart/contains
+        relation (alternate paths), or if a new or removed record mentions entities for
+        every node of the query (path validity and failure mode). """
+    if queries is None:
+        queries = direct_queries + complex_queries
+    rel_types = {rel_type for _, rel_type, _ in relations}
+    mention_sets = [mention_types(entry) for entry in delta] + list(removed_mentions)
+    affected = []
+    for query in queries:
+        pattern = query["pattern"]
+        if rel_types & ({"isA", "hasPart", "contains"} | {rel_type for _, rel_type, _ in pattern["edges"]}):
+            affected.append(query["outfile"])
+            continue
+        for types in mention_sets:
+            if all(any(label == l and (subtype is None or subtype == s) for l, s in types)
+                   for label, subtype in pattern["nodes"].values()):
+                affected.append(query["outfile"])
+                break
+    return affected
+
+# Function to create uniqueness constraints and indexes before loading
+def create_constraints(session, labels):
+    """ Create uniqueness constraints on id and indexes on text for each label. """
+    for label in labels:
+        session.run(f"CREATE CONSTRAINT {label.lower()}_id IF NOT EXISTS "
+                    f"FOR (n:{label}) REQUIRE n.id IS UNIQUE")
+        session.run(f"CREATE INDEX {label.lower()}_text IF NOT EXISTS "
+                    f"FOR (n:{label}) ON (n.text)")
+
+# Function to write rows in UNWIND batches
+def write_batches(session, query, rows, batch_size=1000):
+    """ Write rows with an UNWIND query in batches, one transaction per batch. """
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        session.execute_write(lambda tx: tx.run(query, rows=batch).consume())
+    return len(rows)
+
+# Function to report rows per second of a loading stage
+def report_rate(stage, num_rows, start):
+    """ Print number of rows written and rows per second for a stage. """
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"{stage:<12}{num_rows:>8} rows in {elapsed:.2f}s ({num_rows / elapsed:,.0f} rows/s)")
+
+# Function to write resolved rows with UNWIND batches
+def write_graph(session, entities, relations, entries, mentions, batch_size=1000):
+    """ Merge resolved entity, relation, entry and comesFrom rows into the graph.
+        Existing entities only get the entry ids they do not have yet. """
+    start = time.perf_counter()
+    num_rows = 0
+    for label, rows in entities.items():
+        query = (f"UNWIND $rows AS row "
+                 f"MERGE (n:{label} {{id: row.id}}) "
+                 f"ON CREATE SET n += row "
+                 f"ON MATCH SET n.entry_id = n.entry_id + [x IN row.entry_id WHERE NOT x IN n.entry_id]")
+        num_rows += write_batches(session, query, rows, batch_size)
+    report_rate("Entities", num_rows, start)
+
+    start = time.perf_counter()
+    num_rows = 0
+    for (head_label, rel_type, tail_label), rows in relations.items():
+        query = (f"UNWIND $rows AS row "
+                 f"MATCH (a:{head_label} {{id: row.head_id}}), (b:{tail_label} {{id: row.tail_id}}) "
+                 f"MERGE (a)-[:{rel_type}]->(b)")
+        num_rows += write_batches(session, query, rows, batch_size)
+    report_rate("Relations", num_rows, start)
+
+    start = time.perf_counter()
+    query = ("UNWIND $rows AS row "
+             "MERGE (n:Entry {id: row.id}) "
+             "SET n += row")
+    num_rows = write_batches(session, query, entries, batch_size)
+    report_rate("Entries", num_rows, start)
+
+    start = time.perf_counter()
+    num_rows = 0
+    for label, rows in mentions.items():
+        query = (f"UNWIND $rows AS row "
+                 f"MATCH (b:{label} {{id: row.entity_id}}), (a:Entry {{id: row.entry_id}}) "
+                 f"MERGE (b)-[:comesFrom]->(a)")
+        num_rows += write_batches(session, query, rows, batch_size)
+    report_rate("comesFrom", num_rows, start)
+
+# Function to read the relations of a hierarchy from the graph
+def read_hierarchy(session, hierarchy):
+    """ Return (lower, upper) node keys of the hierarchy relations and {node key: text} """
+    results = session.run(
+        "MATCH (a)-[r]->(b) WHERE type(r) IN $relations "
+        "RETURN labels(a)[0] AS head_label, a.id AS head_id, a.text AS head_text, "
+        "labels(b)[0] AS tail_label, b.id AS tail_id, b.text AS tail_text",
+        relations=hierarchy["relations"]
+    )
+    edges, texts = [], {}
+    for record in results:
+        head = (record["head_label"], record["head_id"])
+        tail = (record["tail_label"], record["tail_id"])
+        texts[head], texts[tail] = record["head_text"], record["tail_text"]
+        edges.append((head, tail) if hierarchy["lower"] == "head" else (tail, head))
+    return edges, texts
+
+# Function to write closure rows of changed (node, ancestor) pairs
+def write_closure(session, hierarchy, closure, pairs, texts, batch_size=1000):
+    """ Merge isAClosure {length} or hasPartClosure {length, path} relationships
+        for the given pairs, grouped by label pair. Closure relationships keep the
+        direction of the hierarchy relations, so (o)-[:isAClosure]->(x) and
+        (a)-[:hasPartClosure]->(b). A hasPartClosure relationship is kept per path. """
+    rows = {}
+    for lower, upper in pairs:
+        value = closure["up"][lower][upper]
+        group = rows.setdefault((lower[0], upper[0]), [])
+        if closure["paths"]:
+            for path in value:
+                group.append({"lower_id": lower[1], "upper_id": upper[1], "length": len(path),
+                              "path": [texts[node] for node in path]})
+        else:
+            group.append({"lower_id": lower[1], "upper_id": upper[1], "length": value})
+
+    closure_type = hierarchy["closure_type"]
+    properties = " {path: row.path}" if closure["paths"] else ""
+    if hierarchy["lower"] == "head":
+        relation = f"(d)-[r:{closure_type}{properties}]->(u)"
+    else:
+        relation = f"(u)-[r:{closure_type}{properties}]->(d)"
+    num_rows = 0
+    for (lower_label, upper_label), group in rows.items():
+        query = (f"UNWIND $rows AS row "
+                 f"MATCH (d:{lower_label} {{id: row.lower_id}}), (u:{upper_label} {{id: row.upper_id}}) "
+                 f"MERGE {relation} "
+                 f"SET r.length = row.length")
+        num_rows += write_batches(session, query, group, batch_size)
+    return num_rows
+
+# Function to build the closure table of a hierarchy from the graph
+def read_closure(session, hierarchy):
+    """ Return the closure table of the hierarchy relations in the graph and {node key: text} """
+    edges, texts = read_hierarchy(session, hierarchy)
+    return build_closure(edges, hierarchy["paths"]), texts
+
+# Function to materialise the isA and hasPart/contains closures
+def create_closures(session, batch_size=1000):
+    """ Build the closure tables from the hierarchy relations in the graph and write them """
+    for hierarchy in HIERARCHIES.values():
+        start = time.perf_counter()
+        closure, texts = read_closure(session, hierarchy)
+        pairs = [(lower, upper) for lower, ancestors in closure["up"].items() for upper in ancestors]
+        num_rows = write_closure(session, hierarchy, closure, pairs, texts, batch_size)
+        report_rate(hierarchy["closure_type"], num_rows, start)
+
+# Function to add new hierarchy relations to materialised closures
+def update_closures(session, closures, relations, entities, batch_size=1000):
+    """ Add the hierarchy relations of an ingested delta to the closure tables
+        and write only the (node, ancestor) pairs that changed """
+    text_of = {(label, row["id"]): row["text"] for label, rows in entities.items() for row in rows}
+    for name, hierarchy in HIERARCHIES.items():
+        closure, texts = closures[name]
+        changed = []
+        for (head_label, rel_type, tail_label), rows in relations.items():
+            if rel_type not in hierarchy["relations"]:
+                continue
+            for row in rows:
+                head, tail = (head_label, row["head_id"]), (tail_label, row["tail_id"])
+                for node in (head, tail):
+                    if node not in texts:
+                        texts[node] = text_of[node]
+                lower, upper = (head, tail) if hierarchy["lower"] == "head" else (tail, head)
+                changed.extend(add_closure_edge(closure, lower, upper))
+        if changed:
+            write_closure(session, hierarchy, closure, list(dict.fromkeys(changed)), texts, batch_size)
+
+# Function to create graph with bulk UNWIND writes
+def create_graph_bulk(driver, data, failure_mode_mapping, batch_size=1000, chunk_size=10000):
+    """ Create graph from MaintIE dataset by resolving rows in Python and writing
+        them in UNWIND batches. Records are resolved and written chunk by chunk,
+        so memory is bounded by chunk_size rather than the corpus size. """
+    total_start = time.perf_counter()
+    labels, entity_ids = set(), set()
+    num_entries, num_labelled, num_rows = 0, 0, 0
+    with driver.session() as session:
+        for chunk in iter_chunks(data, chunk_size):
+            entities, relations, entries, mentions = resolve_graph(chunk)
+            num_labelled += label_failure_modes(entries, failure_mode_mapping)
+            new_labels = (set(entities) | {"Entry"}) - labels
+            if new_labels:
+                create_constraints(session, sorted(new_labels))
+                labels |= new_labels
+            write_graph(session, entities, relations, entries, mentions, batch_size)
+
+            entity_ids.update(row["id"] for rows in entities.values() for row in rows)
+            num_entries += len(entries)
+            num_rows += sum(len(rows) for rows in entities.values()) + len(entries)
+            num_rows += sum(len(rows) for rows in relations.values()) + sum(len(rows) for rows in mentions.values())
+
+        # Materialise isA and hasPart/contains closures once all relations are written
+        create_closures(session, batch_size)
+    print(f"Labelled {num_labelled} entries with failure modes.")
+
+    report_rate("Total", num_rows, total_start)
+    print(f"Created {len(entity_ids)} entities.")
+    print(f"Created {num_entries} entry entities.")
+    print(f"Total number of nodes: {len(entity_ids) + num_entries}")
+
+# Function to get stored record hashes of entries
+def get_stored_hashes(session, entry_ids):
+    """ Return {entry_id: record_hash} of the given entries already in the graph. """
+    results = session.run(
+        "UNWIND $ids AS id MATCH (a:Entry {id: id}) "
+        "RETURN a.id AS id, a.record_hash AS record_hash",
+        ids=entry_ids
+    )
+    return {record["id"]: record["record_hash"] for record in results}
+
+# Function to unlink changed entries from the entities they used to mention
+def unlink_entries(session, entry_ids):
+    """ Remove comesFrom edges and entry ids of changed entries from their entities.
+        Returns the (label, subtype0) of the unlinked entities for each entry. """
+    results = session.run(
+        "UNWIND $ids AS id "
+        "MATCH (b)-[r:comesFrom]->(a:Entry {id: id}) "
+        "SET b.entry_id = [x IN b.entry_id WHERE x <> id] "
+        "DELETE r "
+        "RETURN id, collect([labels(b)[0], b.subtype0]) AS types",
+        ids=entry_ids
+    )
+    return [{tuple(t) for t in record["types"]} for record in results]
+
+# Function to ingest new or changed records into an existing graph
+def ingest_graph(driver, data, failure_mode_mapping, batch_size=1000, chunk_size=10000):
+    """ Merge only new or changed records into an existing graph and
+        return the outfiles of path queries that need to be re-run. """
+    start = time.perf_counter()
+    affected = set()
+    num_records, num_delta, num_changed = 0, 0, 0
+    with driver.session() as session:
+        closures = None
+        for chunk in iter_chunks(data, chunk_size):
+            entry_ids = [stable_id("Entry", entry["text"]) for entry in chunk]
+            delta, changed = diff_records(chunk, get_stored_hashes(session, entry_ids))
+            num_records += len(chunk)
+            num_delta += len(delta)
+            num_changed += len(changed)
+            if not delta:
+                continue
+            removed_mentions = unlink_entries(session, changed) if changed else []
+            entities, relations, entries, mentions = resolve_graph(delta)
+            label_failure_modes(entries, failure_mode_mapping)
+            create_constraints(session, list(entities) + ["Entry"])
+            if closures is None:
+                # Closures of the stored relations, so only pairs changed by the delta are written
+                closures = {name: read_closure(session, hierarchy) for name, hierarchy in HIERARCHIES.items()}
+            write_graph(session, entities, relations, entries, mentions, batch_size)
+            update_closures(session, closures, relations, entities, batch_size)
+            affected.update(affected_patterns(delta, relations, removed_mentions))
+    print(f"{num_delta} new or changed records ({num_changed} changed) out of {num_records}")
+    report_rate("Ingest", num_delta, start)
+    return [query["outfile"] for query in direct_queries + complex_queries if query["outfile"] in affected]
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from neo4j import GraphDatabase
+
+    parser = argparse.ArgumentParser(description="Load MaintIE dataset into Neo4j")
+    parser.add_argument("--data", default="../data/MaintIE/gold_release.json")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only merge new or changed records into the existing graph")
+    args = parser.parse_args()
+
     # Connect to Neo4j
     load_dotenv()
     URI = os.getenv("NEO4J_URI")
@@ -117,12 +395,17 @@ if __name__ == "__main__":
     PASSWORD = os.getenv("NEO4J_PASSWORD")
     driver = GraphDatabase.driver(URI, auth=(USERNAME, PASSWORD))
 
-    # Get data from MaintIE dataset
-    with open('../data/MaintIE/gold_release.json', 'r', encoding='utf-8') as file:
-        data = json.load(file)
+    # Stream records from MaintIE dataset
+    data = iter_records(args.data)
+
+    # Read failure mode mapping once for all entries
+    failure_mode_mapping = read_failure_mode_mapping('../data/MaintIE/gold_undesirable_mapped.csv')
 
     # Process data
-    with driver.session() as session:
-        session.execute_write(create_graph, data)
+    if args.incremental:
+        affected = ingest_graph(driver, data, failure_mode_mapping)
+        print(f"Path patterns to re-run: {', '.join(affected) if affected else 'none'}")
+    else:
+        create_graph_bulk(driver, data, failure_mode_mapping)
 
     driver.close()
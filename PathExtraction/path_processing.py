@@ -0,0 +1,267 @@
+# This file contains the functions to turn path query results into paths
+
+import sys
+import json
+from collections import namedtuple
+
+# Function for list of dictionaries to json file
+def list_to_json(data, json_file):
+    """ Save list of dictionaries to json file """
+    with open(json_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, indent=4))
+
+# Function to get entity type
+def get_entity_type(properties):
+    """ Construct entity class/subclass from properties """
+    entity_type = properties["type"]
+    if "subtype0" in properties:
+        entity_type += "/" + properties["subtype0"]
+    if "subtype1" in properties:
+        entity_type += "/" + properties["subtype1"]
+    return entity_type
+
+# Function to get entity information
+def get_entity_info(record, entity):
+    """ Extract entity information from record """
+    properties = record[f"{entity}_properties"]
+    return {
+        "name": properties["text"],
+        "type": get_entity_type(properties),
+        "entry_id": properties["entry_id"]
+    }
+
+# Compact path record; failure_mode is MISSING when the path has no common entry.
+# Paths are hashed as records, so duplicates are found with a set instead of list scans.
+PathRecord = namedtuple("PathRecord", ["object_name", "object_type", "event_name", "valid", "alternate", "failure_mode"])
+MISSING = object()
+
+# Expansion caps: connect objects deeper than MAX_DEPTH are skipped (steering pump hose, pump hose, hose),
+# MAX_FANOUT limits the alternate paths of one record (None for no limit)
+MAX_DEPTH = 2
+MAX_FANOUT = None
+
+# Function to create a path record
+def make_path(object_name, object_type, event_name, valid, alternate, failure_mode=MISSING):
+    """ Create path record with interned names, as the same names recur across many paths """
+    return PathRecord(sys.intern(object_name), object_type, sys.intern(event_name), valid, alternate, failure_mode)
+
+# Function to convert a path record to a path dictionary
+def path_to_dict(path):
+    """ Convert path record to the dictionary written to path json files """
+    path_dict = path._asdict()
+    if path.failure_mode is MISSING:
+        del path_dict["failure_mode"]
+    return path_dict
+
+# Function to convert a path dictionary to a path record
+def dict_to_path(path_dict):
+    """ Convert path dictionary to a hashable path record """
+    return make_path(path_dict["object_name"], path_dict["object_type"], path_dict["event_name"],
+                     path_dict["valid"], path_dict["alternate"], path_dict.get("failure_mode", MISSING))
+
+# Function to remove duplicate paths
+def remove_duplicates(paths):
+    """ Remove duplicate paths, keeping the first occurrence """
+    seen, unique_paths = set(), []
+    for path in paths:
+        key = dict_to_path(path)
+        if key not in seen:
+            seen.add(key)
+            unique_paths.append(path)
+    return unique_paths
+
+# Function to check validity of paths (if entities come from same entry)
+def check_validity(object, event, helper=None):
+    """ Check if entities come from same entry """
+    object_set = set(object["entry_id"])
+    event_set = set(event["entry_id"])
+    # Check if there is a common entry_id
+    if helper:
+        helper_set = set(helper["entry_id"])
+        common = object_set & event_set & helper_set
+    else:
+        common = object_set & event_set
+    return bool(common)
+
+# Function to get common entry entity ids
+def get_common_entries(object, event, helper=None):
+    """ Get common entry entity ids in mention order (order of the object's entry ids) """
+    common = set(event["entry_id"])
+    if helper:
+        common &= set(helper["entry_id"])
+    return [eid for eid in dict.fromkeys(object["entry_id"]) if eid in common]
+
+# Function to get common entry entity id
+def get_common_entry(object, event, helper=None, get_failure=None):
+    """ Get common entry entity id. With get_failure, the first common entry in mention
+        order that has a failure mode is preferred, else the first common entry. """
+    common = get_common_entries(object, event, helper=helper)
+    if get_failure:
+        labelled = next((eid for eid in common if get_failure(eid) is not None), None)
+        if labelled is not None:
+            return labelled
+    return common[0] if common else None
+
+# Function to collect the lookups needed to process query results
+def collect_lookup_keys(query, records, complex=False):
+    """ Return object names and common entry ids of records, so connect objects
+        and failure modes can be resolved in bulk before processing """
+    entities, entry_ids = [], []
+    for record in records:
+        object_info = get_entity_info(record, "object")
+        event_info = get_entity_info(record, query["event"])
+        helper_info = get_entity_info(record, query["helper"]) if complex else None
+        entities.append(object_info["name"])
+        entry_ids.extend(get_common_entries(object_info, event_info, helper=helper_info))
+    return entities, entry_ids
+
+# Function to print count of paths (valid and alternate paths)
+def print_path_counts(query, paths):
+    """ Print count of paths (valid and alternate paths) """
+    num_direct, valid_direct = 0, 0
+    num_alternate, valid_alternate = 0, 0
+    for path in paths:
+        if path['alternate']:
+            num_alternate += 1
+            if path['valid']:
+                valid_alternate += 1
+        else:
+            num_direct += 1
+            if path['valid']:
+                valid_direct += 1
+    total_paths = num_direct + num_alternate
+    total_valid = valid_direct + valid_alternate
+
+    print(query["outfile"])
+    print(f"{'Direct':<10}{num_direct:<6} ({valid_direct:<3} valid)")
+    print(f"{'Alternate':<10}{num_alternate:<6} ({valid_alternate:<3} valid)")
+    print(f"{'Total':<10}{total_paths:<6} ({total_valid:<3} valid)")
+    print(f"{'-' * 30}")
+
+# Function to yield alternate paths lazily
+def iter_alternate_paths(query, record, object, connect_objects, event, valid, event_helper=None, helper=None,
+                         max_depth=MAX_DEPTH, max_fanout=MAX_FANOUT):
+    """ Yield alternate path records of connect objects and substitutes (may contain duplicates) """
+    event_name = event_helper if event_helper is not None else event['name']
+    num_paths = 0
+
+    # If PhysicalObject has connect relations to other PhysicalObjects
+    # connect_relations: hasPart, contains
+    for connect_obj in connect_objects:
+        # steering pump hose, pump hose, hose
+        if len(connect_obj) > max_depth:
+            continue
+        current_obj = object["name"]
+        for obj in connect_obj:
+            current_obj = f"{obj} {current_obj}"
+            if max_fanout is not None and num_paths >= max_fanout:
+                return
+            num_paths += 1
+            yield make_path(current_obj, object["type"], event_name, valid, True)
+
+    # If PhysicalObject has substitute relations to other PhysicalObjects
+    # substitute_relations: isA
+    for substitute_obj in record["substitute_objects"]:
+        if max_fanout is not None and num_paths >= max_fanout:
+            return
+        num_paths += 1
+        yield make_path(substitute_obj['text'], substitute_obj['type'], event_name, valid, True)
+
+    # If Event has substitute relations to its own Events (Property, Process, State
+    # event_substitute: isA
+    for substitute_event in record[f"substitute_{query['event']}"]:
+        if event_helper is not None and helper is not None:
+            if query['outfile'] == 'object_property_state_paths':
+                # e.g. no charge
+                substitute_name = f"{helper['name']} {substitute_event['text']}"
+            else:
+                # e.g. leak fuel
+                substitute_name = f"{substitute_event['text']} {helper['name']}"
+        else:
+            substitute_name = substitute_event['text']
+        if max_fanout is not None and num_paths >= max_fanout:
+            return
+        num_paths += 1
+        yield make_path(object['name'], object['type'], substitute_name, valid, True)
+
+# Function to get relation information
+def get_alternate_paths(query, record, object, connect_objects, event, valid, event_helper=None, helper=None):
+    """ Extract relation information from record """
+    unique_paths = dict.fromkeys(iter_alternate_paths(query, record, object, connect_objects, event, valid,
+                                                      event_helper=event_helper, helper=helper))
+    return [path_to_dict(path) for path in unique_paths]
+
+# Function to yield the path and alternate paths of a query record
+def iter_record_paths(query, record, get_connect, get_failure, complex=False, max_depth=MAX_DEPTH, max_fanout=MAX_FANOUT):
+    """ Yield the path record of a query record followed by its alternate path records """
+    # PhysicalObject - Equipment
+    object_info = get_entity_info(record, "object")
+    connect_objects = get_connect(object_info["name"])
+
+    # Property / Process / State - Undesirable event
+    event_info = get_entity_info(record, query["event"])
+    event_name = event_info["name"]
+
+    # Helper entity (if complex query)
+    helper_info = None
+    if complex:
+        helper_info = get_entity_info(record, query["helper"]) # event_info["type"]
+        if query['outfile'] == 'object_property_state_paths':
+            # e.g. no charge
+            event_name = f"{helper_info['name']} {event_info['name']}"
+        else:
+            # e.g. leak fuel
+            event_name = f"{event_info['name']} {helper_info['name']}"
+
+    # Check if path is confirmed valid (entities come from same entry)
+    valid = check_validity(object_info, event_info, helper=helper_info)
+
+    # Get failure mode of path
+    failure_mode = MISSING
+    entry_id = get_common_entry(object_info, event_info, helper=helper_info, get_failure=get_failure)
+    if entry_id:
+        failure_mode = get_failure(entry_id)
+
+    # Construct path (not an alternate path)
+    yield make_path(object_info["name"], object_info["type"], event_name, valid, False, failure_mode)
+
+    # Alternate paths (if PhysicalObject has connect or substitute relations)
+    # Pass helper_info in generating alternate paths if complex
+    yield from iter_alternate_paths(query, record, object_info, connect_objects, event_info, valid,
+                                    event_helper=event_name if complex else None, helper=helper_info,
+                                    max_depth=max_depth, max_fanout=max_fanout)
+
+# Function to yield unique path records of query results
+def iter_unique_paths(query, results, get_connect, get_failure, complex=False, seen=None,
+                      max_depth=MAX_DEPTH, max_fanout=MAX_FANOUT):
+    """ Yield path records of query results in order, skipping records already in seen.
+        seen is updated as records are yielded, so memory grows with unique paths only. """
+    seen = set() if seen is None else seen
+    for record in results:
+        for path in iter_record_paths(query, record, get_connect, get_failure, complex=complex,
+                                      max_depth=max_depth, max_fanout=max_fanout):
+            if path not in seen:
+                seen.add(path)
+                yield path
+
+# Function to expand a query record into its path and alternate paths
+def expand_record(query, record, get_connect, get_failure, complex=False):
+    """ Return the path of a query record followed by its alternate paths """
+    return [path_to_dict(path) for path in dict.fromkeys(iter_record_paths(query, record, get_connect, get_failure, complex=complex))]
+
+# Function to process query results
+def process_query_results(query, results, paths, get_connect, get_failure, complex=False):
+    """ Process query results and extract relevant information.
+        get_connect(entity) and get_failure(entry_id) look up connect objects
+        and failure modes in the graph backend (Neo4j or in-memory). """
+    # Include paths only if they don't already exist
+    seen = {dict_to_path(path) for path in paths}
+    for path in iter_unique_paths(query, results, get_connect, get_failure, complex=complex, seen=seen):
+        paths.append(path_to_dict(path))
+
+# Function to stream paths of query results
+def iter_new_paths(query, results, seen, get_connect, get_failure, complex=False):
+    """ Yield the paths of query results in the same order as process_query_results,
+        skipping paths already in seen (a set of path records, updated as paths are yielded). """
+    for path in iter_unique_paths(query, results, get_connect, get_failure, complex=complex, seen=seen):
+        yield path_to_dict(path)
@@ -1,22 +1,29 @@
 # This file contains the cypher queries for Neo4j to extract paths
 
+import threading
+from collections import OrderedDict
+
 # isA relationships: PhysicalObject, Property, Process, State, Activity
-PO_MATCH =  "OPTIONAL MATCH (o)-[:isA*]->(substitute_objects:PhysicalObject)"
+# isAClosure is the transitive closure of isA, materialised by maintie_to_kg.py
+PO_MATCH =  "OPTIONAL MATCH (o)-[:isAClosure]->(substitute_objects:PhysicalObject)"
 PO_RETURN = "collect(properties(substitute_objects)) AS substitute_objects"
 
-PP_MATCH =  "OPTIONAL MATCH (p)-[:isA*]->(substitute_property:Property)"
+PP_MATCH =  "OPTIONAL MATCH (p)-[:isAClosure]->(substitute_property:Property)"
 PP_RETURN = "collect(properties(substitute_property)) AS substitute_property"
 
-PC_MATCH =  "OPTIONAL MATCH (p)-[:isA*]->(substitute_process:Process)"
+PC_MATCH =  "OPTIONAL MATCH (p)-[:isAClosure]->(substitute_process:Process)"
 PC_RETURN = "collect(properties(substitute_process)) AS substitute_process"
 
-ST_MATCH =  "OPTIONAL MATCH (s)-[:isA*]->(substitute_state:State)"
+ST_MATCH =  "OPTIONAL MATCH (s)-[:isAClosure]->(substitute_state:State)"
 ST_RETURN = "collect(properties(substitute_state)) AS substitute_state"
 
-AT_MATCH =  "OPTIONAL MATCH (a)-[:isA*]->(substitute_activity:Activity)"
+AT_MATCH =  "OPTIONAL MATCH (a)-[:isAClosure]->(substitute_activity:Activity)"
 AT_RETURN = "collect(properties(substitute_activity)) AS substitute_activity"
 
 # Path queries
+# "pattern" describes each MATCH for the in-memory engine (kg_engine.py):
+#   nodes: variable -> (label, subtype0), edges: (head, relation, tail),
+#   returns: variable -> record prefix, substitutes: variables with isA* collections (default: all)
 direct_queries = [
     { # Query 1: Find all OBJECT with undesirable properties
         "query": f"""MATCH (o:PhysicalObject)-[:hasProperty]->(p:Property {{subtype0: "UndesirableProperty"}}) {PO_MATCH} {PP_MATCH}
@@ -24,7 +31,10 @@ direct_queries = [
                 """,
         "outfile": "object_property_paths",
         "event": "property",
-        "relation": "hasProperty"
+        "relation": "hasProperty",
+        "pattern": {"nodes": {"o": ("PhysicalObject", None), "p": ("Property", "UndesirableProperty")},
+                    "edges": [("o", "hasProperty", "p")],
+                    "returns": {"o": "object", "p": "property"}}
     },
     { # Query 2: Find all undesirable processes with AGENTS OBJECT
         "query": f"""
@@ -33,7 +43,10 @@ direct_queries = [
                 """,
         "outfile": "process_agent_paths",
         "event": "process",
-        "relation": "hasAgent"
+        "relation": "hasAgent",
+        "pattern": {"nodes": {"p": ("Process", "UndesirableProcess"), "o": ("PhysicalObject", None)},
+                    "edges": [("p", "hasParticipant_hasAgent", "o")],
+                    "returns": {"o": "object", "p": "process"}}
     },
     { # Query 3: Find all undesirable processes with PATIENTS OBJECT
         "query": f"""
@@ -42,7 +55,10 @@ direct_queries = [
                 """,
         "outfile": "process_patient_paths",
         "event": "process",
-        "relation": "hasPatient"
+        "relation": "hasPatient",
+        "pattern": {"nodes": {"p": ("Process", "UndesirableProcess"), "o": ("PhysicalObject", None)},
+                    "edges": [("p", "hasParticipant_hasPatient", "o")],
+                    "returns": {"o": "object", "p": "process"}}
     },
     { # Query 4: Find all undesirable states with PATIENTS OBJECT
         "query": f"""
@@ -51,7 +67,10 @@ direct_queries = [
                 """,
         "outfile": "state_patient_paths",
         "event": "state",
-        "relation": "hasPatient"
+        "relation": "hasPatient",
+        "pattern": {"nodes": {"s": ("State", "UndesirableState"), "o": ("PhysicalObject", None)},
+                    "edges": [("s", "hasParticipant_hasPatient", "o")],
+                    "returns": {"o": "object", "s": "state"}}
     }
 ]
 
@@ -65,7 +84,10 @@ complex_queries = [
         "outfile": "object_property_state_paths",
         "event": "property",
         "helper": "state",
-        "relation": "hasProperty"
+        "relation": "hasProperty",
+        "pattern": {"nodes": {"o": ("PhysicalObject", None), "p": ("Property", None), "s": ("State", "UndesirableState")},
+                    "edges": [("o", "hasProperty", "p"), ("s", "hasParticipant_hasPatient", "p")],
+                    "returns": {"o": "object", "p": "property", "s": "state"}}
     },
     { # Query 6: Find all OBJECT with PROCESSES linked to undesirable states
         "query": f"""
@@ -76,7 +98,10 @@ complex_queries = [
         "outfile": "object_process_state_paths",
         "event": "process",
         "helper": "state",
-        "relation": "hasPatient"
+        "relation": "hasPatient",
+        "pattern": {"nodes": {"o": ("PhysicalObject", None), "p": ("Process", None), "s": ("State", "UndesirableState")},
+                    "edges": [("o", "hasParticipant_hasPatient", "p"), ("s", "hasParticipant_hasPatient", "p")],
+                    "returns": {"o": "object", "p": "process", "s": "state"}}
     },
     { # Query 7: Find all undesirable states with agents OBJECT where states linked to activities
         "query": f"""
@@ -87,7 +112,10 @@ complex_queries = [
         "outfile": "state_agent_activity_paths",
         "event": "state",
         "helper": "activity",
-        "relation": "hasAgent"
+        "relation": "hasAgent",
+        "pattern": {"nodes": {"s": ("State", "UndesirableState"), "o": ("PhysicalObject", None), "a": ("Activity", None)},
+                    "edges": [("s", "hasParticipant_hasAgent", "o"), ("s", "hasParticipant_hasPatient", "a")],
+                    "returns": {"o": "object", "s": "state", "a": "activity"}}
     },
     { # Query 8: Find all undesirable states with agents OBJECT where states have patient OBJECT
         "query": f"""
@@ -98,7 +126,11 @@ complex_queries = [
         "outfile": "state_agent_patient_paths",
         "event": "state",
         "helper": "patient",
-        "relation": "hasAgent"
+        "relation": "hasAgent",
+        "pattern": {"nodes": {"s": ("State", "UndesirableState"), "o": ("PhysicalObject", None), "o2": ("PhysicalObject", None)},
+                    "edges": [("s", "hasParticipant_hasAgent", "o"), ("s", "hasParticipant_hasPatient", "o2")],
+                    "returns": {"o": "object", "s": "state", "o2": "patient"},
+                    "substitutes": ["o", "s"]}
     },
     { # Query 9: Find all undesirable processes with agents OBJECT where processes have patient OBJECT
         "query": f"""
@@ -109,37 +141,145 @@ complex_queries = [
         "outfile": "process_agent_patient_paths",
         "event": "process",
         "helper": "patient",
-        "relation": "hasAgent"
+        "relation": "hasAgent",
+        "pattern": {"nodes": {"p": ("Process", "UndesirableProcess"), "o": ("PhysicalObject", None), "o2": ("PhysicalObject", None)},
+                    "edges": [("p", "hasParticipant_hasAgent", "o"), ("p", "hasParticipant_hasPatient", "o2")],
+                    "returns": {"o": "object", "p": "process", "o2": "patient"},
+                    "substitutes": ["o", "p"]}
     }
 ]
 
+# LRU memo of connect objects and failure modes, shared by all lookups in a run
+# (and by the worker threads of extract_paths.py, hence the lock)
+LOOKUP_CACHE_SIZE = 100000
+LOOKUP_CACHE = {"connect_objects": OrderedDict(), "failure_mode": OrderedDict()}
+LOOKUP_STATS = {"hits": 0, "misses": 0}
+# Keys stored by a bulk prefetch and not read yet: their first per-record read is not counted,
+# as the bulk lookup already counted them (hit if memoised, miss if fetched)
+LOOKUP_PREFETCHED = {"connect_objects": set(), "failure_mode": set()}
+LOOKUP_LOCK = threading.Lock()
+
+# Function to get a value from the lookup memo
+def cache_get(name, key):
+    """ Return (True, value) if key is memoised, else (False, None) """
+    cache = LOOKUP_CACHE[name]
+    with LOOKUP_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            if key in LOOKUP_PREFETCHED[name]:
+                LOOKUP_PREFETCHED[name].discard(key)
+            else:
+                LOOKUP_STATS["hits"] += 1
+            return True, cache[key]
+        LOOKUP_STATS["misses"] += 1
+    return False, None
+
+# Function to store a value in the lookup memo
+def cache_put(name, key, value, prefetched=False):
+    """ Memoise value, evicting the least recently used entry if full.
+        prefetched marks a value stored by a bulk lookup ahead of its per-record read. """
+    cache = LOOKUP_CACHE[name]
+    with LOOKUP_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        if prefetched:
+            LOOKUP_PREFETCHED[name].add(key)
+        if len(cache) > LOOKUP_CACHE_SIZE:
+            evicted, _ = cache.popitem(last=False)
+            LOOKUP_PREFETCHED[name].discard(evicted)
+
+# Function to clear the lookup memo and its counters
+def clear_lookup_cache():
+    """ Clear memoised lookups and reset hit/miss counters """
+    with LOOKUP_LOCK:
+        for cache in LOOKUP_CACHE.values():
+            cache.clear()
+        for keys in LOOKUP_PREFETCHED.values():
+            keys.clear()
+        LOOKUP_STATS["hits"] = LOOKUP_STATS["misses"] = 0
+
 # Function to return recursive hasPart/contains PhysicalObjects
 def get_connect_objects(driver, entity):
     """ Return recursive hasPart/contains PhysicalObjects """
-    query = f"""
-                MATCH path = (a:PhysicalObject)-[:hasPart|contains*]->(b:PhysicalObject {{text: "{entity}"}})
-                WITH [n IN nodes(path) | n.text] AS connect_objects
-                RETURN connect_objects
+    found, connect_objects = cache_get("connect_objects", entity)
+    if found:
+        return connect_objects
+    query = """
+                MATCH (a:PhysicalObject)-[r:hasPartClosure]->(b:PhysicalObject {text: $entity})
+                RETURN r.path AS connect_objects
             """
     connect_objects = []
     with driver.session() as session:
-        results = session.run(query)
+        results = session.run(query, entity=entity)
         for record in results:
-            # Remove last entity and reverse the list
-            object_list = record["connect_objects"][:-1]
-            connect_objects.append(object_list[::-1])
+            # Closure paths are stored nearest first, ending with the connect object
+            connect_objects.append(record["connect_objects"])
+    cache_put("connect_objects", entity, connect_objects)
+    return connect_objects
+
+# Function to return recursive hasPart/contains PhysicalObjects of many entities
+def get_connect_objects_bulk(driver, entities):
+    """ Return {entity: connect objects} resolving all entities not yet memoised in one query """
+    connect_objects, missing = {}, []
+    for entity in dict.fromkeys(entities):
+        found, value = cache_get("connect_objects", entity)
+        if found:
+            connect_objects[entity] = value
+        else:
+            missing.append(entity)
+    if missing:
+        query = """
+                    UNWIND $entities AS entity
+                    MATCH (a:PhysicalObject)-[r:hasPartClosure]->(b:PhysicalObject {text: entity})
+                    RETURN entity, r.path AS connect_objects
+                """
+        fetched = {entity: [] for entity in missing}
+        with driver.session() as session:
+            for record in session.run(query, entities=missing):
+                fetched[record["entity"]].append(record["connect_objects"])
+        for entity, value in fetched.items():
+            cache_put("connect_objects", entity, value, prefetched=True)
+        connect_objects.update(fetched)
     return connect_objects
 
 # Function to return failure mode of an entry entity
 def get_failure_mode(driver, entry_id):
     """ Return failure mode of an entry entity """
-    query = f"""
-                MATCH (e:Entry {{id: {entry_id}}})
+    found, failure_mode = cache_get("failure_mode", entry_id)
+    if found:
+        return failure_mode
+    query = """
+                MATCH (e:Entry {id: $entry_id})
                 RETURN e.failure_mode AS failure_mode
             """
     with driver.session() as session:
-        results = session.run(query)
+        results = session.run(query, entry_id=entry_id)
         record = results.single()
-        if record:
-            return record["failure_mode"]
-        return None
\ No newline at end of file
+        failure_mode = record["failure_mode"] if record else None
+    cache_put("failure_mode", entry_id, failure_mode)
+    return failure_mode
+
+# Function to return failure modes of many entry entities
+def get_failure_modes_bulk(driver, entry_ids):
+    """ Return {entry_id: failure mode} resolving all entries not yet memoised in one query """
+    failure_modes, missing = {}, []
+    for entry_id in dict.fromkeys(entry_ids):
+        found, value = cache_get("failure_mode", entry_id)
+        if found:
+            failure_modes[entry_id] = value
+        else:
+            missing.append(entry_id)
+    if missing:
+        query = """
+                    UNWIND $entry_ids AS entry_id
+                    MATCH (e:Entry {id: entry_id})
+                    RETURN entry_id, e.failure_mode AS failure_mode
+                """
+        fetched = {entry_id: None for entry_id in missing}
+        with driver.session() as session:
+            for record in session.run(query, entry_ids=missing):
+                fetched[record["entry_id"]] = record["failure_mode"]
+        for entry_id, value in fetched.items():
+            cache_put("failure_mode", entry_id, value, prefetched=True)
+        failure_modes.update(fetched)
+    return failure_modes
@@ -0,0 +1,53 @@
+# Tests of the concurrent JSONL runner against the in-memory KG engine
+
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+import kg_engine
+from extract_paths import memory_backend, run_queries
+from maintie_reader import iter_records
+from maintie_to_kg import read_failure_mode_mapping
+from path_queries import direct_queries, complex_queries
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+PATH_EXTRACTION_DIR = os.path.join(MAIN_DIR, 'PathExtraction')
+QUERIES = direct_queries + complex_queries
+
+@pytest.fixture(scope="module")
+def graph():
+    data = os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_release.json')
+    mapping = read_failure_mode_mapping(os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_undesirable_mapped.csv'))
+    return kg_engine.build_graph(iter_records(data), mapping)
+
+# Function to read the paths of a JSONL file
+def read_jsonl(filepath):
+    with open(filepath, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+# Batches of 7 records split most queries, so paths seen in earlier batches must still be skipped
+@pytest.mark.parametrize("batch_size", [7, 500])
+def test_memory_backend_matches_extract_paths(graph, tmp_path, batch_size):
+    results = run_queries(QUERIES, memory_backend(graph), str(tmp_path), workers=4, batch_size=batch_size)
+    assert sorted(counts["outfile"] for counts in results) == sorted(query["outfile"] for query in QUERIES)
+    for counts in results:
+        query = next(query for query in QUERIES if query["outfile"] == counts["outfile"])
+        expected = kg_engine.extract_paths(graph, query, complex=query in complex_queries)
+        paths = read_jsonl(tmp_path / f"{query['outfile']}.jsonl")
+        # Same paths in the same order as the in-memory engine
+        assert paths == expected
+        assert counts["rows"] == len(kg_engine.run_query(graph, query))
+        assert counts["paths"] == len(paths)
+        assert counts["valid"] == sum(path["valid"] for path in paths)
+        assert counts["alternate"] == sum(path["alternate"] for path in paths)
+
+def test_command_line_memory_backend(graph, tmp_path):
+    outfiles = [direct_queries[0]["outfile"], complex_queries[0]["outfile"]]
+    subprocess.run([sys.executable, "extract_paths.py", "--backend", "memory", "--outpath", str(tmp_path),
+                    "--queries", *outfiles], cwd=PATH_EXTRACTION_DIR, check=True, capture_output=True)
+    assert sorted(os.listdir(tmp_path)) == sorted(f"{outfile}.jsonl" for outfile in outfiles)
+    for query in (direct_queries[0], complex_queries[0]):
+        assert read_jsonl(tmp_path / f"{query['outfile']}.jsonl") == \
+               kg_engine.extract_paths(graph, query, complex=query in complex_queries)
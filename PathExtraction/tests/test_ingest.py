@@ -0,0 +1,96 @@
+# Tests of incremental ingestion into the in-memory KG engine against a full rebuild
+
+import os
+import copy
+import json
+import pytest
+
+from kg_engine import build_graph, ingest_records, merge_rows, extract_paths
+from maintie_reader import iter_records
+from maintie_to_kg import read_failure_mode_mapping, resolve_graph, diff_records, affected_patterns, stable_id, record_hash
+from path_queries import direct_queries, complex_queries
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+QUERIES = direct_queries + complex_queries
+
+@pytest.fixture(scope="module")
+def records():
+    return list(iter_records(os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_release.json')))
+
+@pytest.fixture(scope="module")
+def mapping():
+    return read_failure_mode_mapping(os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_undesirable_mapped.csv'))
+
+# Function to create a record from its text, entity spans and relations
+def make_record(text, entities, relations=()):
+    """ entities are (start, end, type) token spans, relations are (head, tail, type) """
+    return {"text": text, "tokens": text.split(),
+            "entities": [{"start": start, "end": end, "type": type} for start, end, type in entities],
+            "relations": [{"head": head, "tail": tail, "type": type} for head, tail, type in relations]}
+
+# Function to list the relations of a graph
+def graph_edges(graph):
+    return {(head, rel_type, tail) for rel_type, heads in graph["out"].items() for head, tails in heads.items() for tail in tails}
+
+# Function to get the paths of every query as sorted json strings
+def all_paths(graph):
+    return {query["outfile"]: sorted(json.dumps(path, sort_keys=True)
+                                     for path in extract_paths(graph, query, complex=query in complex_queries))
+            for query in QUERIES}
+
+def test_ingest_matches_full_rebuild(records, mapping):
+    # Snapshot of all but the last record; the delta changes a record in the middle and adds the last one
+    index = next(i for i, record in enumerate(records[:-1]) if len(record["relations"]) >= 2)
+    old, changed = records[index], copy.deepcopy(records[index])
+    removed = changed["relations"].pop()
+    final = records[:index] + [changed] + records[index + 1:]
+
+    graph = build_graph(records[:-1], mapping)
+    affected = ingest_records(graph, final, mapping)
+    rebuilt = build_graph(final, mapping)
+
+    # Nodes, their entry ids and the mentions of each entry are the same as a full rebuild
+    assert graph["nodes"].keys() == rebuilt["nodes"].keys()
+    for key, node in rebuilt["nodes"].items():
+        assert {**graph["nodes"][key], "entry_id": sorted(graph["nodes"][key].get("entry_id", []))} == \
+               {**node, "entry_id": sorted(node.get("entry_id", []))}
+    assert {entry: set(keys) for entry, keys in graph["mentions"].items()} == \
+           {entry: set(keys) for entry, keys in rebuilt["mentions"].items()}
+
+    # Relations carry no provenance, so the relation removed from the changed record is kept
+    _, old_relations, _, _ = resolve_graph([old])
+    stale = {((h, row["head_id"]), rel_type, (t, row["tail_id"]))
+             for (h, rel_type, t), rows in old_relations.items() for row in rows} - graph_edges(rebuilt)
+    assert len(stale) == 1
+    assert graph_edges(graph) == graph_edges(rebuilt) | stale
+    merge_rows(rebuilt, {}, old_relations, [], {})
+    assert all_paths(graph) == all_paths(rebuilt)
+
+    assert removed["type"] in {rel_type.replace("_", "/") for _, rel_type, _ in stale}
+    assert set(affected) <= {query["outfile"] for query in QUERIES}
+    assert affected # The new and changed records mention pattern nodes
+
+def test_unchanged_records_are_skipped(records, mapping):
+    graph = build_graph(records, mapping)
+    assert diff_records(records, {stable_id("Entry", r["text"]): record_hash(r) for r in records}) == ([], [])
+    assert ingest_records(graph, records, mapping) == []
+
+def test_affected_patterns():
+    leak = make_record("pump leaking", [(0, 1, "PhysicalObject"), (1, 2, "State/UndesirableState")],
+                       [(1, 0, "hasParticipant/hasPatient")])
+    _, relations, _, _ = resolve_graph([leak])
+    assert affected_patterns([leak], relations) == [
+        "process_patient_paths", "state_patient_paths", "object_property_state_paths",
+        "object_process_state_paths", "state_agent_activity_paths", "state_agent_patient_paths",
+        "process_agent_patient_paths"]
+
+    # Without relations, a record only affects queries whose every node it mentions
+    worn = make_record("worn bearing", [(0, 1, "Property/UndesirableProperty"), (1, 2, "PhysicalObject")])
+    assert affected_patterns([worn], {}) == ["object_property_paths"]
+    assert affected_patterns([], {}, removed_mentions=[{("Property", "UndesirableProperty"), ("PhysicalObject", None)}]) == \
+           ["object_property_paths"]
+
+    # An isA relation can add alternate paths to every query
+    pump = make_record("centrifugal pump", [(0, 2, "PhysicalObject"), (1, 2, "PhysicalObject")], [(0, 1, "isA")])
+    _, relations, _, _ = resolve_graph([pump])
+    assert affected_patterns([pump], relations) == [query["outfile"] for query in QUERIES]
@@ -0,0 +1,104 @@
+# Tests of the incremental isA and hasPart/contains closure tables against a brute-force closure
+
+import os
+import random
+import pytest
+
+from kg_closure import HIERARCHIES, new_closure, add_closure_edge, build_closure, get_ancestors
+from kg_engine import build_graph
+from maintie_reader import iter_records
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+# Function to compute shortest lengths to every ancestor by breadth-first search
+def reference_lengths(edges):
+    """ {node: {ancestor: shortest length}} with lengths >= 1 (a node in a cycle is its own ancestor) """
+    above = {}
+    for lower, upper in edges:
+        above.setdefault(lower, []).append(upper)
+    table = {}
+    for node in above:
+        lengths, frontier, length = {}, list(above[node]), 1
+        while frontier:
+            next_frontier = []
+            for a in frontier:
+                if a not in lengths:
+                    lengths[a] = length
+                    next_frontier.extend(above.get(a, []))
+            frontier, length = next_frontier, length + 1
+        table[node] = lengths
+    return table
+
+# Function to enumerate the relation-unique paths to every ancestor
+def reference_paths(edges):
+    """ {node: {ancestor: sorted paths}}, where a path lists the nodes above node and uses no relation twice """
+    above = {}
+    for lower, upper in dict.fromkeys(edges):
+        above.setdefault(lower, []).append(upper)
+    table = {}
+    def walk(start, node, path, used):
+        for a in above.get(node, []):
+            if (node, a) in used:
+                continue
+            table.setdefault(start, {}).setdefault(a, []).append(path + (a,))
+            walk(start, a, path + (a,), used | {(node, a)})
+    for node in above:
+        walk(node, node, (), frozenset())
+    return {node: {a: sorted(paths) for a, paths in ancestors.items()} for node, ancestors in table.items()}
+
+# Function to return the closure table in the form of the reference tables
+def closure_table(closure):
+    if closure["paths"]:
+        return {node: {a: sorted(paths) for a, paths in ancestors.items()} for node, ancestors in closure["up"].items()}
+    return closure["up"]
+
+# Function to check the down table mirrors the up table
+def assert_down_mirrors_up(closure):
+    down = {(d, a): value for a, nodes in closure["down"].items() for d, value in nodes.items()}
+    assert down == {(d, a): value for d, ancestors in closure["up"].items() for a, value in ancestors.items()}
+
+# Function to create random hierarchy relations, including cycles and repeated relations
+def random_edges(seed, num_nodes=9, num_edges=16):
+    rng = random.Random(seed)
+    nodes = [("PhysicalObject", i) for i in range(num_nodes)]
+    return [tuple(rng.sample(nodes, 2)) for _ in range(num_edges)]
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("keep_paths", [False, True])
+def test_incremental_closure_matches_brute_force(seed, keep_paths):
+    edges = random_edges(seed)
+    reference = reference_paths(edges) if keep_paths else reference_lengths(edges)
+    closure = new_closure(keep_paths)
+    for i, (lower, upper) in enumerate(edges):
+        before = {node: dict(ancestors) for node, ancestors in closure_table(closure).items()}
+        changed = add_closure_edge(closure, lower, upper)
+        after = closure_table(closure)
+        # Returned pairs are exactly the pairs whose value changed
+        assert sorted(changed) == sorted((d, a) for d, ancestors in after.items() for a in ancestors
+                                         if before.get(d, {}).get(a) != ancestors[a])
+        # After each relation the table is the closure of the relations added so far
+        partial = reference_paths(edges[:i + 1]) if keep_paths else reference_lengths(edges[:i + 1])
+        assert after == {node: ancestors for node, ancestors in partial.items() if ancestors}
+    assert closure_table(closure) == {node: ancestors for node, ancestors in reference.items() if ancestors}
+    assert_down_mirrors_up(closure)
+
+    # The order relations arrive in does not matter
+    shuffled = list(edges)
+    random.Random(seed).shuffle(shuffled)
+    assert closure_table(build_closure(shuffled, keep_paths)) == closure_table(closure)
+
+def test_get_ancestors_nearest_first():
+    edges = [("a", "b"), ("b", "c"), ("c", "d"), ("a", "d")]
+    assert get_ancestors(build_closure(edges), "a") == ["b", "d", "c"]
+    assert get_ancestors(build_closure(edges, keep_paths=True), "a") == ["b", "d", "c"]
+
+def test_gold_graph_closures_match_brute_force():
+    graph = build_graph(iter_records(os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_release.json')))
+    for name, hierarchy in HIERARCHIES.items():
+        edges = []
+        for rel_type in hierarchy["relations"]:
+            for head, tails in graph["out"].get(rel_type, {}).items():
+                edges.extend((head, tail) if hierarchy["lower"] == "head" else (tail, head) for tail in tails)
+        reference = reference_paths(edges) if hierarchy["paths"] else reference_lengths(edges)
+        assert edges
+        assert closure_table(graph["closure"][name]) == {node: ancestors for node, ancestors in reference.items() if ancestors}
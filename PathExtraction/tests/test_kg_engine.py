@@ -0,0 +1,32 @@
+# Parity of the in-memory KG engine with the path_patterns json files recorded from Neo4j
+
+import os
+import json
+import pytest
+
+from kg_engine import build_graph, extract_paths, compare_paths, failure_mode_changes
+from maintie_reader import iter_records
+from maintie_to_kg import read_failure_mode_mapping
+from path_queries import direct_queries, complex_queries
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+PATTERNS_DIR = os.path.join(MAIN_DIR, 'PathExtraction', 'path_patterns')
+
+@pytest.fixture(scope="module")
+def graph():
+    data = os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_release.json')
+    mapping = read_failure_mode_mapping(os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_undesirable_mapped.csv'))
+    return build_graph(iter_records(data), mapping)
+
+@pytest.mark.parametrize("query", direct_queries + complex_queries, ids=lambda query: query["outfile"])
+def test_paths_match_recorded_neo4j_paths(graph, query):
+    paths = extract_paths(graph, query, complex=query in complex_queries)
+    with open(os.path.join(PATTERNS_DIR, f"{query['outfile']}.json"), encoding='utf-8') as f:
+        recorded = json.load(f)
+    missing, extra = compare_paths(paths, recorded)
+    assert missing == []
+    assert extra == []
+
+    # A path may pick another common entry than Neo4j did, but never loses its failure mode
+    lost = [change for change in failure_mode_changes(paths, recorded) if change[1] is not None and change[2] is None]
+    assert lost == []
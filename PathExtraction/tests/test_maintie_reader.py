@@ -0,0 +1,66 @@
+# Tests of the streaming MaintIE reader
+
+import io
+import re
+import json
+import pytest
+
+from maintie_reader import iter_json_array, iter_records, iter_chunks
+
+RECORDS = [
+    {"text": "pump seal leaking", "tokens": ["pump", "seal", "leaking"],
+     "entities": [{"start": 0, "end": 2, "type": "PhysicalObject"}, {"start": 2, "end": 3, "type": "State/UndesirableState"}],
+     "relations": [{"head": 1, "tail": 0, "type": "hasParticipant/hasPatient"}]},
+    {"text": "motor \"humming\" [loud]", "tokens": ["motor", "\"humming\"", "[loud]"],
+     "entities": [{"start": 0, "end": 1, "type": "PhysicalObject"}], "relations": [], "id": 7},
+    {"text": "", "tokens": [], "entities": [], "relations": []},
+]
+
+# Function to write records to a file as a JSON array or as JSON lines
+def write_records(tmp_path, records, jsonl=False):
+    filepath = tmp_path / ("records.jsonl" if jsonl else "records.json")
+    with open(filepath, "w", encoding='utf-8') as f:
+        if jsonl:
+            f.write("".join(json.dumps(record) + "\n\n" for record in records))
+        else:
+            json.dump(records, f, indent=2)
+    return str(filepath)
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 1 << 20])
+def test_json_array_items_split_across_chunks(chunk_size):
+    text = "  \n[ " + " ,\n ".join(json.dumps(record) for record in RECORDS) + " ]\n"
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == RECORDS
+
+@pytest.mark.parametrize("text", ["[]", " [ ] ", ""])
+def test_empty_json_array(text):
+    assert list(iter_json_array(io.StringIO(text), 2)) == []
+
+def test_truncated_json_array_raises():
+    text = "[" + json.dumps(RECORDS[0]) + ", " + json.dumps(RECORDS[1])[:-5]
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO(text), 4))
+
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_iter_records_keeps_record_fields(tmp_path, jsonl):
+    records = list(iter_records(write_records(tmp_path, RECORDS, jsonl)))
+    assert records == [{field: record[field] for field in ("text", "tokens", "entities", "relations")} for record in RECORDS]
+
+@pytest.mark.parametrize("change, message", [
+    (lambda record: record["entities"][1].update(end=4), "Record 1: entity 1 span [2, 4) outside 3 tokens"),
+    (lambda record: record["entities"][0].update(start=2, end=2), "Record 1: entity 0 span [2, 2) outside 3 tokens"),
+    (lambda record: record["relations"][0].update(tail=2), "Record 1: relation 0 (1 -> 2) outside 2 entities"),
+    (lambda record: record.pop("tokens"), "Record 1: missing 'tokens'"),
+])
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_invalid_records(tmp_path, jsonl, change, message):
+    invalid = json.loads(json.dumps(RECORDS[0]))
+    change(invalid)
+    filepath = write_records(tmp_path, [RECORDS[0], invalid, RECORDS[1]], jsonl)
+    with pytest.raises(ValueError, match=re.escape(message)):
+        list(iter_records(filepath))
+    assert [record["text"] for record in iter_records(filepath, skip_invalid=True)] == [RECORDS[0]["text"], RECORDS[1]["text"]]
+    assert len(list(iter_records(filepath, validate=False))) == 3
+
+def test_iter_chunks():
+    assert list(iter_chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_chunks([], 3)) == []
@@ -0,0 +1,88 @@
+# Tests of resolving MaintIE records into graph rows and writing them in UNWIND batches
+
+import os
+import pytest
+
+from maintie_reader import iter_records
+from maintie_to_kg import stable_id, resolve_graph, write_batches, write_graph
+
+MAIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+# Function to create a record from its text, entity spans and relations
+def make_record(text, entities, relations=()):
+    """ entities are (start, end, type) token spans, relations are (head, tail, type) """
+    return {"text": text, "tokens": text.split(),
+            "entities": [{"start": start, "end": end, "type": type} for start, end, type in entities],
+            "relations": [{"head": head, "tail": tail, "type": type} for head, tail, type in relations]}
+
+RECORDS = [
+    make_record("pump seal leaking", [(0, 1, "PhysicalObject/GeneratingObject"), (1, 2, "PhysicalObject/HoldingObject"),
+                                      (2, 3, "State/UndesirableState")],
+                [(0, 1, "hasPart"), (2, 1, "hasParticipant/hasPatient")]),
+    make_record("replace pump seal", [(0, 1, "Activity/MaintenanceActivity"), (1, 2, "PhysicalObject/GeneratingObject"),
+                                      (2, 3, "PhysicalObject/HoldingObject")],
+                [(1, 2, "hasPart"), (0, 2, "hasParticipant/hasPatient")]),
+    # "pump" as an activity is another entity than the pump object
+    make_record("pump out tank", [(0, 1, "Activity"), (2, 3, "PhysicalObject/StoringObject")],
+                [(0, 1, "hasParticipant/hasPatient")]),
+]
+
+# Session stand-in recording the UNWIND batches written in each transaction
+class FakeSession:
+    def __init__(self):
+        self.batches = []
+
+    def execute_write(self, work):
+        return work(self)
+
+    def run(self, query, rows):
+        self.batches.append((query, rows))
+        return self
+
+    def consume(self):
+        return None
+
+def test_resolve_graph_rows():
+    entities, relations, entries, mentions = resolve_graph(RECORDS)
+    assert {label: len(rows) for label, rows in entities.items()} == {"PhysicalObject": 3, "State": 1, "Activity": 2}
+    # The repeated pump hasPart seal relation is one row
+    assert {key: len(rows) for key, rows in relations.items()} == {
+        ("PhysicalObject", "hasPart", "PhysicalObject"): 1,
+        ("State", "hasParticipant_hasPatient", "PhysicalObject"): 1,
+        ("Activity", "hasParticipant_hasPatient", "PhysicalObject"): 2}
+    assert len(entries) == 3
+    assert sum(len(rows) for rows in mentions.values()) == 8
+
+    pump = next(row for row in entities["PhysicalObject"] if row["text"] == "pump")
+    assert pump["id"] == stable_id("PhysicalObject", "pump")
+    assert pump["subtype0"] == "GeneratingObject"
+    assert pump["entry_id"] == [stable_id("Entry", "pump seal leaking"), stable_id("Entry", "replace pump seal")]
+    assert entries[0]["id"] == stable_id("Entry", "pump seal leaking")
+
+def test_ids_are_stable_and_distinct_across_labels():
+    assert stable_id("Activity", "pump") != stable_id("PhysicalObject", "pump")
+    assert resolve_graph(RECORDS)[0] == resolve_graph(RECORDS)[0]
+
+    entities, _, entries, _ = resolve_graph(iter_records(os.path.join(MAIN_DIR, 'data', 'MaintIE', 'gold_release.json')))
+    ids = [row["id"] for rows in entities.values() for row in rows] + [row["id"] for row in entries]
+    assert len(ids) == len(set(ids))
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_write_batches(batch_size):
+    session = FakeSession()
+    rows = [{"id": i} for i in range(5)]
+    assert write_batches(session, "UNWIND $rows AS row MERGE (n:Test {id: row.id})", rows, batch_size) == 5
+    assert [len(batch) for _, batch in session.batches] == [len(rows[i:i + batch_size]) for i in range(0, 5, batch_size)]
+    assert [row for _, batch in session.batches for row in batch] == rows
+
+def test_write_graph_writes_every_row():
+    session = FakeSession()
+    entities, relations, entries, mentions = resolve_graph(RECORDS)
+    write_graph(session, entities, relations, entries, mentions, batch_size=2)
+    written = [row for _, batch in session.batches for row in batch]
+    assert len(written) == 6 + 4 + 3 + 8
+    assert all(len(batch) <= 2 for _, batch in session.batches)
+    # Labels and relation types cannot be parameters, so each is written with its own query
+    queries = {query for query, _ in session.batches}
+    assert any("MERGE (n:Activity {id: row.id})" in query for query in queries)
+    assert any("MERGE (a)-[:hasParticipant_hasPatient]->(b)" in query for query in queries)
@@ -0,0 +1,81 @@
+# Tests of turning query records into paths: fanout caps, first-seen deduplication and path dictionaries
+
+import pytest
+
+from path_processing import (MISSING, make_path, path_to_dict, dict_to_path, remove_duplicates,
+                             iter_record_paths, iter_unique_paths)
+from path_queries import direct_queries
+
+QUERY = next(query for query in direct_queries if query["outfile"] == "state_patient_paths")
+CONNECT_OBJECTS = {"pump": [["motor"], ["engine", "motor"], ["a", "b", "c"]]}
+FAILURE_MODES = {2: "Leaking"}
+
+# Function to create a state_patient_paths record
+def make_record(object_name, state_name, object_entries, state_entries, substitute_objects=(), substitute_states=()):
+    return {"object_properties": {"text": object_name, "type": "PhysicalObject", "subtype0": "GeneratingObject",
+                                  "entry_id": list(object_entries)},
+            "state_properties": {"text": state_name, "type": "State", "subtype0": "UndesirableState",
+                                 "entry_id": list(state_entries)},
+            "substitute_objects": [{"text": text, "type": "PhysicalObject/GeneratingObject"} for text in substitute_objects],
+            "substitute_state": [{"text": text, "type": "State/UndesirableState"} for text in substitute_states]}
+
+# Function to list the paths of records as (object name, event name, alternate)
+def names(paths):
+    return [(path.object_name, path.event_name, path.alternate) for path in paths]
+
+PUMP = make_record("pump", "leaking", [1, 2], [2, 3], substitute_objects=["centrifugal pump", "motor pump"],
+                   substitute_states=["leak"])
+# Connect objects deeper than MAX_DEPTH (a b c pump) are skipped
+PUMP_PATHS = [("pump", "leaking", False), ("motor pump", "leaking", True), ("engine pump", "leaking", True),
+              ("motor engine pump", "leaking", True), ("centrifugal pump", "leaking", True),
+              ("motor pump", "leaking", True), ("pump", "leak", True)]
+
+def test_record_paths():
+    paths = list(iter_record_paths(QUERY, PUMP, lambda name: CONNECT_OBJECTS.get(name, []), FAILURE_MODES.get))
+    assert names(paths) == PUMP_PATHS
+    assert paths[0].failure_mode == "Leaking"
+    assert all(path.valid for path in paths)
+    assert all(path.failure_mode is MISSING for path in paths[1:])
+
+@pytest.mark.parametrize("max_fanout", [0, 1, 2, 5, 6, 7, None])
+def test_max_fanout_caps_alternates_of_a_record(max_fanout):
+    paths = list(iter_record_paths(QUERY, PUMP, lambda name: CONNECT_OBJECTS.get(name, []), FAILURE_MODES.get,
+                                   max_fanout=max_fanout))
+    num_alternates = len(PUMP_PATHS) - 1 if max_fanout is None else min(max_fanout, len(PUMP_PATHS) - 1)
+    # The path of the record itself is never capped, alternates are kept in expansion order
+    assert names(paths) == PUMP_PATHS[:1 + num_alternates]
+
+def test_max_fanout_is_per_record():
+    records = [PUMP, make_record("valve", "stuck", [4], [5], substitute_objects=["gate valve", "ball valve"])]
+    paths = list(iter_unique_paths(QUERY, records, lambda name: CONNECT_OBJECTS.get(name, []), FAILURE_MODES.get,
+                                   max_fanout=1))
+    assert names(paths) == PUMP_PATHS[:2] + [("valve", "stuck", False), ("gate valve", "stuck", True)]
+    assert [path.valid for path in paths] == [True, True, False, False]
+
+def test_unique_paths_keep_first_seen_order():
+    records = [PUMP, make_record("seal", "leaking", [2], [2], substitute_states=["leak"]),
+               PUMP, make_record("motor", "leaking", [], [])]
+    seen = set()
+    paths = list(iter_unique_paths(QUERY, records, lambda name: CONNECT_OBJECTS.get(name, []), FAILURE_MODES.get, seen=seen))
+    assert names(paths) == [("pump", "leaking", False), ("motor pump", "leaking", True), ("engine pump", "leaking", True),
+                            ("motor engine pump", "leaking", True), ("centrifugal pump", "leaking", True),
+                            ("pump", "leak", True), ("seal", "leaking", False), ("seal", "leak", True),
+                            ("motor", "leaking", False)]
+    assert seen == set(paths)
+
+    # Paths already seen (e.g. in an earlier batch) are skipped
+    assert list(iter_unique_paths(QUERY, records, lambda name: CONNECT_OBJECTS.get(name, []), FAILURE_MODES.get, seen=seen)) == []
+
+def test_path_to_dict():
+    labelled = make_path("pump", "PhysicalObject", "leaking", True, False, "Leaking")
+    unlabelled = make_path("pump", "PhysicalObject", "leaking", True, False)
+    assert path_to_dict(labelled) == {"object_name": "pump", "object_type": "PhysicalObject", "event_name": "leaking",
+                                      "valid": True, "alternate": False, "failure_mode": "Leaking"}
+    # Paths without a common entry have no failure_mode key, which is not the same as a None failure mode
+    assert "failure_mode" not in path_to_dict(unlabelled)
+    assert path_to_dict(make_path("pump", "PhysicalObject", "leaking", True, False, None))["failure_mode"] is None
+    for path in (labelled, unlabelled):
+        assert dict_to_path(path_to_dict(path)) == path
+    assert labelled != unlabelled
+    assert remove_duplicates([path_to_dict(p) for p in (unlabelled, labelled, unlabelled, labelled)]) == \
+           [path_to_dict(unlabelled), path_to_dict(labelled)]